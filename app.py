@@ -12,18 +12,30 @@ DS2API - DeepSeek to OpenAI API 转换服务
     Vercel: 自动部署
 """
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-
 from core.config import IS_VERCEL, logger
+from core.utils import ORJSONResponse
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：关闭时释放共享的 HTTP 客户端"""
+    yield
+    from core.deepseek import close_async_http_session
+    from routes.admin.vercel import close_vercel_client
+    await close_async_http_session()
+    await close_vercel_client()
+
 
 # 创建 FastAPI 应用
 app = FastAPI(
     title="DS2API",
     description="DeepSeek to OpenAI/Claude API",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 
@@ -31,17 +43,18 @@ app = FastAPI(
 @app.exception_handler(Exception)
 async def unhandled_exception_handler(request: Request, exc: Exception):
     logger.exception(f"[unhandled_exception] {request.method} {request.url.path}: {exc}")
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"error": {"type": "api_error", "message": "Internal Server Error"}},
     )
 
 
-# CORS 中间件
+# CORS 中间件（鉴权走 Authorization 头而非 cookie，不需要凭据模式；
+# 通配来源 + allow_credentials=False 时 Starlette 直接返回固定的 "*"，无需逐请求回显与匹配 Origin）
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
-    allow_credentials=True,
+    allow_credentials=False,
     allow_methods=["GET", "POST", "OPTIONS", "PUT", "DELETE"],
     allow_headers=["Content-Type", "Authorization"],
 )
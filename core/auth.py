@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*-
 """账号认证与管理模块 - 轮询(Round-Robin)策略"""
+import asyncio
+import functools
 import threading
+from collections import deque
 from fastapi import HTTPException, Request
 
+from . import config
 from .config import CONFIG, logger
 from .deepseek import login_deepseek_via_account, BASE_HEADERS
 from .utils import get_account_identifier
 
-# -------------------------- 全局账号队列 --------------------------
-# 使用列表实现轮询队列，配合线程锁保证并发安全
-account_queue = []  # 可用账号队列
+# -------------------------- 全局账号池 --------------------------
+# 空闲账号按 token 有无分成两个双端队列，元素为 (account_id, account)：
+# 选择时从左侧弹出、释放时追加到右侧，轮转为 O(1)，无需维护下标；
+# 双端队列与 in_use_accounts 均由 _queue_lock 保护
+_tokened = deque()  # 已有 token 的空闲账号
+_fresh = deque()  # 尚无 token 的空闲账号（选中后需登录）
+_account_ids = {}  # {id(account): account_id} 初始化时缓存，避免热路径重复计算标识
 in_use_accounts = {}  # 正在使用的账号 {account_id: account}
 _queue_lock = threading.Lock()  # 线程锁
 
@@ -18,13 +26,19 @@ claude_api_key_queue = []  # 维护所有可用的Claude API keys
 
 def init_account_queue():
     """初始化时从配置加载账号（不再随机排序，保持配置顺序）"""
-    global account_queue, in_use_accounts
+    global _tokened, _fresh, _account_ids, in_use_accounts
+    # 标识只在这里计算一次（不写入账号字典，避免污染 config.json）
+    tokened, fresh = deque(), deque()
+    account_ids = {}
+    for acc in CONFIG.get("accounts", []):
+        acc_id = get_account_identifier(acc)
+        account_ids[id(acc)] = acc_id
+        (tokened if acc.get("token", "").strip() else fresh).append((acc_id, acc))
     with _queue_lock:
-        account_queue = CONFIG.get("accounts", [])[:]  # 深拷贝
+        _tokened, _fresh = tokened, fresh
+        _account_ids = account_ids
         in_use_accounts = {}
-        # 按 token 有无排序：有 token 的账号优先
-        account_queue.sort(key=lambda a: 0 if a.get("token", "").strip() else 1)
-        logger.info(f"[init_account_queue] 初始化 {len(account_queue)} 个账号，轮询模式")
+    logger.info(f"[init_account_queue] 初始化 {len(tokened) + len(fresh)} 个账号，轮询模式")
 
 
 def init_claude_api_key_queue():
@@ -41,16 +55,23 @@ init_claude_api_key_queue()
 # get_account_identifier 已移至 core.utils
 
 
+def _account_id(account: dict) -> str:
+    """返回账号标识（优先使用初始化时缓存的结果）"""
+    acc_id = _account_ids.get(id(account))
+    return acc_id if acc_id is not None else get_account_identifier(account)
+
+
 def get_queue_status() -> dict:
     """获取账号队列状态（用于监控）"""
     with _queue_lock:
         # total 应该是配置中的账号总数，而非队列相加（避免状态不一致导致重复计数）
         total_accounts = len(CONFIG.get("accounts", []))
+        available = [acc_id for acc_id, _ in _tokened] + [acc_id for acc_id, _ in _fresh]
         return {
-            "available": len(account_queue),
+            "available": len(available),
             "in_use": len(in_use_accounts),
             "total": total_accounts,
-            "available_accounts": [get_account_identifier(a) for a in account_queue],
+            "available_accounts": available,
             "in_use_accounts": list(in_use_accounts.keys()),
         }
 
@@ -58,57 +79,57 @@ def get_queue_status() -> dict:
 # ----------------------------------------------------------------------
 # 账号选择与释放 - 轮询(Round-Robin)策略
 # ----------------------------------------------------------------------
+def _pop_available(dq: deque, exclude):
+    """从队列左侧取出第一个未被排除的账号，被排除的账号轮转到右侧（需持有 _queue_lock）"""
+    if not exclude:
+        # 首次选择没有排除项，直接弹出队首
+        return dq.popleft() if dq else None
+    for _ in range(len(dq)):
+        entry = dq.popleft()
+        if entry[0] and entry[0] not in exclude:
+            return entry
+        dq.append(entry)
+    return None
+
+
 def choose_new_account(exclude_ids=None):
     """轮询选择策略：
-    1. 使用线程锁保证并发安全
-    2. 优先选择队首的有 token 账号
-    3. 从队列头部取出账号（FIFO）
-    4. 请求完成后调用 release_account 将账号放回队尾
+    1. 优先从已有 token 的空闲队列左侧取账号
+    2. 没有可用的有 token 账号时，再从无 token 队列取账号（需要登录）
+    3. 被排除的账号直接轮转到队尾，不影响其他账号
+    4. 请求完成后调用 release_account 将账号放回对应队列的右侧
     """
-    if exclude_ids is None:
-        exclude_ids = []
+    exclude = set(exclude_ids) if exclude_ids else None
 
     with _queue_lock:
-        # 第一轮：优先选择已有 token 的账号
-        for i in range(len(account_queue)):
-            acc = account_queue[i]
-            acc_id = get_account_identifier(acc)
-            if acc_id and acc_id not in exclude_ids:
-                if acc.get("token", "").strip():  # 已有 token
-                    selected = account_queue.pop(i)
-                    in_use_accounts[acc_id] = selected
-                    logger.info(f"[choose_new_account] 轮询选择(有token): {acc_id} | 队列剩余: {len(account_queue)}")
-                    return selected
-
-        # 第二轮：选择任意账号（需要登录）
-        for i in range(len(account_queue)):
-            acc = account_queue[i]
-            acc_id = get_account_identifier(acc)
-            if acc_id and acc_id not in exclude_ids:
-                selected = account_queue.pop(i)
-                in_use_accounts[acc_id] = selected
-                logger.info(f"[choose_new_account] 轮询选择(需登录): {acc_id} | 队列剩余: {len(account_queue)}")
-                return selected
-
-        logger.warning(f"[choose_new_account] 没有可用账号 | 队列: {len(account_queue)}, 使用中: {len(in_use_accounts)}")
-        return None
+        for dq, label in ((_tokened, "有token"), (_fresh, "需登录")):
+            entry = _pop_available(dq, exclude)
+            if entry is not None:
+                acc_id, acc = entry
+                in_use_accounts[acc_id] = acc
+                logger.info("[choose_new_account] 轮询选择(%s): %s | 使用中: %d", label, acc_id, len(in_use_accounts))
+                return acc
+        available = len(_tokened) + len(_fresh)
+
+    logger.warning("[choose_new_account] 没有可用账号 | 空闲: %d, 使用中: %d", available, len(in_use_accounts))
+    return None
 
 
 def release_account(account: dict):
-    """将账号重新加入队列末尾（轮询核心：用完放队尾）"""
+    """将账号放回空闲队列右侧（按当前 token 状态归入对应队列，登录成功的账号由此晋升）"""
     if not account:
         return
     
-    acc_id = get_account_identifier(account)
+    acc_id = _account_id(account)
     with _queue_lock:
-        # 从使用中移除
-        if acc_id in in_use_accounts:
-            del in_use_accounts[acc_id]
-            # 放回队尾
-            account_queue.append(account)
-            logger.debug(f"[release_account] 释放账号: {acc_id} | 队列长度: {len(account_queue)}")
-        else:
-            logger.warning(f"[release_account] 账号 {acc_id} 不在使用列表中 (可能是因为重置了队列)，跳过释放")
+        released = in_use_accounts.pop(acc_id, None) is not None
+        if released:
+            dq = _tokened if account.get("token", "").strip() else _fresh
+            dq.append((acc_id, account))
+    if released:
+        logger.debug("[release_account] 释放账号: %s | 使用中: %d", acc_id, len(in_use_accounts))
+    else:
+        logger.warning("[release_account] 账号 %s 不在使用列表中 (可能是因为重置了队列)，跳过释放", acc_id)
 
 
 # ----------------------------------------------------------------------
@@ -127,22 +148,22 @@ def release_claude_api_key(api_key):
 # ----------------------------------------------------------------------
 # 判断调用模式：配置模式 vs 用户自带 token
 # ----------------------------------------------------------------------
-def determine_mode_and_token(request: Request):
+async def determine_mode_and_token(request: Request):
     """
     根据请求头 Authorization 判断使用哪种模式：
     - 如果 Bearer token 出现在 CONFIG["keys"] 中，则为配置模式，从 CONFIG["accounts"] 中随机选择一个账号（排除已尝试账号），
       检查该账号是否已有 token，否则调用登录接口获取；
     - 否则，直接使用请求中的 Bearer 值作为 DeepSeek token。
     结果存入 request.state.deepseek_token；配置模式下同时存入 request.state.account 与 request.state.tried_accounts。
+    登录是阻塞的 HTTPS 请求，放到线程池执行，避免阻塞事件循环。
     """
     auth_header = request.headers.get("Authorization", "")
     if not auth_header.startswith("Bearer "):
         raise HTTPException(
             status_code=401, detail="Unauthorized: missing Bearer token."
         )
-    caller_key = auth_header.replace("Bearer ", "", 1).strip()
-    config_keys = CONFIG.get("keys", [])
-    if caller_key in config_keys:
+    caller_key = auth_header[7:].strip()  # 去掉 "Bearer " 前缀
+    if caller_key in config.CONFIG_KEYS:
         request.state.use_config_token = True
         request.state.tried_accounts = []  # 初始化已尝试账号
         selected_account = choose_new_account()
@@ -153,10 +174,10 @@ def determine_mode_and_token(request: Request):
             )
         if not selected_account.get("token", "").strip():
             try:
-                login_deepseek_via_account(selected_account)
+                await asyncio.to_thread(login_deepseek_via_account, selected_account)
             except Exception as e:
                 logger.error(
-                    f"[determine_mode_and_token] 账号 {get_account_identifier(selected_account)} 登录失败：{e}"
+                    f"[determine_mode_and_token] 账号 {_account_id(selected_account)} 登录失败：{e}"
                 )
                 raise HTTPException(status_code=500, detail="Account login failed.")
 
@@ -168,9 +189,15 @@ def determine_mode_and_token(request: Request):
         request.state.deepseek_token = caller_key
 
 
+@functools.lru_cache(maxsize=256)
+def _auth_headers_for(token: str) -> dict:
+    """按 token 缓存带 authorization 的请求头（token 失效/刷新时整体清空）"""
+    return {**BASE_HEADERS, "authorization": f"Bearer {token}"}
+
+
 def get_auth_headers(request: Request) -> dict:
-    """返回 DeepSeek 请求所需的公共请求头"""
-    return {**BASE_HEADERS, "authorization": f"Bearer {request.state.deepseek_token}"}
+    """返回 DeepSeek 请求所需的公共请求头（共享缓存对象，调用方需复制后再修改）"""
+    return _auth_headers_for(request.state.deepseek_token)
 
 
 # determine_claude_mode_and_token 已移除（直接使用 determine_mode_and_token）
@@ -193,20 +220,22 @@ def refresh_account_token(request: Request) -> bool:
     if not account:
         return False
     
-    acc_id = get_account_identifier(account)
-    logger.info(f"[refresh_account_token] 尝试刷新账号 {acc_id} 的 token")
+    acc_id = _account_id(account)
+    logger.info("[refresh_account_token] 尝试刷新账号 %s 的 token", acc_id)
     
     try:
         # 清除旧 token
         account["token"] = ""
+        _auth_headers_for.cache_clear()
+        config.bump_config_version()
         # 重新登录
         login_deepseek_via_account(account)
         # 更新 request 状态
         request.state.deepseek_token = account.get("token")
-        logger.info(f"[refresh_account_token] 账号 {acc_id} token 刷新成功")
+        logger.info("[refresh_account_token] 账号 %s token 刷新成功", acc_id)
         return True
     except Exception as e:
-        logger.error(f"[refresh_account_token] 账号 {acc_id} token 刷新失败: {e}")
+        logger.error("[refresh_account_token] 账号 %s token 刷新失败: %s", acc_id, e)
         return False
 
 
@@ -217,7 +246,9 @@ def mark_token_invalid(request: Request):
     
     account = getattr(request.state, 'account', None)
     if account:
-        acc_id = get_account_identifier(account)
-        logger.warning(f"[mark_token_invalid] 标记账号 {acc_id} 的 token 为无效")
+        acc_id = _account_id(account)
+        logger.warning("[mark_token_invalid] 标记账号 %s 的 token 为无效", acc_id)
         account["token"] = ""
+        _auth_headers_for.cache_clear()
+        config.bump_config_version()
 
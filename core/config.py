@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 """配置管理模块"""
 import base64
-import json
+import functools
+import itertools
 import logging
 import os
 import sys
+import threading
 
-import transformers
+import orjson
 
 # -------------------------- 获取项目根目录 --------------------------
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -32,9 +34,23 @@ logger = logging.getLogger("ds2api")
 
 # -------------------------- 初始化 tokenizer --------------------------
 chat_tokenizer_dir = resolve_path("DS2API_TOKENIZER_DIR", "")
-tokenizer = transformers.AutoTokenizer.from_pretrained(
-    chat_tokenizer_dir, trust_remote_code=True
-)
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer():
+    """首次调用时才导入 transformers 并加载 tokenizer（transformers 导入很慢，避免拖慢冷启动）。
+
+    未安装 transformers 或加载失败时返回 None，调用方应退回估算方式。
+    """
+    try:
+        import transformers
+
+        return transformers.AutoTokenizer.from_pretrained(
+            chat_tokenizer_dir, trust_remote_code=True
+        )
+    except Exception as e:
+        logger.warning(f"[get_tokenizer] tokenizer 加载失败，使用估算方式: {e}")
+        return None
 
 # ----------------------------------------------------------------------
 # 配置文件的读写函数
@@ -53,36 +69,61 @@ def load_config() -> dict:
     raw_cfg = os.getenv("DS2API_CONFIG_JSON") or os.getenv("CONFIG_JSON")
     if raw_cfg:
         try:
-            return json.loads(raw_cfg)
-        except json.JSONDecodeError:
+            return orjson.loads(raw_cfg)
+        except orjson.JSONDecodeError:
             try:
                 decoded = base64.b64decode(raw_cfg).decode("utf-8")
-                return json.loads(decoded)
+                return orjson.loads(decoded)
             except Exception as e:
                 logger.warning(f"[load_config] 环境变量配置解析失败: {e}")
                 return {}
 
     try:
-        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(CONFIG_PATH, "rb") as f:
+            return orjson.loads(f.read())
     except Exception as e:
         logger.warning(f"[load_config] 无法读取配置文件({CONFIG_PATH}): {e}")
         return {}
 
 
+# 多个线程（如并发登录）可能同时回写配置，串行化写文件避免内容交错
+_save_lock = threading.Lock()
+
+# 配置版本号：CONFIG 每次修改后递增，供导出/同步判断是否需要重新序列化
+# （next() 在 GIL 下是原子操作，无需加锁）
+_version_counter = itertools.count(1)
+_config_version = 0
+
+
+def bump_config_version() -> None:
+    """标记 CONFIG 内容已变化（save_config 会自动调用）"""
+    global _config_version
+    _config_version = next(_version_counter)
+
+
+def config_version() -> int:
+    """返回当前配置版本号"""
+    return _config_version
+
+
 def save_config(cfg: dict) -> None:
     """将配置写回 config.json。
 
     Vercel 环境文件系统通常是只读的；且如果配置来自环境变量，也无法回写。
     所以这里失败不应影响主流程。
     """
+    # 无论能否写回文件，内存中的配置都已变化
+    bump_config_version()
     if os.getenv("DS2API_CONFIG_JSON") or os.getenv("CONFIG_JSON"):
         logger.info("[save_config] 配置来自环境变量，跳过写回")
         return
 
     try:
-        with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-            json.dump(cfg, f, ensure_ascii=False, indent=2)
+        # 先完成序列化再打开文件，序列化失败时不会截断已有配置
+        with _save_lock:
+            data = orjson.dumps(cfg, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            with open(CONFIG_PATH, "wb") as f:
+                f.write(data)
     except PermissionError as e:
         logger.warning(f"[save_config] 配置文件不可写({CONFIG_PATH}): {e}")
     except Exception as e:
@@ -96,6 +137,16 @@ if not CONFIG:
         "[config] 未加载到有效配置，请提供 config.json（路径可用 DS2API_CONFIG_PATH 指定）或设置环境变量 DS2API_CONFIG_JSON"
     )
 
+# API Key 集合（每个请求都要做成员判断，用 frozenset 代替列表线性查找）
+CONFIG_KEYS = frozenset(CONFIG.get("keys", []))
+
+
+def refresh_config_keys() -> None:
+    """CONFIG["keys"] 变更后重建 CONFIG_KEYS（使用方需通过模块属性读取）"""
+    global CONFIG_KEYS
+    CONFIG_KEYS = frozenset(CONFIG.get("keys", []))
+
+
 # WASM 模块文件路径
 WASM_PATH = resolve_path("DS2API_WASM_PATH", "sha3_wasm_bg.7b9ca65ddd.wasm")
 
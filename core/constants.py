@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 """常量定义模块 - 统一管理项目中的所有常量"""
+import re
 
 # ----------------------------------------------------------------------
 # 网络和超时配置
@@ -7,6 +8,11 @@
 KEEP_ALIVE_TIMEOUT = 5  # 保活超时（秒）
 STREAM_IDLE_TIMEOUT = 30  # 流无新内容超时（秒）
 MAX_KEEPALIVE_COUNT = 10  # 最大连续 keepalive 次数
+STREAM_COALESCE_WINDOW = 0.016  # 流式增量合并窗口（秒），积压时最多攒这么久再发
+STREAM_COALESCE_MAX_DELTAS = 8  # 流式增量合并时单帧最多包含的片段数
+COMPLETION_MAX_CLIENTS = 64  # 异步对话会话的最大并发 curl 句柄数（超出的请求排队等待）
+RESPONSE_CACHE_TTL = 120  # 响应缓存条目有效期（秒）
+RESPONSE_CACHE_MAXSIZE = 1024  # 响应缓存最大条目数
 
 # ----------------------------------------------------------------------
 # DeepSeek API 配置
@@ -35,9 +41,19 @@ BASE_HEADERS = {
 # ----------------------------------------------------------------------
 # SSE 解析配置
 # ----------------------------------------------------------------------
+# 上游 SSE 行按原始字节解析，前缀与结束标记保持为 bytes
+SSE_DATA_PREFIX = b"data:"
+SSE_DONE = b"[DONE]"
+# 发给下游的 SSE 注释行，仅用于保活
+SSE_KEEPALIVE = b": keep-alive\n\n"
+# 判定一个 "{" 是否开启工具调用 JSON 时最多扣住的字符数
+TOOL_PREFIX_DETECT_CHARS = 64
+
 # 跳过的路径模式（状态相关，不是内容）
 SKIP_PATTERNS = [
     "quasi_status", "elapsed_secs", "token_usage", 
     "pending_fragment", "conversation_mode",
     "fragments/-1/status", "fragments/-2/status", "fragments/-3/status"
 ]
+# 合并为一个预编译正则，每个 chunk 只扫描一次路径
+SKIP_PATTERN_RE = re.compile("|".join(map(re.escape, SKIP_PATTERNS)))
@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 """DeepSeek API 相关逻辑"""
+import asyncio
+import logging
+import random
 import time
-from curl_cffi import requests
+
+import orjson
+from curl_cffi import CurlHttpVersion, requests
 from fastapi import HTTPException
 
 from .config import CONFIG, save_config, logger
@@ -13,12 +18,50 @@ from .constants import (
     DEEPSEEK_CREATE_POW_URL,
     DEEPSEEK_COMPLETION_URL,
     BASE_HEADERS,
+    COMPLETION_MAX_CLIENTS,
 )
 
 
 # get_account_identifier 已移至 core.utils
 
 
+# 复用的 curl_cffi 会话（用于非流式请求）：Session 为每个线程维护各自的 curl 句柄，
+# 同一线程内的后续请求可复用已建立的连接与 TLS 会话；不保存服务端 cookie，避免不同账号串用。
+# 流式请求不走这里：Session 的流式请求会复制句柄（不继承连接），并且共用一个默认大小的线程池，
+# 长时间的对话流会互相排队。
+HTTP_SESSION = requests.Session(impersonate="safari15_3", discard_cookies=True)
+
+# 流式对话请求使用的异步会话：由 curl multi 句柄在事件循环上驱动，不占线程池；
+# 请求结束后句柄连同已建立的连接与 TLS 会话放回池中，下一次对话无需重新握手，
+# HTTP/2 下多个并发流可以复用同一条连接。会话绑定创建它的事件循环，因此在运行中的
+# 循环里按需创建，循环变化时重建；应用关闭时由 lifespan 调用 close_async_http_session。
+_async_http_session = None
+_async_http_session_loop = None
+
+
+def get_async_http_session() -> requests.AsyncSession:
+    """获取（首次调用时在当前事件循环上创建）共享的异步会话"""
+    global _async_http_session, _async_http_session_loop
+    loop = asyncio.get_running_loop()
+    if _async_http_session is None or _async_http_session_loop is not loop:
+        # 旧会话绑定的循环已不可用，无法再在其上关闭，直接丢弃
+        _async_http_session = requests.AsyncSession(
+            impersonate="safari15_3",
+            discard_cookies=True,
+            http_version=CurlHttpVersion.V2TLS,
+            max_clients=COMPLETION_MAX_CLIENTS,
+        )
+        _async_http_session_loop = loop
+    return _async_http_session
+
+
+async def close_async_http_session() -> None:
+    """关闭共享的异步会话"""
+    global _async_http_session, _async_http_session_loop
+    if _async_http_session is not None:
+        session, _async_http_session = _async_http_session, None
+        _async_http_session_loop = None
+        await session.close()
 
 
 # ----------------------------------------------------------------------
@@ -52,16 +95,16 @@ def login_deepseek_via_account(account: dict) -> str:
             "os": "android",
         }
     try:
-        resp = requests.post(
-            DEEPSEEK_LOGIN_URL, headers=BASE_HEADERS, json=payload, impersonate="safari15_3"
-        )
+        resp = HTTP_SESSION.post(DEEPSEEK_LOGIN_URL, headers=BASE_HEADERS, json=payload)
         resp.raise_for_status()
     except Exception as e:
         logger.error(f"[login_deepseek_via_account] 登录请求异常: {e}")
         raise HTTPException(status_code=500, detail="Account login failed: 请求异常")
     try:
-        logger.warning(f"[login_deepseek_via_account] {resp.text}")
-        data = resp.json()
+        body = resp.content
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[login_deepseek_via_account] {body.decode('utf-8', 'replace')}")
+        data = orjson.loads(body)
     except Exception as e:
         logger.error(f"[login_deepseek_via_account] JSON解析失败: {e}")
         raise HTTPException(
@@ -109,11 +152,22 @@ def login_deepseek_via_account(account: dict) -> str:
 # ----------------------------------------------------------------------
 # 封装对话接口调用的重试机制
 # ----------------------------------------------------------------------
+def _retry_delay(attempt: int) -> float:
+    """指数退避：0.1s、0.2s、0.4s……外加少量随机抖动，避免并发请求同时重试"""
+    return 0.1 * (2 ** attempt) + random.random() * 0.05
+
+
 def call_completion_endpoint(payload: dict, headers: dict, max_attempts: int = 3):
-    """调用 DeepSeek 对话接口，支持重试"""
-    attempts = 0
-    while attempts < max_attempts:
+    """调用 DeepSeek 对话接口，支持重试（阻塞调用，异步路由中应通过 asyncio.to_thread 调用）
+
+    网络异常、5xx 与 429 按指数退避重试；其他 4xx（如 401/403）重试无意义，直接返回 None。
+    """
+    for attempt in range(max_attempts):
+        if attempt:
+            time.sleep(_retry_delay(attempt - 1))
         try:
+            # 流式请求刻意不使用 HTTP_SESSION：curl_cffi 会为流式请求复制句柄（不继承已有连接），
+            # 且同一 Session 的所有流共用一个默认大小的线程池，并发对话会互相排队
             deepseek_resp = requests.post(
                 DEEPSEEK_COMPLETION_URL,
                 headers=headers,
@@ -122,17 +176,41 @@ def call_completion_endpoint(payload: dict, headers: dict, max_attempts: int = 3
                 impersonate="safari15_3",
             )
         except Exception as e:
-            logger.warning(f"[call_completion_endpoint] 请求异常: {e}")
-            time.sleep(1)
-            attempts += 1
+            logger.warning("[call_completion_endpoint] 请求异常: %s", e)
             continue
-        if deepseek_resp.status_code == 200:
+        status = deepseek_resp.status_code
+        if status == 200:
             return deepseek_resp
-        else:
-            logger.warning(
-                f"[call_completion_endpoint] 调用对话接口失败, 状态码: {deepseek_resp.status_code}"
+        logger.warning("[call_completion_endpoint] 调用对话接口失败, 状态码: %d", status)
+        deepseek_resp.close()
+        if 400 <= status < 500 and status != 429:
+            break
+    return None
+
+
+async def acall_completion_endpoint(payload: dict, headers: dict, max_attempts: int = 3):
+    """call_completion_endpoint 的异步版本：通过共享的异步会话复用连接
+
+    返回的流式响应需用 aiter_content() 读取、aclose() 关闭；重试策略与同步版本一致。
+    """
+    for attempt in range(max_attempts):
+        if attempt:
+            await asyncio.sleep(_retry_delay(attempt - 1))
+        try:
+            deepseek_resp = await get_async_http_session().post(
+                DEEPSEEK_COMPLETION_URL,
+                headers=headers,
+                json=payload,
+                stream=True,
             )
-            deepseek_resp.close()
-            time.sleep(1)
-            attempts += 1
+        except Exception as e:
+            logger.warning("[acall_completion_endpoint] 请求异常: %s", e)
+            continue
+        status = deepseek_resp.status_code
+        if status == 200:
+            return deepseek_resp
+        logger.warning("[acall_completion_endpoint] 调用对话接口失败, 状态码: %d", status)
+        await deepseek_resp.aclose()
+        if 400 <= status < 500 and status != 429:
+            break
     return None
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 """消息处理模块"""
+import functools
 import re
 
+import orjson
+
 from .config import CONFIG, logger
 
 # Claude 默认模型
@@ -10,58 +13,159 @@ CLAUDE_DEFAULT_MODEL = "claude-sonnet-4-20250514"
 # 预编译正则表达式（性能优化）
 _MARKDOWN_IMAGE_PATTERN = re.compile(r"!\[(.*?)\]\((.*?)\)")
 
+# 角色标签常量（拼接时直接追加片段，避免每个消息块都格式化一次 f-string）
+_ASSIST_PREFIX = "<｜Assistant｜>"
+_ASSIST_SUFFIX = "<｜end▁of▁sentence｜>"
+_USER_PREFIX = "<｜User｜>"
+
+# 命中任一关键字的 Claude 模型映射到 slow 模型
+_SLOW_MODEL_KEYWORDS = ("opus", "reasoner", "slow")
+
 
 # ----------------------------------------------------------------------
 # 消息预处理函数，将多轮对话合并成最终 prompt
 # ----------------------------------------------------------------------
-def messages_prepare(messages: list) -> str:
+def _extract_text(content: object) -> str:
+    """提取消息内容文本：字符串直接返回，数组仅拼接 type 为 "text" 的部分"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(
+            [item.get("text", "") for item in content if item.get("type") == "text"]
+        )
+    return str(content)
+
+
+def _emit_block(parts: list[str], role: str, texts: list[str]) -> None:
+    """将一个合并后的同角色消息块加上角色标签追加到 parts"""
+    text = "\n\n".join(texts)
+    if role == "assistant":
+        parts.extend((_ASSIST_PREFIX, text, _ASSIST_SUFFIX))
+    elif role in ("user", "system") and parts:
+        # 第一个块不加 <｜User｜> 前缀
+        parts.extend((_USER_PREFIX, text))
+    else:
+        parts.append(text)
+
+
+def messages_prepare(messages: list[dict]) -> str:
     """处理消息列表，合并连续相同角色的消息，并添加角色标签：
     - 对于 assistant 消息，加上 <｜Assistant｜> 前缀及 <｜end▁of▁sentence｜> 结束标签；
     - 对于 user/system 消息（除第一条外）加上 <｜User｜> 前缀；
     - 如果消息 content 为数组，则提取其中 type 为 "text" 的部分；
     - 最后移除 markdown 图片格式的内容。
+    单次遍历：同角色消息先累积在 block_texts 中，角色切换时直接输出带标签的片段。
     """
-    processed = []
+    parts: list[str] = []
+    block_role = None
+    block_texts: list[str] = []
     for m in messages:
         role = m.get("role", "")
-        content = m.get("content", "")
-        if isinstance(content, list):
-            texts = [
-                item.get("text", "") for item in content if item.get("type") == "text"
-            ]
-            text = "\n".join(texts)
-        else:
-            text = str(content)
-        processed.append({"role": role, "text": text})
-    if not processed:
+        text = _extract_text(m.get("content", ""))
+        # 合并连续同一角色的消息
+        if block_texts and role == block_role:
+            block_texts.append(text)
+            continue
+        if block_texts:
+            _emit_block(parts, block_role, block_texts)
+        block_role = role
+        block_texts = [text]
+    if not block_texts:
         return ""
-    # 合并连续同一角色的消息
-    merged = [processed[0]]
-    for msg in processed[1:]:
-        if msg["role"] == merged[-1]["role"]:
-            merged[-1]["text"] += "\n\n" + msg["text"]
-        else:
-            merged.append(msg)
-    # 添加标签
-    parts = []
-    for idx, block in enumerate(merged):
-        role = block["role"]
-        text = block["text"]
-        if role == "assistant":
-            parts.append(f"<｜Assistant｜>{text}<｜end▁of▁sentence｜>")
-        elif role in ("user", "system"):
-            if idx > 0:
-                parts.append(f"<｜User｜>{text}")
-            else:
-                parts.append(text)
-        else:
-            parts.append(text)
+    _emit_block(parts, block_role, block_texts)
     final_prompt = "".join(parts)
-    # 仅移除 markdown 图片格式(不全部移除 !）- 使用预编译的正则表达式
-    final_prompt = _MARKDOWN_IMAGE_PATTERN.sub(r"[\1](\2)", final_prompt)
+    # 仅移除 markdown 图片格式(不全部移除 !）- 不含 "![" 时跳过正则扫描
+    if "![" in final_prompt:
+        final_prompt = _MARKDOWN_IMAGE_PATTERN.sub(r"[\1](\2)", final_prompt)
     return final_prompt
 
 
+# ----------------------------------------------------------------------
+# Claude 工具调用指导
+# ----------------------------------------------------------------------
+_TOOL_PROMPT_HEADER = "You are Claude, a helpful AI assistant. You have access to these tools:\n\n"
+_TOOL_PROMPT_FOOTER = """
+
+When you need to use tools, you can call multiple tools in a single response. Use this format:
+
+{"tool_calls": [
+  {"name": "tool1", "input": {"param": "value"}},
+  {"name": "tool2", "input": {"param": "value"}}
+]}
+
+IMPORTANT: You can call multiple tools in ONE response.
+
+Remember: Output ONLY the JSON, no other text. The response must start with { and end with ]}"""
+
+
+@functools.lru_cache(maxsize=256)
+def build_tool_system_message(tools_json: bytes) -> dict:
+    """根据工具定义构建工具使用指导的 system 消息
+
+    参数为 tools 列表的 orjson 序列化结果：Agent 类客户端每轮都带同一组工具，
+    按序列化字节缓存即可复用整段提示词。返回值被缓存共享，调用方需先复制再修改。
+    """
+    # 整段提示词按顺序追加到同一个列表，最后只 join 一次
+    parts = [_TOOL_PROMPT_HEADER]
+    add = parts.append
+    for index, tool in enumerate(orjson.loads(tools_json)):
+        if index:
+            add("\n")
+        add(f"Tool: {tool.get('name', 'unknown')}\nDescription: {tool.get('description', 'No description available')}")
+        schema = tool.get("input_schema", {})
+        properties = schema.get("properties")
+        if properties:
+            required = schema.get("required", [])
+            add("\nParameters:")
+            for prop_name, prop_info in properties.items():
+                is_req = " (required)" if prop_name in required else ""
+                add(f"\n  - {prop_name}: {prop_info.get('type', 'string')}{is_req}")
+    add(_TOOL_PROMPT_FOOTER)
+
+    return {"role": "system", "content": "".join(parts)}
+
+
+# ----------------------------------------------------------------------
+# OpenAI 工具调用指导
+# ----------------------------------------------------------------------
+_OPENAI_TOOL_PROMPT_HEADER = "You have access to these tools:\n\n"
+_OPENAI_TOOL_PROMPT_FOOTER = """
+
+When you need to use tools, output ONLY this JSON format (no other text):
+{"tool_calls": [
+  {"name": "tool_name", "input": {"param": "value"}}
+]}
+
+IMPORTANT: If calling tools, output ONLY the JSON. The response must start with { and end with }"""
+
+
+@functools.lru_cache(maxsize=256)
+def build_openai_tool_prompt(tools_json: bytes) -> str:
+    """根据 OpenAI 格式的工具定义构建工具使用指导提示词
+
+    参数为 tools 列表的 orjson 序列化结果，同一组工具直接复用缓存的提示词。
+    """
+    parts = [_OPENAI_TOOL_PROMPT_HEADER]
+    add = parts.append
+    for index, tool in enumerate(orjson.loads(tools_json)):
+        if index:
+            add("\n")
+        # OpenAI 格式: {"type": "function", "function": {...}}，兼容直接给出函数定义的简化格式
+        func = tool.get("function", tool)
+        add(f"Tool: {func.get('name', 'unknown')}\nDescription: {func.get('description', 'No description available')}")
+        schema = func.get("parameters", {})
+        properties = schema.get("properties")
+        if properties:
+            required = schema.get("required", [])
+            add("\nParameters:")
+            for prop_name, prop_info in properties.items():
+                is_req = " (required)" if prop_name in required else ""
+                add(f"\n  - {prop_name}: {prop_info.get('type', 'string')}{is_req}")
+    add(_OPENAI_TOOL_PROMPT_FOOTER)
+
+    return "".join(parts)
+
+
 # ----------------------------------------------------------------------
 # OpenAI到Claude格式转换函数
 # ----------------------------------------------------------------------
@@ -76,21 +180,19 @@ def convert_claude_to_deepseek(claude_request: dict) -> dict:
     )
 
     # Claude模型映射到DeepSeek模型 - 基于配置和模型特征判断
-    if (
-        "opus" in model.lower()
-        or "reasoner" in model.lower()
-        or "slow" in model.lower()
-    ):
+    model_lower = model.lower()
+    if any(k in model_lower for k in _SLOW_MODEL_KEYWORDS):
         deepseek_model = claude_mapping.get("slow", "deepseek-chat")
     else:
         deepseek_model = claude_mapping.get("fast", "deepseek-chat")
 
-    deepseek_request = {"model": deepseek_model, "messages": messages.copy()}
-
-    # 处理system消息 - 将system参数转换为system role消息
+    # 处理system消息 - 将system参数转换为system role消息（一次构建新列表，不做 insert(0)）；
+    # 无 system 时直接复用原列表，下游只读取不修改
     if "system" in claude_request:
         system_msg = {"role": "system", "content": claude_request["system"]}
-        deepseek_request["messages"].insert(0, system_msg)
+        messages = [system_msg, *messages]
+
+    deepseek_request = {"model": deepseek_model, "messages": messages}
 
     # 添加可选参数
     if "temperature" in claude_request:
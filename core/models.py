@@ -56,35 +56,40 @@ CLAUDE_MODELS = [
 ]
 
 
-def get_model_config(model: str) -> tuple[bool, bool]:
+# 模型名称（小写） -> (thinking_enabled, search_enabled)
+_MODEL_CONFIG = {
+    "deepseek-chat": (False, False),
+    "deepseek-reasoner": (True, False),
+    "deepseek-chat-search": (False, True),
+    "deepseek-reasoner-search": (True, True),
+}
+# 不区分模型、只需一组可用开关的调用方（Claude 映射、账号测试）使用的默认配置
+DEFAULT_MODEL_CONFIG = (False, False)
+_UNSUPPORTED_MODEL_CONFIG = (None, None)
+
+# 模型列表响应内容固定，模块加载时构建一次
+_OPENAI_MODELS_RESPONSE = {"object": "list", "data": DEEPSEEK_MODELS}
+_CLAUDE_MODELS_RESPONSE = {"object": "list", "data": CLAUDE_MODELS}
+
+
+def get_model_config(model: str, default: tuple = _UNSUPPORTED_MODEL_CONFIG) -> tuple[bool, bool]:
     """根据模型名称获取配置
     
     Args:
         model: 模型名称
+        default: 不支持的模型返回的配置，默认 (None, None)
         
     Returns:
         (thinking_enabled, search_enabled) 元组
     """
-    model_lower = model.lower()
-    
-    if model_lower == "deepseek-chat":
-        return False, False
-    elif model_lower == "deepseek-reasoner":
-        return True, False
-    elif model_lower == "deepseek-chat-search":
-        return False, True
-    elif model_lower == "deepseek-reasoner-search":
-        return True, True
-    else:
-        return None, None  # 不支持的模型
+    return _MODEL_CONFIG.get(model.lower(), default)
 
 
 def get_openai_models_response() -> dict:
-    """获取 OpenAI 格式的模型列表响应"""
-    return {"object": "list", "data": DEEPSEEK_MODELS}
+    """获取 OpenAI 格式的模型列表响应（共享对象，调用方不应修改）"""
+    return _OPENAI_MODELS_RESPONSE
 
 
 def get_claude_models_response() -> dict:
-    """获取 Claude 格式的模型列表响应"""
-    return {"object": "list", "data": CLAUDE_MODELS}
-
+    """获取 Claude 格式的模型列表响应（共享对象，调用方不应修改）"""
+    return _CLAUDE_MODELS_RESPONSE
@@ -2,13 +2,13 @@
 """PoW (Proof of Work) 计算模块"""
 import base64
 import ctypes
-import json
+import os
 import struct
 import threading
 import time
 
-from curl_cffi import requests
-from wasmtime import Engine, Linker, Module, Store
+import orjson
+from wasmtime import Config, Engine, Linker, Module, Store
 
 from .config import CONFIG, WASM_PATH, logger
 from .utils import get_account_identifier
@@ -21,6 +21,36 @@ _wasm_engine = None
 _wasm_module = None
 
 
+def _load_wasm_module(engine: Engine, wasm_path: str) -> Module:
+    """加载 WASM 模块：优先反序列化旁边的 .cwasm 预编译产物（跳过 Cranelift 编译），
+    不存在、过期或与当前 wasmtime 版本不兼容时重新编译，并尽量写回 .cwasm 供下次启动使用。
+    """
+    cwasm_path = wasm_path + ".cwasm"
+    try:
+        if os.path.getmtime(cwasm_path) >= os.path.getmtime(wasm_path):
+            module = Module.deserialize_file(engine, cwasm_path)
+            logger.info(f"[WASM] 已加载预编译模块: {cwasm_path}")
+            return module
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"[WASM] 预编译模块不可用，重新编译: {e}")
+
+    with open(wasm_path, "rb") as f:
+        wasm_bytes = f.read()
+    module = Module(engine, wasm_bytes)
+    try:
+        # 先写临时文件再替换，避免并发启动的进程读到半个文件
+        tmp_path = f"{cwasm_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(module.serialize())
+        os.replace(tmp_path, cwasm_path)
+    except OSError as e:
+        # Vercel 等只读文件系统上无法写回，不影响使用
+        logger.info(f"[WASM] 无法写入预编译模块（将每次启动时编译）: {e}")
+    return module
+
+
 def _get_cached_wasm_module(wasm_path: str):
     """获取缓存的 WASM 模块，首次调用时加载"""
     global _wasm_engine, _wasm_module
@@ -34,10 +64,11 @@ def _get_cached_wasm_module(wasm_path: str):
             return _wasm_engine, _wasm_module
         
         try:
-            with open(wasm_path, "rb") as f:
-                wasm_bytes = f.read()
-            _wasm_engine = Engine()
-            _wasm_module = Module(_wasm_engine, wasm_bytes)
+            config = Config()
+            config.cranelift_opt_level = "speed"
+            engine = Engine(config)
+            _wasm_module = _load_wasm_module(engine, wasm_path)
+            _wasm_engine = engine
             logger.info(f"[WASM] 已缓存 WASM 模块: {wasm_path}")
         except Exception as e:
             logger.error(f"[WASM] 加载 WASM 模块失败: {e}")
@@ -55,6 +86,41 @@ except Exception as e:
 # get_account_identifier 已移至 core.utils
 
 
+# ----------------------------------------------------------------------
+# 线程本地的 WASM 实例缓存
+# ----------------------------------------------------------------------
+# Store 不是线程安全的，因此每个线程各自持有一个实例并在多次求解之间复用，
+# 省去每次请求的 Store/Linker 创建、实例化与导出函数查找。
+# wasm_solve 会释放传入的字符串内存，栈指针在每次求解后恢复，实例可安全复用。
+_pow_local = threading.local()
+
+# wasm_solve 写回 retptr 的结果布局：4 字节状态 + 4 字节填充 + 8 字节 f64 求解结果
+_SOLVE_RESULT = struct.Struct("<i4xd")
+
+
+def _get_thread_instance(engine, module):
+    """获取当前线程的 WASM 实例：(module, store, memory, add_to_stack, alloc, wasm_solve)"""
+    inst = getattr(_pow_local, "instance", None)
+    if inst is not None and inst[0] is module:
+        return inst
+
+    store = Store(engine)
+    exports = Linker(engine).instantiate(store, module).exports(store)
+    try:
+        inst = (
+            module,
+            store,
+            exports["memory"],
+            exports["__wbindgen_add_to_stack_pointer"],
+            exports["__wbindgen_export_0"],
+            exports["wasm_solve"],
+        )
+    except KeyError as e:
+        raise RuntimeError(f"缺少 wasm 导出函数: {e}")
+    _pow_local.instance = inst
+    return inst
+
+
 # ----------------------------------------------------------------------
 # 使用 WASM 模块计算 PoW 答案的辅助函数
 # ----------------------------------------------------------------------
@@ -76,7 +142,9 @@ def compute_pow_answer(
       - 从 wasm 内存中读取状态与求解结果，
       - 若状态非 0，则返回整数形式的答案，否则返回 None。
     
-    优化：使用缓存的 WASM 模块，避免每次请求都重新加载文件。
+    优化：使用缓存的 WASM 模块，避免每次请求都重新加载文件；实例按线程复用。
+    注：DeepSeekHashV1 基于 Keccak（sha3），并非 SHA-256，SHA-NI 等硬件指令无法加速；
+    wasm_solve 也不接受起始 nonce，无法拆分到多线程并行搜索，因此求解仍在 WASM 中完成。
     """
     if algorithm != "DeepSeekHashV1":
         raise ValueError(f"不支持的算法：{algorithm}")
@@ -86,70 +154,135 @@ def compute_pow_answer(
     # 获取缓存的 WASM 模块（避免重复加载文件）
     engine, module = _get_cached_wasm_module(wasm_path)
     
-    # 每次调用创建新的 Store 和实例（必须的，因为 Store 不是线程安全的）
-    store = Store(engine)
-    linker = Linker(engine)
-    instance = linker.instantiate(store, module)
-    exports = instance.exports(store)
-    
+    # 复用当前线程的实例（Store 不是线程安全的，不能跨线程共享）
+    _, store, memory, add_to_stack, alloc, wasm_solve = _get_thread_instance(engine, module)
     try:
-        memory = exports["memory"]
-        add_to_stack = exports["__wbindgen_add_to_stack_pointer"]
-        alloc = exports["__wbindgen_export_0"]
-        wasm_solve = exports["wasm_solve"]
-    except KeyError as e:
-        raise RuntimeError(f"缺少 wasm 导出函数: {e}")
+        return _solve(store, memory, add_to_stack, alloc, wasm_solve, challenge_str, prefix, difficulty)
+    except Exception:
+        # 求解中途出错（如 wasm trap）时实例内部状态不可信，丢弃后下次重建
+        _pow_local.instance = None
+        raise
 
-    def write_memory(offset: int, data: bytes):
-        size = len(data)
-        base_addr = ctypes.cast(memory.data_ptr(store), ctypes.c_void_p).value
-        ctypes.memmove(base_addr + offset, data, size)
 
-    def read_memory(offset: int, size: int) -> bytes:
-        base_addr = ctypes.cast(memory.data_ptr(store), ctypes.c_void_p).value
-        return ctypes.string_at(base_addr + offset, size)
+def _memory_base(store, memory) -> int:
+    """线性内存基址；alloc / wasm_solve 都可能使内存扩容并改变基址，每次访问前重新获取"""
+    return ctypes.cast(memory.data_ptr(store), ctypes.c_void_p).value
 
-    def encode_string(text: str):
-        data = text.encode("utf-8")
-        length = len(data)
-        ptr_val = alloc(store, length, 1)
-        ptr = int(ptr_val.value) if hasattr(ptr_val, "value") else int(ptr_val)
-        write_memory(ptr, data)
-        return ptr, length
 
+def _write_string(store, memory, alloc, text: str):
+    """在 wasm 内存中分配并写入 UTF-8 字符串，返回 (ptr, length)"""
+    data = text.encode("utf-8")
+    length = len(data)
+    # i32 导出函数的返回值即 Python int
+    ptr = alloc(store, length, 1)
+    ctypes.memmove(_memory_base(store, memory) + ptr, data, length)
+    return ptr, length
+
+
+def _solve(store, memory, add_to_stack, alloc, wasm_solve, challenge_str: str, prefix: str, difficulty: int):
+    """在给定实例上执行一次 wasm_solve，返回答案或 None"""
     # 1. 申请 16 字节栈空间
     retptr = add_to_stack(store, -16)
-    # 2. 编码 challenge 与 prefix 到 wasm 内存中
-    ptr_challenge, len_challenge = encode_string(challenge_str)
-    ptr_prefix, len_prefix = encode_string(prefix)
-    # 3. 调用 wasm_solve（注意：difficulty 以 float 形式传入）
-    wasm_solve(
-        store,
-        retptr,
-        ptr_challenge,
-        len_challenge,
-        ptr_prefix,
-        len_prefix,
-        float(difficulty),
-    )
-    # 4. 从 retptr 处读取 4 字节状态和 8 字节求解结果
-    status_bytes = read_memory(retptr, 4)
-    if len(status_bytes) != 4:
-        add_to_stack(store, 16)
-        raise RuntimeError("读取状态字节失败")
-    status = struct.unpack("<i", status_bytes)[0]
-    value_bytes = read_memory(retptr + 8, 8)
-    if len(value_bytes) != 8:
+    try:
+        # 2. 编码 challenge 与 prefix 到 wasm 内存中
+        ptr_challenge, len_challenge = _write_string(store, memory, alloc, challenge_str)
+        ptr_prefix, len_prefix = _write_string(store, memory, alloc, prefix)
+        # 3. 调用 wasm_solve（注意：difficulty 以 float 形式传入）
+        wasm_solve(
+            store,
+            retptr,
+            ptr_challenge,
+            len_challenge,
+            ptr_prefix,
+            len_prefix,
+            float(difficulty),
+        )
+        # 4. 从 retptr 处直接读取 4 字节状态（+4 字节填充）和 8 字节求解结果（零拷贝视图）
+        result_view = (ctypes.c_ubyte * _SOLVE_RESULT.size).from_address(_memory_base(store, memory) + retptr)
+        status, value = _SOLVE_RESULT.unpack_from(result_view)
+    finally:
+        # 5. 恢复栈指针
         add_to_stack(store, 16)
-        raise RuntimeError("读取结果字节失败")
-    value = struct.unpack("<d", value_bytes)[0]
-    # 5. 恢复栈指针
-    add_to_stack(store, 16)
     if status == 0:
         return None
     return int(value)
 
 
+def encode_pow_response(challenge: dict, answer: int) -> str:
+    """将 challenge 与答案编码为 x-ds-pow-response 请求头的值"""
+    pow_dict = {
+        "algorithm": challenge["algorithm"],
+        "challenge": challenge["challenge"],
+        "salt": challenge["salt"],
+        "answer": answer,
+        "signature": challenge["signature"],
+        "target_path": challenge["target_path"],
+    }
+    # orjson 输出即紧凑格式的 UTF-8 字节，可直接 base64 编码；
+    # 实测比手工拼接 JSON 模板（encode_basestring_ascii）更快，因此保留 dict + orjson
+    return base64.b64encode(orjson.dumps(pow_dict)).decode("ascii")
+
+
+def _solve_challenge(challenge: dict, caller: str):
+    """求解 PoW challenge 并编码为 x-ds-pow-response 请求头，失败返回 None"""
+    try:
+        answer = compute_pow_answer(
+            challenge["algorithm"],
+            challenge["challenge"],
+            challenge["salt"],
+            challenge.get("difficulty", 144000),
+            challenge.get("expire_at", 1680000000),
+            challenge["signature"],
+            challenge["target_path"],
+            WASM_PATH,
+        )
+    except Exception as e:
+        logger.error(f"[{caller}] PoW 答案计算异常: {e}")
+        return None
+    if answer is None:
+        return None
+    return encode_pow_response(challenge, answer)
+
+
+def fetch_pow_response(headers: dict):
+    """用给定请求头获取并求解一次 PoW，不重试、不切换账号
+
+    不读写 request.state，可与 create_session 在不同线程并发执行。
+    
+    Returns:
+        Base64 编码的 PoW 响应，如果失败返回 None
+    """
+    from .deepseek import HTTP_SESSION, DEEPSEEK_CREATE_POW_URL
+
+    try:
+        resp = HTTP_SESSION.post(
+            DEEPSEEK_CREATE_POW_URL,
+            headers=headers,
+            json={"target_path": "/api/v0/chat/completion"},
+            timeout=30,
+        )
+    except Exception as e:
+        logger.warning(f"[fetch_pow_response] 请求异常: {e}")
+        return None
+    if resp.status_code != 200:
+        logger.warning(f"[fetch_pow_response] HTTP {resp.status_code}")
+        resp.close()
+        return None
+    try:
+        data = resp.json()
+    except Exception as e:
+        logger.warning(f"[fetch_pow_response] JSON解析异常: {e}")
+        data = {}
+    finally:
+        resp.close()
+    if data.get("code") != 0:
+        logger.warning(
+            f"[fetch_pow_response] 获取 PoW 失败, code={data.get('code')}, msg={data.get('msg')}"
+        )
+        return None
+    return _solve_challenge(data["data"]["biz_data"]["challenge"], "fetch_pow_response")
+
+
 def get_pow_response(request, max_attempts: int = 3):
     """获取 PoW 响应
     
@@ -161,64 +294,50 @@ def get_pow_response(request, max_attempts: int = 3):
         Base64 编码的 PoW 响应，如果失败返回 None
     """
     from .auth import get_auth_headers, choose_new_account
-    from .deepseek import BASE_HEADERS, login_deepseek_via_account, DEEPSEEK_CREATE_POW_URL
+    from .deepseek import HTTP_SESSION, login_deepseek_via_account, DEEPSEEK_CREATE_POW_URL
     
     pow_url = DEEPSEEK_CREATE_POW_URL
     
     attempts = 0
+    # 只有切换账号后 token 才会变化，请求头按 token 复用，无需每轮重建
+    headers = None
+    headers_token = None
     while attempts < max_attempts:
-        headers = get_auth_headers(request)
+        token = request.state.deepseek_token
+        if headers is None or token != headers_token:
+            headers = get_auth_headers(request)
+            headers_token = token
         try:
-            resp = requests.post(
+            # 复用共享会话，重试与后续请求无需重新建立 TLS 连接
+            resp = HTTP_SESSION.post(
                 pow_url,
                 headers=headers,
                 json={"target_path": "/api/v0/chat/completion"},
                 timeout=30,
-                impersonate="safari15_3",
             )
         except Exception as e:
             logger.error(f"[get_pow_response] 请求异常: {e}")
             attempts += 1
             continue
-        try:
-            data = resp.json()
-        except Exception as e:
-            logger.error(f"[get_pow_response] JSON解析异常: {e}")
-            data = {}
-        if resp.status_code == 200 and data.get("code") == 0:
-            challenge = data["data"]["biz_data"]["challenge"]
-            difficulty = challenge.get("difficulty", 144000)
-            expire_at = challenge.get("expire_at", 1680000000)
+        if resp.status_code == 200:
             try:
-                answer = compute_pow_answer(
-                    challenge["algorithm"],
-                    challenge["challenge"],
-                    challenge["salt"],
-                    difficulty,
-                    expire_at,
-                    challenge["signature"],
-                    challenge["target_path"],
-                    WASM_PATH,
-                )
+                data = resp.json()
             except Exception as e:
-                logger.error(f"[get_pow_response] PoW 答案计算异常: {e}")
-                answer = None
-            if answer is None:
+                logger.error(f"[get_pow_response] JSON解析异常: {e}")
+                data = {}
+        else:
+            # 非 200 响应不解析 JSON，只截取开头用于日志
+            data = {}
+            logger.warning(
+                f"[get_pow_response] HTTP {resp.status_code}, body={resp.content[:256].decode('utf-8', 'replace')}"
+            )
+        if resp.status_code == 200 and data.get("code") == 0:
+            resp.close()
+            encoded = _solve_challenge(data["data"]["biz_data"]["challenge"], "get_pow_response")
+            if encoded is None:
                 logger.warning("[get_pow_response] PoW 答案计算失败，重试中...")
-                resp.close()
                 attempts += 1
                 continue
-            pow_dict = {
-                "algorithm": challenge["algorithm"],
-                "challenge": challenge["challenge"],
-                "salt": challenge["salt"],
-                "answer": answer,
-                "signature": challenge["signature"],
-                "target_path": challenge["target_path"],
-            }
-            pow_str = json.dumps(pow_dict, separators=(",", ":"), ensure_ascii=False)
-            encoded = base64.b64encode(pow_str.encode("utf-8")).decode("utf-8").rstrip()
-            resp.close()
             return encoded
         else:
             code = data.get("code")
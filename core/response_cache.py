@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""响应缓存模块 - 进程内的短时 TTL 缓存，复用相同请求的上游输出"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+import orjson
+
+from .constants import RESPONSE_CACHE_MAXSIZE, RESPONSE_CACHE_TTL
+
+
+class TTLCache:
+    """按插入顺序淘汰的定长 TTL 缓存（线程安全）
+
+    过期条目在读取时惰性删除；超出容量时淘汰最早写入的条目。
+    """
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_MAXSIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+RESPONSE_CACHE = TTLCache()
+
+
+def response_cache_key(*parts: Any) -> bytes:
+    """对请求内容取摘要作为缓存键（键排序，字段顺序不同的相同请求命中同一条目）"""
+    return hashlib.blake2b(orjson.dumps(parts, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """会话管理模块 - 封装公共的会话创建和 PoW 获取逻辑"""
-from curl_cffi import requests as cffi_requests
+import asyncio
+
 from fastapi import HTTPException, Request
 
 from .config import logger
@@ -15,10 +16,11 @@ from .auth import (
 from .deepseek import (
     DEEPSEEK_CREATE_SESSION_URL,
     DEEPSEEK_CREATE_POW_URL,
+    HTTP_SESSION,
     login_deepseek_via_account,
     call_completion_endpoint,
 )
-from .pow import get_pow_response
+from .pow import fetch_pow_response, get_pow_response
 
 
 def create_session(request: Request, max_attempts: int = 3) -> str | None:
@@ -37,30 +39,40 @@ def create_session(request: Request, max_attempts: int = 3) -> str | None:
     while attempts < max_attempts:
         headers = get_auth_headers(request)
         try:
-            resp = cffi_requests.post(
+            # 复用共享会话，重试与后续请求无需重新建立 TLS 连接
+            resp = HTTP_SESSION.post(
                 DEEPSEEK_CREATE_SESSION_URL,
                 headers=headers,
                 json={"agent": "chat"},
-                impersonate="safari15_3",
             )
         except Exception as e:
             logger.error(f"[create_session] 请求异常: {e}")
             attempts += 1
             continue
         
-        try:
-            data = resp.json()
-        except Exception as e:
-            logger.error(f"[create_session] JSON解析异常: {e}")
+        status_code = resp.status_code
+        if status_code == 200:
+            try:
+                data = resp.json()
+            except Exception as e:
+                logger.error(f"[create_session] JSON解析异常: {e}")
+                data = {}
+            code = data.get("code")
+            msg = data.get("msg", "")
+        else:
+            # 非 200 响应（错误页 / 限流）不解析 JSON，只截取开头用于日志
             data = {}
+            code = None
+            msg = ""
+            logger.warning(
+                f"[create_session] HTTP {status_code}, body={resp.content[:256].decode('utf-8', 'replace')}"
+            )
         
-        if resp.status_code == 200 and data.get("code") == 0:
+        if status_code == 200 and code == 0:
             session_id = data["data"]["biz_data"]["id"]
             resp.close()
             return session_id
         else:
-            code = data.get("code")
-            msg = data.get("msg", "")
             logger.warning(
                 f"[create_session] 创建会话失败, code={code}, msg={msg}"
             )
@@ -69,7 +81,8 @@ def create_session(request: Request, max_attempts: int = 3) -> str | None:
             # 配置模式下尝试处理 token 问题
             if request.state.use_config_token:
                 # token 无效（认证失败）时，先尝试刷新当前账号的 token
-                if code in [40001, 40002, 40003] or "token" in msg.lower() or "unauthorized" in msg.lower():
+                if (status_code in (401, 403) or code in [40001, 40002, 40003]
+                        or "token" in msg.lower() or "unauthorized" in msg.lower()):
                     if not token_refreshed:
                         logger.info("[create_session] 检测到 token 可能过期，尝试刷新")
                         if refresh_account_token(request):
@@ -118,6 +131,25 @@ def get_pow(request: Request, max_attempts: int = 3) -> str | None:
     return get_pow_response(request, max_attempts)
 
 
+async def create_session_and_pow(request: Request, max_attempts: int = 3) -> tuple[str | None, str | None]:
+    """并发创建会话并获取 PoW，省去一次串行的 HTTP 往返
+    
+    PoW 用当前 token 预取（fetch_pow_response 不修改 request.state）；若预取失败，
+    或 create_session 在重试中刷新 token / 切换了账号，则在最终账号上按原流程重新获取。
+    
+    Returns:
+        (session_id, pow_resp)，任一项失败为 None
+    """
+    token = request.state.deepseek_token
+    session_id, pow_resp = await asyncio.gather(
+        asyncio.to_thread(create_session, request, max_attempts),
+        asyncio.to_thread(fetch_pow_response, get_auth_headers(request)),
+    )
+    if session_id and (pow_resp is None or request.state.deepseek_token != token):
+        pow_resp = await asyncio.to_thread(get_pow, request, max_attempts)
+    return session_id, pow_resp
+
+
 def prepare_completion_request(
     request: Request,
     session_id: str,
@@ -4,12 +4,16 @@
 这个模块包含解析 DeepSeek SSE 响应的公共逻辑，供 openai.py、claude.py 和 accounts.py 共用。
 合并了原 sse_parser.py 和 stream_parser.py 的功能。
 """
-import json
+import functools
+import random
 import re
-from typing import List, Tuple, Optional, Dict, Any, Generator
+import time
+from typing import List, Tuple, Optional, Dict, Any, AsyncGenerator, Generator
+
+import orjson
 
 from .config import logger
-from .constants import SKIP_PATTERNS
+from .constants import SKIP_PATTERN_RE, SSE_DATA_PREFIX, SSE_DONE, TOOL_PREFIX_DETECT_CHARS
 
 # 预编译正则表达式
 _TOOL_CALL_PATTERN = re.compile(r'\{\s*["\']tool_calls["\']\s*:\s*\[(.*?)\]\s*\}', re.DOTALL)
@@ -29,33 +33,128 @@ def parse_deepseek_sse_line(raw_line: bytes) -> Optional[Dict[str, Any]]:
     Returns:
         解析后的 chunk 字典，如果解析失败或应跳过则返回 None
     """
-    try:
-        line = raw_line.decode("utf-8")
-    except Exception as e:
-        logger.warning(f"[parse_deepseek_sse_line] 解码失败: {e}")
+    # 直接在字节上判断，空行 / keep-alive / 非 data 行无需先解码
+    if not raw_line.startswith(SSE_DATA_PREFIX):
         return None
+    return parse_deepseek_sse_data(raw_line[5:].strip())
+
+
+def parse_deepseek_sse_data(data: bytes) -> Optional[Dict[str, Any]]:
+    """解析 SSE 事件 data 字段（已去掉 "data:" 前缀与首尾空白）
     
-    if not line or not line.startswith("data:"):
-        return None
-    
-    data_str = line[5:].strip()
-    
-    if data_str == "[DONE]":
+    Returns:
+        解析后的 chunk 字典，[DONE] 返回 {"type": "done"}，解析失败返回 None
+    """
+    if data == SSE_DONE:
         return {"type": "done"}
     
     try:
-        chunk = json.loads(data_str)
-        return chunk
-    except json.JSONDecodeError as e:
-        logger.warning(f"[parse_deepseek_sse_line] JSON解析失败: {e}")
+        # orjson 直接解析 UTF-8 字节（非法编码同样抛出 JSONDecodeError，属于 ValueError）
+        return orjson.loads(data)
+    except ValueError as e:
+        logger.warning("[parse_deepseek_sse_data] JSON解析失败: %s", e)
         return None
 
 
+def _split_chunk(pending: bytearray, chunk: bytes) -> List[bytes]:
+    """把一个网络块按 \\n 切分，返回其中完整的行；末尾的半行留在 pending 中
+
+    每个网络块只做一次 split；跨块的半行累积在 bytearray 中，
+    避免 iter_lines 每次拼接 pending + chunk 产生的重复拷贝。
+    """
+    if b"\n" not in chunk:
+        pending += chunk
+        return []
+    lines = chunk.split(b"\n")
+    if pending:
+        pending += lines[0]
+        lines[0] = bytes(pending)
+        pending.clear()
+    pending += lines.pop()
+    return lines
+
+
+def iter_sse_lines(response: Any) -> Generator[bytes, None, None]:
+    """按 \\n 切分流响应，逐行产出原始字节"""
+    pending = bytearray()
+    for chunk in response.iter_content():
+        yield from _split_chunk(pending, chunk)
+    if pending:
+        yield bytes(pending)
+
+
+def _split_events(buf: bytearray, chunk: bytes) -> List[bytes]:
+    """把网络块追加到 buf，按空行（\\n\\n）切出完整的事件块；未结束的事件留在 buf 中
+
+    CRLF 分帧的流先把 \\r\\n 统一成 \\n，再按同样的规则切分。
+    分隔符可能跨块（\\r 与 \\n 也可能分属两块），查找与替换都从上一块的最后两个字节开始；
+    切完后一次性删除已消费的前缀。
+    """
+    start = max(len(buf) - 2, 0)
+    buf += chunk
+    if buf.find(b"\r", start) >= 0:
+        buf[start:] = buf[start:].replace(b"\r\n", b"\n")
+    blocks = []
+    pos = 0
+    idx = buf.find(b"\n\n", start)
+    while idx >= 0:
+        blocks.append(bytes(buf[pos:idx]))
+        pos = idx + 2
+        idx = buf.find(b"\n\n", pos)
+    if pos:
+        del buf[:pos]
+    return blocks
+
+
+def _block_data(block: bytes) -> List[Optional[bytes]]:
+    """取出多行事件块中每个 data 行的内容；没有 data 行时返回 [None]"""
+    payloads = [line[5:].strip() for line in block.split(b"\n") if line[:5] == SSE_DATA_PREFIX]
+    return payloads or [None]
+
+
+def iter_sse_events(response: Any) -> Generator[Optional[bytes], None, None]:
+    """按空行切分 SSE 事件，逐个产出 data 字段（已去掉前缀与首尾空白）
+
+    DeepSeek 的事件几乎都是单行 "data: {...}"，直接切片；多行事件中每个 data 行单独产出。
+    没有 data 行的事件（注释、keep-alive）产出 None，供调用方检测空闲。
+    """
+    buf = bytearray()
+    prefix = SSE_DATA_PREFIX
+    for chunk in response.iter_content():
+        for block in _split_events(buf, chunk):
+            if b"\n" not in block:
+                yield block[5:].strip() if block[:5] == prefix else None
+            else:
+                yield from _block_data(block)
+    if buf:
+        yield from _block_data(bytes(buf))
+
+
+async def aiter_sse_events(response: Any) -> AsyncGenerator[Optional[bytes], None]:
+    """iter_sse_events 的异步版本，用于 AsyncSession 的流式响应"""
+    buf = bytearray()
+    prefix = SSE_DATA_PREFIX
+    async for chunk in response.aiter_content():
+        for block in _split_events(buf, chunk):
+            if b"\n" not in block:
+                yield block[5:].strip() if block[:5] == prefix else None
+            else:
+                for data in _block_data(block):
+                    yield data
+    if buf:
+        for data in _block_data(bytes(buf)):
+            yield data
+
+
+@functools.lru_cache(maxsize=1024)
 def should_skip_chunk(chunk_path: str) -> bool:
-    """判断是否应该跳过这个 chunk（状态相关，不是内容）"""
+    """判断是否应该跳过这个 chunk（状态相关，不是内容）
+
+    DeepSeek 流中出现的路径种类很少，按路径缓存结果，每个 chunk 只需一次哈希查找。
+    """
     if chunk_path == "response/search_status":
         return True
-    return any(kw in chunk_path for kw in SKIP_PATTERNS)
+    return SKIP_PATTERN_RE.search(chunk_path) is not None
 
 
 def is_response_finished(chunk_path: str, v_value: Any) -> bool:
@@ -77,21 +176,33 @@ def is_search_result(item: dict) -> bool:
 # 内容提取函数
 # ----------------------------------------------------------------------
 
+# 内层 type 字段到内容类型的映射（DeepSeek 使用 THINK 而不是 THINKING）
+_INNER_TYPE_MAP = {"THINK": "thinking", "THINKING": "thinking", "RESPONSE": "text"}
+
+# 内容类型固定的 chunk 路径，每个 chunk 一次字典查找代替逐个字符串比较
+_PATH_TYPE_MAP = {"response/thinking_content": "thinking", "response/content": "text"}
+
+
+def _map_inner_type(raw_type: str, default_type: str) -> str:
+    """把内层 type 映射为内容类型，未知类型返回 default_type
+
+    DeepSeek 原样返回大写的 THINK / RESPONSE，先精确查找，未命中时才 upper()。
+    """
+    mapped = _INNER_TYPE_MAP.get(raw_type)
+    if mapped is None:
+        mapped = _INNER_TYPE_MAP.get(raw_type.upper(), default_type)
+    return mapped
+
+
 def extract_content_from_item(item: dict, default_type: str = "text") -> Optional[Tuple[str, str]]:
     """从包含 content 和 type 的项中提取内容
     
     返回 (content, content_type) 或 None
     """
     if "content" in item and "type" in item:
-        inner_type = item.get("type", "").upper()
-        content = item.get("content", "")
+        content = item["content"]
         if content:
-            if inner_type == "THINK" or inner_type == "THINKING":
-                return (content, "thinking")
-            elif inner_type == "RESPONSE":
-                return (content, "text")
-            else:
-                return (content, default_type)
+            return (content, _map_inner_type(item["type"], default_type))
     return None
 
 
@@ -102,30 +213,35 @@ def extract_content_recursive(items: List[Dict], default_type: str = "text") ->
     如果遇到 FINISHED 信号返回 None
     """
     extracted: List[Tuple[str, str]] = []
+    # 每个 SSE chunk 都会走到这里，循环内的全局查找提前绑定为局部变量
+    add = extracted.append
+    skip = should_skip_chunk
+    map_type = _map_inner_type
     for item in items:
         if not isinstance(item, dict):
             continue
         
+        # 跳过搜索结果项（同 is_search_result）
+        if "url" in item and "title" in item:
+            continue
+        
         item_p = item.get("p", "")
         item_v = item.get("v")
         
-        # 跳过搜索结果项
-        if is_search_result(item):
-            continue
-        
         # 只有当 p="status" (精确匹配) 且 v="FINISHED" 才认为是真正结束
         if item_p == "status" and item_v == "FINISHED":
             return None  # 信号结束
         
         # 跳过状态相关
-        if should_skip_chunk(item_p):
+        if skip(item_p):
             continue
         
-        # 直接处理包含 content 和 type 的项
-        result = extract_content_from_item(item, default_type)
-        if result:
-            extracted.append(result)
-            continue
+        # 直接处理包含 content 和 type 的项（同 extract_content_from_item）
+        if "content" in item and "type" in item:
+            content = item["content"]
+            if content:
+                add((content, map_type(item["type"], default_type)))
+                continue
         
         # 确定类型（基于 p 字段）
         if "thinking" in item_p:
@@ -138,26 +254,17 @@ def extract_content_recursive(items: List[Dict], default_type: str = "text") ->
         # 处理不同的 v 类型
         if isinstance(item_v, str):
             if item_v and item_v != "FINISHED":
-                extracted.append((item_v, content_type))
+                add((item_v, content_type))
         elif isinstance(item_v, list):
             # 内层可能是 [{"content": "text", "type": "THINK/RESPONSE", ...}] 格式
             for inner in item_v:
                 if isinstance(inner, dict):
-                    # 检查内层的 type 字段
-                    inner_type = inner.get("type", "").upper()
-                    # DeepSeek 使用 THINK 而不是 THINKING
-                    if inner_type == "THINK" or inner_type == "THINKING":
-                        final_type = "thinking"
-                    elif inner_type == "RESPONSE":
-                        final_type = "text"
-                    else:
-                        final_type = content_type  # 继承外层类型
-                    
+                    # 检查内层的 type 字段，未知类型继承外层类型
                     content = inner.get("content", "")
                     if content:
-                        extracted.append((content, final_type))
+                        add((content, map_type(inner.get("type", ""), content_type)))
                 elif isinstance(inner, str) and inner:
-                    extracted.append((inner, content_type))
+                    add((inner, content_type))
     return extracted
 
 
@@ -208,38 +315,28 @@ def parse_sse_chunk_for_content(
                 fragments = batch_item.get("v", [])
                 for frag in fragments:
                     if isinstance(frag, dict):
-                        frag_type = frag.get("type", "").upper()
-                        if frag_type == "THINK" or frag_type == "THINKING":
-                            new_fragment_type = "thinking"
-                        elif frag_type == "RESPONSE":
-                            new_fragment_type = "text"
+                        new_fragment_type = _map_inner_type(frag.get("type", ""), new_fragment_type)
     
     # 也检测直接的 fragments 路径
     if "response/fragments" in chunk_path and isinstance(v_value, list):
         for frag in v_value:
             if isinstance(frag, dict):
-                frag_type = frag.get("type", "").upper()
-                if frag_type == "THINK" or frag_type == "THINKING":
-                    new_fragment_type = "thinking"
-                elif frag_type == "RESPONSE":
-                    new_fragment_type = "text"
+                new_fragment_type = _map_inner_type(frag.get("type", ""), new_fragment_type)
     
     # 确定当前内容类型
-    if chunk_path == "response/thinking_content":
-        ptype = "thinking"
-    elif chunk_path == "response/content":
-        ptype = "text"
-    elif "response/fragments" in chunk_path and "/content" in chunk_path:
-        # 如 response/fragments/-1/content - 使用当前 fragment 类型
-        ptype = new_fragment_type
-    elif not chunk_path:
-        # 空路径内容：使用当前活跃的 fragment 类型
-        if thinking_enabled:
+    ptype = _PATH_TYPE_MAP.get(chunk_path)
+    if ptype is None:
+        if "response/fragments" in chunk_path and "/content" in chunk_path:
+            # 如 response/fragments/-1/content - 使用当前 fragment 类型
             ptype = new_fragment_type
+        elif not chunk_path:
+            # 空路径内容：使用当前活跃的 fragment 类型
+            if thinking_enabled:
+                ptype = new_fragment_type
+            else:
+                ptype = "text"
         else:
             ptype = "text"
-    else:
-        ptype = "text"
     
     # 处理字符串值
     if isinstance(v_value, str):
@@ -274,23 +371,19 @@ def extract_content_from_chunk(chunk: Dict[str, Any]) -> Tuple[str, str, bool]:
     
     # 检测内容审核/敏感词阻止
     if "error" in chunk or chunk.get("code") == "content_filter":
-        logger.warning(f"[extract_content_from_chunk] 检测到内容过滤: {chunk}")
+        logger.warning("[extract_content_from_chunk] 检测到内容过滤: %s", chunk)
         return "", "text", True
     
     if "v" not in chunk:
         return "", "text", False
     
     v_value = chunk["v"]
-    ptype = "text"
     
     # 检查路径确定类型
     path = chunk.get("p", "")
     if path == "response/search_status":
         return "", "text", False  # 跳过搜索状态
-    elif path == "response/thinking_content":
-        ptype = "thinking"
-    elif path == "response/content":
-        ptype = "text"
+    ptype = _PATH_TYPE_MAP.get(path, "text")
     
     if isinstance(v_value, str):
         if v_value == "FINISHED":
@@ -310,6 +403,52 @@ def extract_content_from_chunk(chunk: Dict[str, Any]) -> Tuple[str, str, bool]:
 # 响应收集函数
 # ----------------------------------------------------------------------
 
+# 不携带内容的行（keep-alive、状态 chunk 等）统一产出同一个元组，供调用方做超时与保活判断
+_PING_EVENT = ("ping", "")
+_FINISHED_EVENT = ("finished", "")
+
+
+def classify_sse_data(data: Optional[bytes]) -> Tuple[str, str]:
+    """把一个 DeepSeek SSE 事件的 data 字段解析为 (kind, content) 事件
+    
+    kind 为：
+    - "text" / "thinking": 一段非空内容
+    - "ping": 本事件没有内容（调用方可据此检测空闲超时）
+    - "finished": 响应结束（[DONE]、FINISHED 或内容过滤）
+    """
+    if data is None:
+        return _PING_EVENT
+    chunk = parse_deepseek_sse_data(data)
+    if not chunk:
+        return _PING_EVENT
+    content, content_type, is_finished = extract_content_from_chunk(chunk)
+    if is_finished:
+        return _FINISHED_EVENT
+    return (content_type, content) if content else _PING_EVENT
+
+
+def iter_classified_events(response: Any) -> Generator[Tuple[str, str], None, None]:
+    """逐个解析 DeepSeek SSE 事件并按内容类型产出（见 classify_sse_data），
+    产出 "finished" 后生成器结束
+    """
+    classify = classify_sse_data
+    for data in iter_sse_events(response):
+        event = classify(data)
+        yield event
+        if event is _FINISHED_EVENT:
+            return
+
+
+async def aiter_classified_events(response: Any) -> AsyncGenerator[Tuple[str, str], None]:
+    """iter_classified_events 的异步版本，用于 AsyncSession 的流式响应"""
+    classify = classify_sse_data
+    async for data in aiter_sse_events(response):
+        event = classify(data)
+        yield event
+        if event is _FINISHED_EVENT:
+            return
+
+
 def collect_deepseek_response(response: Any) -> Tuple[str, str]:
     """收集 DeepSeek 流响应的完整内容
     
@@ -319,40 +458,115 @@ def collect_deepseek_response(response: Any) -> Tuple[str, str]:
     Returns:
         (reasoning_content, text_content) 元组
     """
-    thinking_parts: List[str] = []
-    text_parts: List[str] = []
+    parts: Dict[str, List[str]] = {"thinking": [], "text": []}
     
     try:
-        for raw_line in response.iter_lines():
-            chunk = parse_deepseek_sse_line(raw_line)
-            if not chunk:
-                continue
-            
-            content, content_type, is_finished = extract_content_from_chunk(chunk)
-            
-            if is_finished:
-                break
-            
-            if content:
-                if content_type == "thinking":
-                    thinking_parts.append(content)
-                else:
-                    text_parts.append(content)
+        for kind, content in iter_classified_events(response):
+            if kind in parts:
+                parts[kind].append(content)
     except Exception as e:
-        logger.error(f"[collect_deepseek_response] 收集响应失败: {e}")
+        logger.error("[collect_deepseek_response] 收集响应失败: %s", e)
     finally:
         try:
             response.close()
         except Exception:
             pass
     
-    return "".join(thinking_parts), "".join(text_parts)
+    return "".join(parts["thinking"]), "".join(parts["text"])
+
+
+async def acollect_deepseek_response(response: Any) -> Tuple[str, str]:
+    """collect_deepseek_response 的异步版本，用于 AsyncSession 的流式响应"""
+    parts: Dict[str, List[str]] = {"thinking": [], "text": []}
+    
+    try:
+        async for kind, content in aiter_classified_events(response):
+            if kind in parts:
+                parts[kind].append(content)
+    except Exception as e:
+        logger.error("[acollect_deepseek_response] 收集响应失败: %s", e)
+    finally:
+        try:
+            await response.aclose()
+        except Exception:
+            pass
+    
+    return "".join(parts["thinking"]), "".join(parts["text"])
 
 
 # ----------------------------------------------------------------------
 # 工具调用解析
 # ----------------------------------------------------------------------
 
+# 工具调用 JSON 的开头（去掉空白、单引号统一为双引号后比较）
+_TOOL_CALL_PREFIX = '{"tool_calls"'
+
+
+def detect_tool_call_prefix(head: str) -> Optional[bool]:
+    """根据输出开头判断是否为工具调用 JSON，供流式输出决定直通还是缓冲
+    
+    Args:
+        head: 目前收到的输出开头
+        
+    Returns:
+        True 表示以 {"tool_calls" 开头，False 表示普通文本，
+        None 表示开头过短（或只有空白）暂时无法判断
+    """
+    compact = "".join(head.split()).replace("'", '"')
+    if not compact:
+        return None
+    if compact.startswith(_TOOL_CALL_PREFIX):
+        return True
+    if _TOOL_CALL_PREFIX.startswith(compact):
+        return None
+    return False
+
+
+class ToolCallTextGate:
+    """声明了工具时的正文闸门：普通文本直接放行，从可能开启 {"tool_calls" 的 "{" 起扣住后文
+
+    工具调用前面可能有一段说明文字，只看输出开头会把后面的工具 JSON 当成文本发出。
+    逐个检查正文中的 "{"：判定为工具调用时，之前的文本照常放行，之后的全部交给工具解析；
+    判定不是则连同这个 "{" 一起放行；暂时无法判断就扣住，等下一段输出再判断。
+    """
+
+    def __init__(self):
+        self._held = ""
+        self.tool_text: Optional[str] = None  # 判定为工具调用后，从 "{" 起的全部输出
+
+    def feed(self, text: str) -> Tuple[str, str]:
+        """追加一段正文，返回 (可以直接发出的文本, 需要交给工具解析的文本)"""
+        if self.tool_text is not None:
+            self.tool_text += text
+            return "", text
+        buf = self._held + text
+        self._held = ""
+        pos = buf.find("{")
+        while pos >= 0:
+            is_tool = detect_tool_call_prefix(buf[pos:pos + TOOL_PREFIX_DETECT_CHARS])
+            if is_tool:
+                self.tool_text = buf[pos:]
+                return buf[:pos], self.tool_text
+            # 空白过长仍无法判断的按普通文本处理，扣住的内容有上限
+            if is_tool is None and len(buf) - pos < TOOL_PREFIX_DETECT_CHARS:
+                self._held = buf[pos:]
+                return buf[:pos], ""
+            pos = buf.find("{", pos + 1)
+        return buf, ""
+
+    def flush(self) -> str:
+        """输出结束时取回仍被扣住的文本（未能判定为工具调用，按普通文本发出）"""
+        held, self._held = self._held, ""
+        return held
+
+
+def _allowed_tool_names(tools_requested: List[Dict]) -> set:
+    """请求中声明的工具名集合"""
+    return {
+        name for name in (tool.get("name") for tool in tools_requested) if isinstance(name, str)
+    }
+
+
 def parse_tool_calls(text: str, tools_requested: List[Dict]) -> List[Dict[str, Any]]:
     """从响应文本中解析工具调用
     
@@ -364,39 +578,134 @@ def parse_tool_calls(text: str, tools_requested: List[Dict]) -> List[Dict[str, A
         检测到的工具调用列表，每项包含 name 和 input
     """
     detected_tools: List[Dict[str, Any]] = []
+    # 没有声明工具时任何调用都不会通过名称校验，连子串扫描也省掉；
+    # 两种格式都要求出现 tool_calls 字面量，普通回复直接返回，不跑正则。
+    # 不能只看开头是否为 "{"：工具调用前面可能还有一段说明文字
+    if not tools_requested or "tool_calls" not in text:
+        return detected_tools
+    # 声明的工具名集合只建一次，每个检测到的调用 O(1) 校验
+    allowed_names = _allowed_tool_names(tools_requested)
     cleaned_text = text.strip()
     
     # 尝试直接解析完整 JSON
     if cleaned_text.startswith('{"tool_calls":') and cleaned_text.endswith("]}"):
         try:
-            tool_data = json.loads(cleaned_text)
+            tool_data = orjson.loads(cleaned_text)
             for tool_call in tool_data.get("tool_calls", []):
                 tool_name = tool_call.get("name")
                 tool_input = tool_call.get("input", {})
-                if any(tool.get("name") == tool_name for tool in tools_requested):
+                if isinstance(tool_name, str) and tool_name in allowed_names:
                     detected_tools.append({"name": tool_name, "input": tool_input})
             if detected_tools:
                 return detected_tools
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             pass
     
     # 使用正则匹配
     matches = _TOOL_CALL_PATTERN.findall(cleaned_text)
     for match in matches:
         try:
-            tool_calls_json = f'{{"tool_calls": [{match}]}}'
-            tool_data = json.loads(tool_calls_json)
-            for tool_call in tool_data.get("tool_calls", []):
+            # 捕获组即 tool_calls 数组的内容，直接按数组解析，无需再包一层对象
+            for tool_call in orjson.loads(f"[{match}]"):
                 tool_name = tool_call.get("name")
                 tool_input = tool_call.get("input", {})
-                if any(tool.get("name") == tool_name for tool in tools_requested):
+                if isinstance(tool_name, str) and tool_name in allowed_names:
                     detected_tools.append({"name": tool_name, "input": tool_input})
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             continue
     
     return detected_tools
 
 
+# tool_calls 数组内决定嵌套层级与字符串边界的字符，其余字符由正则直接跳过
+_TOOL_STREAM_TOKEN_RE = re.compile(r'[{}\[\]"\\]')
+
+
+class ToolCallStreamParser:
+    """增量解析流式输出中的 {"tool_calls": [...]}，每个工具对象一闭合就产出
+
+    只跟踪数组内的括号层级和字符串状态，对象闭合后把这一段交给 orjson 解析，
+    不必等整段输出结束再扫描一遍。用法：每收到一段输出调用 feed()。
+    """
+
+    def __init__(self, tools_requested: List[Dict]):
+        self._allowed_names = _allowed_tool_names(tools_requested)
+        self._buf = ""
+        self._pos = 0  # 下一个待扫描的位置
+        self._in_array = False
+        self._depth = 0
+        self._obj_start = -1
+        self._in_string = False
+        self._escaped_at = -1  # 被反斜杠转义的字符位置
+        self.done = False
+        self.found = 0  # 已产出的工具调用数
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """追加一段输出，返回其中新闭合的工具调用（每项包含 name 和 input）"""
+        detected_tools: List[Dict[str, Any]] = []
+        if self.done:
+            return detected_tools
+        buf = self._buf = self._buf + text
+        pos = self._pos
+        if not self._in_array:
+            start = buf.find("[", pos)
+            if start < 0:
+                self._pos = len(buf)
+                return detected_tools
+            self._in_array = True
+            pos = start + 1
+
+        depth = self._depth
+        in_string = self._in_string
+        escaped_at = self._escaped_at
+        next_pos = len(buf)
+        for match in _TOOL_STREAM_TOKEN_RE.finditer(buf, pos):
+            i = match.start()
+            if i == escaped_at:
+                continue
+            ch = match.group()
+            if in_string:
+                if ch == '"':
+                    in_string = False
+                elif ch == "\\":
+                    escaped_at = i + 1
+            elif ch == '"':
+                in_string = True
+            elif ch == "{" or ch == "[":
+                if depth == 0:
+                    if ch == "[":
+                        continue
+                    self._obj_start = i
+                depth += 1
+            elif depth:
+                depth -= 1
+                if depth == 0 and ch == "}":
+                    self._add_tool(buf[self._obj_start:i + 1], detected_tools)
+            elif ch == "]":
+                # tool_calls 数组结束
+                self.done = True
+                next_pos = i + 1
+                break
+
+        self._pos = next_pos
+        self._depth = depth
+        self._in_string = in_string
+        self._escaped_at = escaped_at
+        return detected_tools
+
+    def _add_tool(self, raw: str, detected_tools: List[Dict[str, Any]]) -> None:
+        try:
+            tool_call = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            return
+        if not isinstance(tool_call, dict):
+            return
+        tool_name = tool_call.get("name")
+        if isinstance(tool_name, str) and tool_name in self._allowed_names:
+            detected_tools.append({"name": tool_name, "input": tool_call.get("input", {})})
+            self.found += 1
+
+
 # ----------------------------------------------------------------------
 # 引用过滤
 # ----------------------------------------------------------------------
@@ -434,17 +743,16 @@ def format_openai_tool_calls(
         OpenAI 格式的 tool_calls 数组，例如：
         [{"id": "call_xxx", "type": "function", "function": {"name": "...", "arguments": "..."}}]
     """
-    import random
-    import time
-    
-    tool_calls_data = []
-    for idx, tool_info in enumerate(detected_tools):
-        tool_calls_data.append({
-            "id": f"call_{base_id or int(time.time())}_{random.randint(1000,9999)}_{idx}",
+    # ID 前缀对整批调用相同，只取一次时间
+    id_prefix = f"call_{base_id or int(time.time())}_"
+    return [
+        {
+            "id": f"{id_prefix}{random.randint(1000, 9999)}_{idx}",
             "type": "function",
             "function": {
                 "name": tool_info["name"],
-                "arguments": json.dumps(tool_info.get("input", {}), ensure_ascii=False)
+                "arguments": orjson.dumps(tool_info.get("input", {})).decode("utf-8")
             }
-        })
-    return tool_calls_data
+        }
+        for idx, tool_info in enumerate(detected_tools)
+    ]
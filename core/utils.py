@@ -1,5 +1,22 @@
 # -*- coding: utf-8 -*-
 """公共工具函数模块"""
+import orjson
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# SSE 响应头：禁止代理（nginx 等）缓冲与缓存，保证逐帧及时送达
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+class ORJSONResponse(JSONResponse):
+    """使用 orjson 序列化的 JSONResponse（输出 UTF-8，不转义非 ASCII 字符）"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def sse_response(stream) -> StreamingResponse:
+    """把已编码好的 SSE 帧生成器包装为 text/event-stream 响应"""
+    return StreamingResponse(stream, media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 def get_account_identifier(account: dict) -> str:
@@ -18,12 +35,21 @@ def estimate_tokens(text) -> int:
     """
     if isinstance(text, str):
         return max(1, len(text) // 4)
-    elif isinstance(text, list):
-        return sum(
-            estimate_tokens(item.get("text", ""))
-            if isinstance(item, dict)
-            else estimate_tokens(str(item))
-            for item in text
-        )
-    else:
+    if not isinstance(text, list):
         return max(1, len(str(text)) // 4)
+
+    # 用显式栈代替递归：只有 dict 的 text 字段为列表时才继续展开，
+    # 每个叶子片段单独按 max(1, len // 4) 计数，与逐项估算的结果一致
+    total = 0
+    stack = [text]
+    while stack:
+        for item in stack.pop():
+            if isinstance(item, dict):
+                item = item.get("text", "")
+                if isinstance(item, list):
+                    stack.append(item)
+                    continue
+            if not isinstance(item, str):
+                item = str(item)
+            total += max(1, len(item) // 4)
+    return total
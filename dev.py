@@ -8,15 +8,19 @@ DS2API 开发服务器 - 统一启动后端和前端
     python dev.py --backend   # 仅启动后端
     python dev.py --frontend  # 仅启动前端
     python dev.py --install   # 安装所有依赖
+    python dev.py --prod      # 不启用热重载启动后端（可加 --workers N）
 
 环境变量:
     PORT - 后端服务端口，默认 5001
     LOG_LEVEL - 日志级别，默认 INFO
 """
 import os
+import queue
 import sys
 import signal
+import socket
 import subprocess
+import threading
 import time
 from pathlib import Path
 
@@ -62,21 +66,40 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 
-def start_backend():
-    """启动后端服务"""
+def _arg_value(name: str, default: str) -> str:
+    """读取形如 `--name value` 的命令行参数"""
+    if name in sys.argv:
+        idx = sys.argv.index(name)
+        if idx + 1 < len(sys.argv):
+            return sys.argv[idx + 1]
+    return default
+
+
+def start_backend(prod: bool = False):
+    """启动后端服务
+
+    开发模式启用热重载，并排除 webui 目录（node_modules 文件众多，监听它只会拖慢重载）；
+    --prod 不启用热重载，可用 --workers 指定进程数。注意账号池是进程内状态，
+    多进程时各进程独立轮询，同一账号可能被并发使用，默认仍为单进程。
+    uvicorn[standard] 已安装 uvloop / httptools 时会自动选用，无需显式指定。
+    """
     print(f"🚀 启动后端服务... http://localhost:{BACKEND_PORT}")
-    proc = subprocess.Popen(
-        [
-            sys.executable, "-m", "uvicorn",
-            "app:app",
-            "--host", HOST,
-            "--port", str(BACKEND_PORT),
+    cmd = [
+        sys.executable, "-m", "uvicorn",
+        "app:app",
+        "--host", HOST,
+        "--port", str(BACKEND_PORT),
+        "--log-level", LOG_LEVEL,
+    ]
+    if prod:
+        cmd += ["--workers", _arg_value("--workers", "1")]
+    else:
+        cmd += [
             "--reload",
             "--reload-dir", str(PROJECT_DIR),
-            "--log-level", LOG_LEVEL,
-        ],
-        cwd=PROJECT_DIR,
-    )
+            "--reload-exclude", str(WEBUI_DIR),
+        ]
+    proc = subprocess.Popen(cmd, cwd=PROJECT_DIR)
     processes.append(proc)
     return proc
 
@@ -101,14 +124,35 @@ def start_frontend():
     return proc
 
 
+def _wait_backend_ready(timeout: float = 10.0):
+    """探测后端端口，可连接时提示就绪（最多等待 timeout 秒）"""
+    host = "127.0.0.1" if HOST in ("0.0.0.0", "::", "") else HOST
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, BACKEND_PORT), timeout=0.1):
+                print(f"✅ 后端已就绪: http://localhost:{BACKEND_PORT}")
+                return
+        except OSError:
+            time.sleep(0.05)
+    print(f"⚠️  后端 {timeout:g}s 内未就绪，请检查上方日志")
+
+
+def _reap(proc, exited):
+    """等待子进程退出后放入队列"""
+    proc.wait()
+    exited.put(proc)
+
+
 def main():
     # 解析参数
     if "--install" in sys.argv or "-i" in sys.argv:
         install_dependencies()
         return
     
-    backend_only = "--backend" in sys.argv or "-b" in sys.argv
-    frontend_only = "--frontend" in sys.argv or "-f" in sys.argv
+    prod = "--prod" in sys.argv
+    backend_only = prod or "--backend" in sys.argv or "-b" in sys.argv
+    frontend_only = not prod and ("--frontend" in sys.argv or "-f" in sys.argv)
     
     # 注册信号处理
     signal.signal(signal.SIGINT, signal_handler)
@@ -121,12 +165,12 @@ def main():
     if frontend_only:
         start_frontend()
     elif backend_only:
-        start_backend()
+        start_backend(prod)
     else:
-        # 同时启动
+        # 同时启动：Vite 不依赖后端，两者并行启动，后端就绪由后台线程探测
         start_backend()
-        time.sleep(1)  # 等待后端启动
         start_frontend()
+        threading.Thread(target=_wait_backend_ready, daemon=True).start()
     
     print("\n" + "-" * 50)
     if not frontend_only:
@@ -136,13 +180,13 @@ def main():
     print("-" * 50)
     print("按 Ctrl+C 停止所有服务\n")
     
-    # 等待进程结束
+    # 等待进程结束：每个子进程由一个守护线程阻塞 wait()，主线程阻塞在队列上，空闲时不轮询
+    exited = queue.Queue()
+    for proc in processes:
+        threading.Thread(target=_reap, args=(proc, exited), daemon=True).start()
     try:
         while processes:
-            for proc in processes[:]:
-                if proc.poll() is not None:
-                    processes.remove(proc)
-            time.sleep(0.5)
+            processes.remove(exited.get())
     except KeyboardInterrupt:
         signal_handler(None, None)
 
@@ -2,7 +2,7 @@
 """Admin 路由模块 - 合并所有子模块路由"""
 from fastapi import APIRouter
 
-from .auth import router as auth_router, verify_admin, ADMIN_KEY
+from .auth import router as auth_router, verify_admin, AdminAuth, ADMIN_KEY
 from .config import router as config_router
 from .accounts import router as accounts_router
 from .vercel import router as vercel_router
@@ -17,4 +17,4 @@ router.include_router(accounts_router)
 router.include_router(vercel_router)
 
 # 导出常用依赖
-__all__ = ["router", "verify_admin", "ADMIN_KEY"]
+__all__ = ["router", "verify_admin", "AdminAuth", "ADMIN_KEY"]
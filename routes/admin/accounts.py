@@ -2,12 +2,11 @@
 """Admin 账号管理模块 - 账号测试与导入"""
 import asyncio
 import json
-import base64
 
-from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import JSONResponse
 
-from core.config import CONFIG, save_config, logger, WASM_PATH
+from core.config import CONFIG, save_config, bump_config_version, refresh_config_keys, logger, WASM_PATH
 from core.auth import init_account_queue, get_account_identifier
 from core.deepseek import (
     login_deepseek_via_account, 
@@ -15,11 +14,11 @@ from core.deepseek import (
     DEEPSEEK_COMPLETION_URL, 
     BASE_HEADERS,
 )
-from core.pow import compute_pow_answer
-from core.models import get_model_config
-from core.sse_parser import parse_sse_chunk_for_content
+from core.pow import compute_pow_answer, encode_pow_response
+from core.models import DEFAULT_MODEL_CONFIG, get_model_config
+from core.sse_parser import iter_sse_lines, parse_sse_chunk_for_content
 
-from .auth import verify_admin
+from .auth import AdminAuth
 
 router = APIRouter()
 
@@ -95,6 +94,7 @@ async def test_account_api(account: dict, model: str = "deepseek-chat", message:
         if not token or (session_result and not session_result["success"] and _is_token_invalid(session_result["status_code"], session_result["data"])):
             try:
                 account["token"] = ""
+                bump_config_version()
                 login_deepseek_via_account(account)
                 token = account.get("token", "")
                 session_result = _create_session(token)
@@ -145,21 +145,9 @@ async def test_account_api(account: dict, model: str = "deepseek-chat", message:
             result["message"] = f"PoW 计算失败: {str(e)}"
             return result
         
-        pow_dict = {
-            "algorithm": challenge["algorithm"],
-            "challenge": challenge["challenge"],
-            "salt": challenge["salt"],
-            "answer": answer,
-            "signature": challenge["signature"],
-            "target_path": challenge["target_path"],
-        }
-        pow_str = json.dumps(pow_dict, separators=(",", ":"), ensure_ascii=False)
-        pow_header = base64.b64encode(pow_str.encode("utf-8")).decode("utf-8").rstrip()
+        pow_header = encode_pow_response(challenge, answer)
         
-        thinking_enabled, search_enabled = get_model_config(model)
-        if thinking_enabled is None:
-            thinking_enabled = False
-            search_enabled = False
+        thinking_enabled, search_enabled = get_model_config(model, DEFAULT_MODEL_CONFIG)
         
         payload = {
             "chat_session_id": session_id,
@@ -188,7 +176,7 @@ async def test_account_api(account: dict, model: str = "deepseek-chat", message:
         content_parts = []
         current_fragment_type = "thinking" if thinking_enabled else "text"
         
-        for line in completion_resp.iter_lines():
+        for line in iter_sse_lines(completion_resp):
             if not line:
                 continue
             try:
@@ -236,7 +224,7 @@ async def test_account_api(account: dict, model: str = "deepseek-chat", message:
 
 
 @router.post("/accounts/test")
-async def test_single_account(request: Request, _: bool = Depends(verify_admin)):
+async def test_single_account(request: Request, _: AdminAuth):
     """测试单个账号的 API 调用"""
     data = await request.json()
     identifier = data.get("identifier", "")
@@ -262,7 +250,7 @@ async def test_single_account(request: Request, _: bool = Depends(verify_admin))
 
 
 @router.post("/accounts/test-all")
-async def test_all_accounts(request: Request, _: bool = Depends(verify_admin)):
+async def test_all_accounts(request: Request, _: AdminAuth):
     """批量测试所有账号的 API 调用"""
     data = await request.json()
     model = data.get("model", "deepseek-chat")
@@ -297,7 +285,7 @@ async def test_all_accounts(request: Request, _: bool = Depends(verify_admin)):
 # 批量导入
 # ----------------------------------------------------------------------
 @router.post("/import")
-async def batch_import(request: Request, _: bool = Depends(verify_admin)):
+async def batch_import(request: Request, _: AdminAuth):
     """批量导入 keys 和 accounts"""
     try:
         data = await request.json()
@@ -327,6 +315,7 @@ async def batch_import(request: Request, _: bool = Depends(verify_admin)):
                     existing_ids.add(acc_id)
                     imported_accounts += 1
         
+        refresh_config_keys()
         init_account_queue()
         save_config(CONFIG)
         
@@ -5,7 +5,11 @@ import os
 import time
 import hashlib
 import hmac
+import threading
+from collections import OrderedDict
+from typing import Annotated
 
+import orjson
 from fastapi import APIRouter, HTTPException, Request, Depends
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -23,72 +27,104 @@ JWT_SECRET = os.getenv("DS2API_JWT_SECRET", ADMIN_KEY or "ds2api-default-secret"
 JWT_EXPIRE_HOURS = int(os.getenv("DS2API_JWT_EXPIRE_HOURS", "24"))
 
 
+def _is_admin_key(value) -> bool:
+    """常量时间比较 admin key（按 bytes 比较，兼容非 ASCII 字符）"""
+    if not isinstance(value, str):
+        return False
+    return hmac.compare_digest(value.encode(), ADMIN_KEY.encode())
+
+
 # ----------------------------------------------------------------------
 # JWT 工具函数（轻量实现，无需额外依赖）
 # ----------------------------------------------------------------------
-def _b64_encode(data: bytes) -> str:
-    """Base64 URL 安全编码"""
-    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+# 各段全程保持 bytes，只在生成完整 token 时解码一次，避免逐段 bytes/str 互转
+def _b64_encode(data: bytes) -> bytes:
+    """Base64 URL 安全编码（去掉填充）"""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
 
-def _b64_decode(data: str) -> bytes:
-    """Base64 URL 安全解码"""
+def _b64_decode(data: bytes) -> bytes:
+    """Base64 URL 安全解码（补齐填充）"""
     padding = 4 - len(data) % 4
     if padding != 4:
-        data += "=" * padding
+        data += b"=" * padding
     return base64.urlsafe_b64decode(data)
 
+# 密钥字节与固定的 header 段在导入时计算一次，签发/验证时不再重复编码
+_JWT_SECRET_BYTES = JWT_SECRET.encode()
+_JWT_HEADER_B64 = _b64_encode(b'{"alg":"HS256","typ":"JWT"}')
+# 预先完成密钥填充（ipad/opad）的 HMAC 模板，每次签名只需 copy() 后 update
+_JWT_HMAC_TEMPLATE = hmac.new(_JWT_SECRET_BYTES, b"", hashlib.sha256)
+
+def _jwt_sign(signing_input: bytes) -> bytes:
+    """计算 HS256 签名"""
+    h = _JWT_HMAC_TEMPLATE.copy()
+    h.update(signing_input)
+    return h.digest()
+
 def create_jwt_token(expire_hours: int = None) -> str:
     """创建 JWT Token"""
-    import json
-    
     if expire_hours is None:
         expire_hours = JWT_EXPIRE_HOURS
     
-    header = {"alg": "HS256", "typ": "JWT"}
+    now = int(time.time())
     payload = {
-        "iat": int(time.time()),
-        "exp": int(time.time()) + (expire_hours * 3600),
+        "iat": now,
+        "exp": now + (expire_hours * 3600),
         "role": "admin"
     }
     
-    header_b64 = _b64_encode(json.dumps(header, separators=(",", ":")).encode())
-    payload_b64 = _b64_encode(json.dumps(payload, separators=(",", ":")).encode())
+    payload_b64 = _b64_encode(orjson.dumps(payload))
     
-    message = f"{header_b64}.{payload_b64}"
-    signature = hmac.new(JWT_SECRET.encode(), message.encode(), hashlib.sha256).digest()
-    signature_b64 = _b64_encode(signature)
+    message = b".".join((_JWT_HEADER_B64, payload_b64))
+    signature_b64 = _b64_encode(_jwt_sign(message))
     
-    return f"{message}.{signature_b64}"
+    return b".".join((message, signature_b64)).decode("ascii")
+
+# 已验证 token 的 payload 缓存（LRU）：管理面板轮询时同一 token 反复验证，
+# 命中后只需检查过期时间，无需重新计算 HMAC 和解析 JSON
+_VERIFIED_TOKEN_CACHE_SIZE = 256
+_verified_tokens: "OrderedDict[str, dict]" = OrderedDict()
+_verified_tokens_lock = threading.Lock()
 
 def verify_jwt_token(token: str) -> dict:
     """验证 JWT Token，返回 payload 或抛出异常"""
-    import json
+    with _verified_tokens_lock:
+        cached = _verified_tokens.get(token)
+        if cached is not None:
+            if cached.get("exp", 0) >= time.time():
+                _verified_tokens.move_to_end(token)
+                return cached
+            del _verified_tokens[token]
     
     try:
-        parts = token.split(".")
+        raw = token.encode()
+        parts = raw.split(b".")
         if len(parts) != 3:
             raise ValueError("Invalid token format")
         
         header_b64, payload_b64, signature_b64 = parts
         
-        # 验证签名
-        message = f"{header_b64}.{payload_b64}"
-        expected_sig = hmac.new(JWT_SECRET.encode(), message.encode(), hashlib.sha256).digest()
+        # 验证签名（签名输入即 token 最后一个 "." 之前的部分，无需重新拼接）
+        expected_sig = _jwt_sign(raw[:len(header_b64) + 1 + len(payload_b64)])
         actual_sig = _b64_decode(signature_b64)
         
         if not hmac.compare_digest(expected_sig, actual_sig):
             raise ValueError("Invalid signature")
         
         # 解析 payload
-        payload = json.loads(_b64_decode(payload_b64))
+        payload = orjson.loads(_b64_decode(payload_b64))
         
         # 验证过期时间
         if payload.get("exp", 0) < time.time():
             raise ValueError("Token expired")
-        
-        return payload
     except Exception as e:
         raise ValueError(f"Token verification failed: {str(e)}")
+    
+    with _verified_tokens_lock:
+        _verified_tokens[token] = payload
+        if len(_verified_tokens) > _VERIFIED_TOKEN_CACHE_SIZE:
+            _verified_tokens.popitem(last=False)
+    return payload
 
 
 # ----------------------------------------------------------------------
@@ -105,7 +141,7 @@ async def admin_login(request: Request):
     admin_key = data.get("admin_key", "")
     expire_hours = data.get("expire_hours", JWT_EXPIRE_HOURS)
     
-    if admin_key != ADMIN_KEY:
+    if not _is_admin_key(admin_key):
         raise HTTPException(status_code=401, detail="Invalid admin key")
     
     token = create_jwt_token(expire_hours)
@@ -134,22 +170,28 @@ async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(secur
         raise HTTPException(status_code=401, detail=str(e))
 
 
-def verify_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """验证 Admin 权限（支持 JWT 和直接 admin key）"""
+def verify_admin(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    """验证 Admin 权限（支持 JWT 和直接 admin key）
+
+    返回认证信息：JWT 为解码后的 payload，直接 admin key 为 {"admin_key": True}。
+    同一请求内多个依赖都声明 Depends(verify_admin) 时，FastAPI 只执行一次并复用结果。
+    """
     if not credentials:
         raise HTTPException(status_code=401, detail="Authentication required")
     
     token = credentials.credentials
     
-    # 尝试 JWT 验证
+    # 先尝试直接 admin key（一次比较），再走开销更大的 JWT 验证
+    if _is_admin_key(token):
+        return {"admin_key": True}
+    
     try:
-        verify_jwt_token(token)
-        return True
+        return verify_jwt_token(token)
     except ValueError:
         pass
     
-    # 尝试直接 admin key
-    if token == ADMIN_KEY:
-        return True
-    
     raise HTTPException(status_code=401, detail="Invalid credentials")
+
+
+# 管理端点统一使用的认证依赖
+AdminAuth = Annotated[dict, Depends(verify_admin)]
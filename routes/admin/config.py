@@ -2,14 +2,14 @@
 """Admin 配置管理模块 - 配置、API Keys、账号管理"""
 import os
 
-from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import JSONResponse
 
-from core.config import CONFIG, save_config, logger
+from core.config import CONFIG, save_config, refresh_config_keys, logger
 from core.auth import init_account_queue, get_queue_status, get_account_identifier
 from core.deepseek import login_deepseek_via_account
 
-from .auth import verify_admin
+from .auth import AdminAuth
 
 router = APIRouter()
 
@@ -23,7 +23,7 @@ VERCEL_TEAM_ID = os.getenv("VERCEL_TEAM_ID", "")
 # Vercel 预配置信息
 # ----------------------------------------------------------------------
 @router.get("/vercel/config")
-async def get_vercel_config(_: bool = Depends(verify_admin)):
+async def get_vercel_config(_: AdminAuth):
     """获取预配置的 Vercel 信息（脱敏）"""
     return JSONResponse(content={
         "has_token": bool(VERCEL_TOKEN),
@@ -36,7 +36,7 @@ async def get_vercel_config(_: bool = Depends(verify_admin)):
 # 配置管理
 # ----------------------------------------------------------------------
 @router.get("/config")
-async def get_config(_: bool = Depends(verify_admin)):
+async def get_config(_: AdminAuth):
     """获取当前配置（密码脱敏）"""
     safe_config = {
         "keys": CONFIG.get("keys", []),
@@ -58,12 +58,13 @@ async def get_config(_: bool = Depends(verify_admin)):
 
 
 @router.post("/config")
-async def update_config(request: Request, _: bool = Depends(verify_admin)):
+async def update_config(request: Request, _: AdminAuth):
     """更新完整配置"""
     data = await request.json()
     
     if "keys" in data:
         CONFIG["keys"] = data["keys"]
+        refresh_config_keys()
     
     if "accounts" in data:
         # 保留原有密码和 token
@@ -89,7 +90,7 @@ async def update_config(request: Request, _: bool = Depends(verify_admin)):
 # API Keys 管理
 # ----------------------------------------------------------------------
 @router.post("/keys")
-async def add_key(request: Request, _: bool = Depends(verify_admin)):
+async def add_key(request: Request, _: AdminAuth):
     """添加 API Key"""
     data = await request.json()
     key = data.get("key", "").strip()
@@ -103,18 +104,20 @@ async def add_key(request: Request, _: bool = Depends(verify_admin)):
     if "keys" not in CONFIG:
         CONFIG["keys"] = []
     CONFIG["keys"].append(key)
+    refresh_config_keys()
     save_config(CONFIG)
     
     return JSONResponse(content={"success": True, "total_keys": len(CONFIG["keys"])})
 
 
 @router.delete("/keys/{key}")
-async def delete_key(key: str, _: bool = Depends(verify_admin)):
+async def delete_key(key: str, _: AdminAuth):
     """删除 API Key"""
     if key not in CONFIG.get("keys", []):
         raise HTTPException(status_code=404, detail="Key 不存在")
     
     CONFIG["keys"].remove(key)
+    refresh_config_keys()
     save_config(CONFIG)
     return JSONResponse(content={"success": True, "total_keys": len(CONFIG["keys"])})
 
@@ -124,9 +127,9 @@ async def delete_key(key: str, _: bool = Depends(verify_admin)):
 # ----------------------------------------------------------------------
 @router.get("/accounts")
 async def list_accounts(
+    _: AdminAuth,
     page: int = 1,
     page_size: int = 10,
-    _: bool = Depends(verify_admin)
 ):
     """获取账号列表（分页，倒序，密码脱敏）"""
     accounts = CONFIG.get("accounts", [])
@@ -166,7 +169,7 @@ async def list_accounts(
 
 
 @router.post("/accounts")
-async def add_account(request: Request, _: bool = Depends(verify_admin)):
+async def add_account(request: Request, _: AdminAuth):
     """添加账号"""
     data = await request.json()
     email = data.get("email", "").strip()
@@ -204,7 +207,7 @@ async def add_account(request: Request, _: bool = Depends(verify_admin)):
 
 
 @router.delete("/accounts/{identifier}")
-async def delete_account(identifier: str, _: bool = Depends(verify_admin)):
+async def delete_account(identifier: str, _: AdminAuth):
     """删除账号（通过 email 或 mobile）"""
     accounts = CONFIG.get("accounts", [])
     for i, acc in enumerate(accounts):
@@ -221,6 +224,6 @@ async def delete_account(identifier: str, _: bool = Depends(verify_admin)):
 # 账号队列状态
 # ----------------------------------------------------------------------
 @router.get("/queue/status")
-async def get_account_queue_status(_: bool = Depends(verify_admin)):
+async def get_account_queue_status(_: AdminAuth):
     """获取账号轮询队列状态"""
     return JSONResponse(content=get_queue_status())
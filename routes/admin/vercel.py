@@ -2,18 +2,19 @@
 """Admin Vercel 模块 - Vercel 同步和部署"""
 import asyncio
 import base64
-import json
+import importlib.util
 import os
+import random
 
-import httpx
-from fastapi import APIRouter, HTTPException, Request, Depends
-from fastapi.responses import JSONResponse
+import orjson
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 
-from core.config import CONFIG, save_config, logger
+from core.config import CONFIG, save_config, config_version, logger
 from core.auth import get_account_identifier, init_account_queue
 from core.deepseek import login_deepseek_via_account
 
-from .auth import verify_admin
+from .auth import AdminAuth
 
 router = APIRouter()
 
@@ -22,12 +23,85 @@ VERCEL_TOKEN = os.getenv("VERCEL_TOKEN", "")
 VERCEL_PROJECT_ID = os.getenv("VERCEL_PROJECT_ID", "")
 VERCEL_TEAM_ID = os.getenv("VERCEL_TEAM_ID", "")
 
+VERCEL_API_BASE = "https://api.vercel.com"
+
+# 同步前自动验证账号时的最大并发登录数
+SYNC_LOGIN_CONCURRENCY = max(1, int(os.getenv("DS2API_SYNC_CONCURRENCY", "8")))
+# 单个账号登录验证的超时（秒），避免一个卡住的登录拖住整个同步
+SYNC_LOGIN_TIMEOUT = float(os.getenv("DS2API_LOGIN_TIMEOUT", "10"))
+
+# Vercel API 限流（429）或暂不可用（503）时的最大尝试次数
+VERCEL_MAX_ATTEMPTS = 3
+
+# CONFIG 序列化结果缓存：(配置版本号, JSON 字符串, Base64)，配置未变化时直接复用
+_config_export_cache = None
+# /admin/export 响应体缓存：(配置版本号, 已序列化的 JSON bytes)，仅导出时按需生成
+_export_body_cache = None
+
+
+def _export_config_data():
+    """返回当前 CONFIG 的 (JSON 字符串, Base64)，按配置版本号缓存"""
+    global _config_export_cache
+    # 先读版本号再序列化：序列化期间的修改会使版本号变化，下次调用重新生成
+    version = config_version()
+    cached = _config_export_cache
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+    config_bytes = orjson.dumps(CONFIG, option=orjson.OPT_NON_STR_KEYS)
+    config_json = config_bytes.decode("utf-8")
+    config_b64 = base64.b64encode(config_bytes).decode("ascii")
+    _config_export_cache = (version, config_json, config_b64)
+    return config_json, config_b64
+
+
+# Vercel API 客户端：进程内复用连接（TLS 握手只做一次），安装 h2 时启用 HTTP/2，
+# 让 sync 中并发发出的请求复用同一连接；应用关闭时由 lifespan 调用 close_vercel_client。
+# httpx 只在这两个管理端点用到，首次调用时再导入，不计入服务启动时间
+_vercel_client = None
+
+
+def _get_vercel_client():
+    """获取（首次调用时创建）共享的 Vercel API 客户端"""
+    global _vercel_client
+    if _vercel_client is None:
+        import httpx
+
+        _vercel_client = httpx.AsyncClient(
+            http2=importlib.util.find_spec("h2") is not None,
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _vercel_client
+
+
+async def _vercel_request(method: str, url: str, **kwargs):
+    """通过共享客户端请求 Vercel API，遇到 429/503 时指数退避加随机抖动后重试"""
+    client = _get_vercel_client()
+    for attempt in range(1, VERCEL_MAX_ATTEMPTS + 1):
+        resp = await client.request(method, url, **kwargs)
+        if resp.status_code not in (429, 503) or attempt == VERCEL_MAX_ATTEMPTS:
+            return resp
+        delay = 2 ** (attempt - 1) + random.uniform(0, 0.5)
+        logger.warning(
+            f"[_vercel_request] {method} {url} 返回 {resp.status_code}，"
+            f"{delay:.1f}s 后重试（{attempt}/{VERCEL_MAX_ATTEMPTS}）"
+        )
+        await asyncio.sleep(delay)
+
+
+async def close_vercel_client() -> None:
+    """关闭共享的 Vercel API 客户端"""
+    global _vercel_client
+    if _vercel_client is not None:
+        client, _vercel_client = _vercel_client, None
+        await client.aclose()
+
 
 # ----------------------------------------------------------------------
 # API 测试（通过本地 API）
 # ----------------------------------------------------------------------
 @router.post("/test")
-async def test_api(request: Request, _: bool = Depends(verify_admin)):
+async def test_api(request: Request, _: AdminAuth):
     """测试 API 调用"""
     try:
         data = await request.json()
@@ -41,11 +115,20 @@ async def test_api(request: Request, _: bool = Depends(verify_admin)):
                 raise HTTPException(status_code=400, detail="没有可用的 API Key")
             api_key = keys[0]
         
-        host = request.headers.get("host", "localhost:5001")
-        scheme = "https" if "vercel" in host.lower() else "http"
-        base_url = f"{scheme}://{host}"
-        
-        async with httpx.AsyncClient(timeout=60.0) as client:
+        import httpx
+
+        # 默认通过 ASGITransport 在进程内调用本应用，省去回环 TCP 连接；
+        # ?external=1 时仍走真实 HTTP 请求，用于端到端验证部署
+        if request.query_params.get("external") == "1":
+            host = request.headers.get("host", "localhost:5001")
+            scheme = "https" if "vercel" in host.lower() else "http"
+            base_url = f"{scheme}://{host}"
+            transport = None
+        else:
+            base_url = "http://ds2api.local"
+            transport = httpx.ASGITransport(app=request.app)
+
+        async with httpx.AsyncClient(transport=transport, timeout=60.0) as client:
             response = await client.post(
                 f"{base_url}/v1/chat/completions",
                 headers={"Authorization": f"Bearer {api_key}"},
@@ -70,7 +153,7 @@ async def test_api(request: Request, _: bool = Depends(verify_admin)):
 # Vercel 同步
 # ----------------------------------------------------------------------
 @router.post("/vercel/sync")
-async def sync_to_vercel(request: Request, _: bool = Depends(verify_admin)):
+async def sync_to_vercel(request: Request, _: AdminAuth):
     """同步配置到 Vercel 并触发重新部署"""
     try:
         data = await request.json()
@@ -79,6 +162,7 @@ async def sync_to_vercel(request: Request, _: bool = Depends(verify_admin)):
         team_id = data.get("team_id", "")
         auto_validate = data.get("auto_validate", True)
         save_vercel_credentials = data.get("save_credentials", True)
+        force = data.get("force", False)
         
         use_preconfig = vercel_token == "__USE_PRECONFIG__" or not vercel_token
         if use_preconfig:
@@ -95,163 +179,206 @@ async def sync_to_vercel(request: Request, _: bool = Depends(verify_admin)):
         validated_count = 0
         failed_accounts = []
         if auto_validate:
-            accounts = CONFIG.get("accounts", [])
-            for acc in accounts:
+            # 登录是阻塞的网络请求：放到线程中并发执行，用信号量限制并发数
+            sem = asyncio.Semaphore(SYNC_LOGIN_CONCURRENCY)
+
+            async def _validate(acc: dict):
                 acc_id = get_account_identifier(acc)
-                if not acc.get("token", "").strip():
+                async with sem:
                     try:
                         logger.info(f"[sync_to_vercel] 自动验证账号: {acc_id}")
-                        login_deepseek_via_account(acc)
-                        validated_count += 1
+                        await asyncio.wait_for(
+                            asyncio.to_thread(login_deepseek_via_account, acc),
+                            timeout=SYNC_LOGIN_TIMEOUT,
+                        )
+                        return acc_id, None
+                    except asyncio.TimeoutError:
+                        return acc_id, f"登录超时（{SYNC_LOGIN_TIMEOUT:g}s）"
                     except Exception as e:
-                        logger.warning(f"[sync_to_vercel] 账号 {acc_id} 验证失败: {e}")
-                        failed_accounts.append(acc_id)
-                    await asyncio.sleep(0.5)
+                        return acc_id, e
+
+            pending = [acc for acc in CONFIG.get("accounts", []) if not acc.get("token", "").strip()]
+            for acc_id, error in await asyncio.gather(*(_validate(acc) for acc in pending)):
+                if error is None:
+                    validated_count += 1
+                else:
+                    logger.warning(f"[sync_to_vercel] 账号 {acc_id} 验证失败: {error}")
+                    failed_accounts.append(acc_id)
         
-        config_json = json.dumps(CONFIG, ensure_ascii=False, separators=(",", ":"))
-        config_b64 = base64.b64encode(config_json.encode("utf-8")).decode("utf-8")
+        _, config_b64 = _export_config_data()
         
         headers = {"Authorization": f"Bearer {vercel_token}"}
-        base_url = "https://api.vercel.com"
+        # 本次同步用到的项目 URL 只拼接一次
+        project_url = f"{VERCEL_API_BASE}/v9/projects/{project_id}"
+        env_url = f"{project_url}/env"
+        env_create_url = f"{VERCEL_API_BASE}/v10/projects/{project_id}/env"
+        
+        params = {"teamId": team_id} if team_id else {}
+        env_resp = await _vercel_request(
+            "GET",
+            env_url,
+            headers=headers,
+            params=params,
+        )
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            params = {"teamId": team_id} if team_id else {}
-            env_resp = await client.get(
-                f"{base_url}/v9/projects/{project_id}/env",
+        if env_resp.status_code != 200:
+            raise HTTPException(status_code=env_resp.status_code, detail=f"获取环境变量失败: {env_resp.text}")
+        
+        env_vars = env_resp.json().get("envs", [])
+        # 按 key 建索引（同名保留第一个），避免每个变量都线性扫描一遍
+        env_by_key = {}
+        for env in env_vars:
+            key = env.get("key")
+            if key:
+                env_by_key.setdefault(key, env)
+        
+        async def _upsert_env(key: str, value: str):
+            """已存在则更新，否则创建（加密，production + preview）"""
+            existing = env_by_key.get(key)
+            if existing:
+                return await _vercel_request(
+                    "PATCH",
+                    f"{env_url}/{existing['id']}",
+                    headers=headers,
+                    params=params,
+                    json={"value": value},
+                )
+            return await _vercel_request(
+                "POST",
+                env_create_url,
                 headers=headers,
                 params=params,
+                json={
+                    "key": key,
+                    "value": value,
+                    "type": "encrypted",
+                    "target": ["production", "preview"],
+                },
             )
-            
-            if env_resp.status_code != 200:
-                raise HTTPException(status_code=env_resp.status_code, detail=f"获取环境变量失败: {env_resp.text}")
-            
-            env_vars = env_resp.json().get("envs", [])
-            existing_env = None
-            for env in env_vars:
-                if env.get("key") == "DS2API_CONFIG_JSON":
-                    existing_env = env
-                    break
-            
-            if existing_env:
-                env_id = existing_env["id"]
-                update_resp = await client.patch(
-                    f"{base_url}/v9/projects/{project_id}/env/{env_id}",
+        
+        # 保存 Vercel 凭证
+        creds_to_save = []
+        if save_vercel_credentials and not use_preconfig:
+            creds_to_save = [
+                ("VERCEL_TOKEN", vercel_token),
+                ("VERCEL_PROJECT_ID", project_id),
+            ]
+            if team_id:
+                creds_to_save.append(("VERCEL_TEAM_ID", team_id))
+        
+        def _saved_keys(resps):
+            """凭证保存失败不影响同步结果，只返回保存成功的 key"""
+            return [
+                key
+                for (key, _), resp in zip(creds_to_save, resps)
+                if not isinstance(resp, BaseException) and resp.status_code in [200, 201]
+            ]
+        
+        # 远端配置与本次上传内容一致时跳过上传和重新部署（force=true 可强制部署）
+        existing_config = env_by_key.get("DS2API_CONFIG_JSON")
+        if existing_config and not force:
+            unchanged = False
+            try:
+                current_resp = await _vercel_request(
+                    "GET",
+                    f"{VERCEL_API_BASE}/v1/projects/{project_id}/env/{existing_config['id']}",
                     headers=headers,
                     params=params,
-                    json={"value": config_b64},
                 )
-                if update_resp.status_code not in [200, 201]:
-                    raise HTTPException(status_code=update_resp.status_code, detail=f"更新环境变量失败: {update_resp.text}")
-            else:
-                create_resp = await client.post(
-                    f"{base_url}/v10/projects/{project_id}/env",
+                if current_resp.status_code == 200:
+                    unchanged = current_resp.json().get("value") == config_b64
+            except Exception as e:
+                logger.warning(f"[sync_to_vercel] 读取远端配置失败，按有变化处理: {e}")
+            if unchanged:
+                cred_resps = await asyncio.gather(
+                    *(_upsert_env(key, value) for key, value in creds_to_save),
+                    return_exceptions=True,
+                )
+                result = {
+                    "success": True,
+                    "unchanged": True,
+                    "message": "Vercel 上的配置未变化，已跳过上传和重新部署",
+                    "validated_accounts": validated_count,
+                }
+                if failed_accounts:
+                    result["failed_accounts"] = failed_accounts
+                saved_credentials = _saved_keys(cred_resps)
+                if saved_credentials:
+                    result["saved_credentials"] = saved_credentials
+                return JSONResponse(content=result)
+        
+        # 配置、凭证写入与项目信息查询互不依赖，并发发出；部署需等待写入完成
+        config_resp, project_resp, *cred_resps = await asyncio.gather(
+            _upsert_env("DS2API_CONFIG_JSON", config_b64),
+            _vercel_request(
+                "GET",
+                project_url,
+                headers=headers,
+                params=params,
+            ),
+            *(_upsert_env(key, value) for key, value in creds_to_save),
+            return_exceptions=True,
+        )
+        
+        if isinstance(config_resp, BaseException):
+            raise config_resp
+        if config_resp.status_code not in [200, 201]:
+            action = "更新" if "DS2API_CONFIG_JSON" in env_by_key else "创建"
+            raise HTTPException(status_code=config_resp.status_code, detail=f"{action}环境变量失败: {config_resp.text}")
+        
+        saved_credentials = _saved_keys(cred_resps)
+        
+        # 触发重新部署
+        if isinstance(project_resp, BaseException):
+            raise project_resp
+        if project_resp.status_code == 200:
+            project_data = project_resp.json()
+            repo = project_data.get("link", {})
+            
+            if repo.get("type") == "github":
+                deploy_resp = await _vercel_request(
+                    "POST",
+                    f"{VERCEL_API_BASE}/v13/deployments",
                     headers=headers,
                     params=params,
                     json={
-                        "key": "DS2API_CONFIG_JSON",
-                        "value": config_b64,
-                        "type": "encrypted",
-                        "target": ["production", "preview"],
+                        "name": project_id,
+                        "project": project_id,
+                        "target": "production",
+                        "gitSource": {
+                            "type": "github",
+                            "repoId": repo.get("repoId"),
+                            "ref": repo.get("productionBranch", "main"),
+                        },
                     },
                 )
-                if create_resp.status_code not in [200, 201]:
-                    raise HTTPException(status_code=create_resp.status_code, detail=f"创建环境变量失败: {create_resp.text}")
-            
-            # 保存 Vercel 凭证
-            saved_credentials = []
-            if save_vercel_credentials and not use_preconfig:
-                creds_to_save = [
-                    ("VERCEL_TOKEN", vercel_token),
-                    ("VERCEL_PROJECT_ID", project_id),
-                ]
-                if team_id:
-                    creds_to_save.append(("VERCEL_TEAM_ID", team_id))
-                
-                for key, value in creds_to_save:
-                    existing = None
-                    for env in env_vars:
-                        if env.get("key") == key:
-                            existing = env
-                            break
-                    
-                    if existing:
-                        upd_resp = await client.patch(
-                            f"{base_url}/v9/projects/{project_id}/env/{existing['id']}",
-                            headers=headers,
-                            params=params,
-                            json={"value": value},
-                        )
-                        if upd_resp.status_code in [200, 201]:
-                            saved_credentials.append(key)
-                    else:
-                        crt_resp = await client.post(
-                            f"{base_url}/v10/projects/{project_id}/env",
-                            headers=headers,
-                            params=params,
-                            json={
-                                "key": key,
-                                "value": value,
-                                "type": "encrypted",
-                                "target": ["production", "preview"],
-                            },
-                        )
-                        if crt_resp.status_code in [200, 201]:
-                            saved_credentials.append(key)
-            
-            # 触发重新部署
-            project_resp = await client.get(
-                f"{base_url}/v9/projects/{project_id}",
-                headers=headers,
-                params=params,
-            )
-            
-            if project_resp.status_code == 200:
-                project_data = project_resp.json()
-                repo = project_data.get("link", {})
                 
-                if repo.get("type") == "github":
-                    deploy_resp = await client.post(
-                        f"{base_url}/v13/deployments",
-                        headers=headers,
-                        params=params,
-                        json={
-                            "name": project_id,
-                            "project": project_id,
-                            "target": "production",
-                            "gitSource": {
-                                "type": "github",
-                                "repoId": repo.get("repoId"),
-                                "ref": repo.get("productionBranch", "main"),
-                            },
-                        },
-                    )
-                    
-                    if deploy_resp.status_code in [200, 201]:
-                        deploy_data = deploy_resp.json()
-                        result = {
-                            "success": True,
-                            "message": "配置已同步，正在重新部署...",
-                            "deployment_url": deploy_data.get("url"),
-                            "validated_accounts": validated_count,
-                        }
-                        if failed_accounts:
-                            result["failed_accounts"] = failed_accounts
-                        if saved_credentials:
-                            result["saved_credentials"] = saved_credentials
-                        return JSONResponse(content=result)
-            
-            result = {
-                "success": True,
-                "message": "配置已同步到 Vercel，请手动触发重新部署",
-                "manual_deploy_required": True,
-                "validated_accounts": validated_count,
-            }
-            if failed_accounts:
-                result["failed_accounts"] = failed_accounts
-            if saved_credentials:
-                result["saved_credentials"] = saved_credentials
-            return JSONResponse(content=result)
-            
+                if deploy_resp.status_code in [200, 201]:
+                    deploy_data = deploy_resp.json()
+                    result = {
+                        "success": True,
+                        "message": "配置已同步，正在重新部署...",
+                        "deployment_url": deploy_data.get("url"),
+                        "validated_accounts": validated_count,
+                    }
+                    if failed_accounts:
+                        result["failed_accounts"] = failed_accounts
+                    if saved_credentials:
+                        result["saved_credentials"] = saved_credentials
+                    return JSONResponse(content=result)
+        
+        result = {
+            "success": True,
+            "message": "配置已同步到 Vercel，请手动触发重新部署",
+            "manual_deploy_required": True,
+            "validated_accounts": validated_count,
+        }
+        if failed_accounts:
+            result["failed_accounts"] = failed_accounts
+        if saved_credentials:
+            result["saved_credentials"] = saved_credentials
+        return JSONResponse(content=result)
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -263,12 +390,14 @@ async def sync_to_vercel(request: Request, _: bool = Depends(verify_admin)):
 # 导出配置
 # ----------------------------------------------------------------------
 @router.get("/export")
-async def export_config(_: bool = Depends(verify_admin)):
+async def export_config(_: AdminAuth):
     """导出完整配置（JSON 和 Base64）"""
-    config_json = json.dumps(CONFIG, ensure_ascii=False, separators=(",", ":"))
-    config_b64 = base64.b64encode(config_json.encode("utf-8")).decode("utf-8")
-    
-    return JSONResponse(content={
-        "json": config_json,
-        "base64": config_b64,
-    })
+    global _export_body_cache
+    version = config_version()
+    cached = _export_body_cache
+    if cached is None or cached[0] != version:
+        config_json, config_b64 = _export_config_data()
+        body = orjson.dumps({"json": config_json, "base64": config_b64})
+        cached = _export_body_cache = (version, body)
+    # 直接返回已序列化的 bytes，跳过 JSONResponse 的再次编码
+    return Response(content=cached[1], media_type="application/json")
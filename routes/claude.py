@@ -1,43 +1,112 @@
 # -*- coding: utf-8 -*-
 """Claude API 路由"""
-import json
-import random
+import asyncio
+import secrets
 import time
 
+import orjson
 from curl_cffi import requests as cffi_requests
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import JSONResponse, StreamingResponse
 
 from core.config import CONFIG, logger
 from core.auth import (
     determine_mode_and_token,
     get_auth_headers,
 )
-from core.deepseek import call_completion_endpoint
+from core.deepseek import acall_completion_endpoint
 from core.session_manager import (
-    create_session,
-    get_pow,
+    create_session_and_pow,
     cleanup_account,
 )
-from core.models import get_model_config, get_claude_models_response
+from core.models import DEFAULT_MODEL_CONFIG, get_model_config, get_claude_models_response
 from core.sse_parser import (
-    parse_deepseek_sse_line,
-    parse_sse_chunk_for_content,
-    extract_content_from_chunk,
-    collect_deepseek_response,
+    aiter_classified_events,
+    acollect_deepseek_response,
     parse_tool_calls,
+    ToolCallStreamParser,
+    ToolCallTextGate,
 )
-from core.constants import STREAM_IDLE_TIMEOUT
-from core.utils import estimate_tokens
+from core.constants import (
+    KEEP_ALIVE_TIMEOUT,
+    SSE_KEEPALIVE,
+    STREAM_IDLE_TIMEOUT,
+)
+from core.response_cache import RESPONSE_CACHE, response_cache_key
+from core.utils import ORJSONResponse, estimate_tokens, sse_response
 from core.messages import (
     messages_prepare,
     convert_claude_to_deepseek,
+    build_tool_system_message,
     CLAUDE_DEFAULT_MODEL,
 )
 
 router = APIRouter()
 
 
+# SSE data 帧的固定前后缀，模块加载时建好，每个事件只做字节拼接
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+
+# 只有下标或文本不同的骨架事件预先按 orjson 的紧凑输出写好，不再逐个构建字典并序列化
+_TEXT_BLOCK_START = b'data: {"type":"content_block_start","index":0,"content_block":{"type":"text","text":""}}\n\n'
+_TEXT_DELTA_PREFIX = b'data: {"type":"content_block_delta","index":0,"delta":{"type":"text_delta","text":'
+_TEXT_DELTA_SUFFIX = b"}}\n\n"
+_CONTENT_BLOCK_STOP = b'data: {"type":"content_block_stop","index":%d}\n\n'
+_MESSAGE_STOP = b'data: {"type":"message_stop"}\n\n'
+
+
+def _sse_event(event: dict) -> bytes:
+    """把事件序列化为一条 SSE data 帧（orjson 直接产出 UTF-8 字节，StreamingResponse 无需再编码）"""
+    return _SSE_PREFIX + orjson.dumps(event) + _SSE_SUFFIX
+
+
+def _tool_use_events(tool_use_id: str, index: int, tool_info: dict) -> bytes:
+    """一个工具调用对应的 content_block_start + content_block_stop 两帧"""
+    return _sse_event({
+        "type": "content_block_start",
+        "index": index,
+        "content_block": {"type": "tool_use", "id": tool_use_id, "name": tool_info["name"], "input": tool_info["input"]},
+    }) + _CONTENT_BLOCK_STOP % index
+
+
+async def _replay_cached(cached: tuple):
+    """把缓存的 (思考, 正文) 按原顺序重放为两个事件，复用流式发送逻辑"""
+    reasoning, content = cached
+    if reasoning:
+        yield ("thinking", reasoning)
+    if content:
+        yield ("text", content)
+
+
+# convert_claude_to_deepseek 读取的可选请求字段
+_CLAUDE_PASSTHROUGH_KEYS = ("system", "temperature", "top_p", "stop_sequences", "stream")
+# 影响输出、需要计入响应缓存键的可选请求字段（stream 单独计入）
+_CLAUDE_CACHE_KEY_FIELDS = ("system", "temperature", "top_p", "stop_sequences")
+
+
+def _normalize_message(message: dict, _isinstance=isinstance, _str=str) -> dict:
+    """把数组形式的 content 合并为文本（text 与 tool_result 块）
+
+    content 不是数组、或数组里没有可提取文本时原样返回，不复制消息字典；下游只读取消息。
+    """
+    content = message.get("content")
+    if not _isinstance(content, list):
+        return message
+    content_parts = []
+    add = content_parts.append
+    for content_block in content:
+        block_type = content_block.get("type")
+        if block_type == "text":
+            if "text" in content_block:
+                add(content_block["text"])
+        elif block_type == "tool_result" and "content" in content_block:
+            add(_str(content_block["content"]))
+    if content_parts:
+        return {**message, "content": "\n".join(content_parts)}
+    if content:
+        return message
+    return {**message, "content": ""}
+
 
 # ----------------------------------------------------------------------
 # 通过 OpenAI 接口调用 Claude
@@ -47,11 +116,9 @@ async def call_claude_via_openai(request: Request, claude_payload: dict):
     deepseek_payload = convert_claude_to_deepseek(claude_payload)
 
     try:
-        session_id = create_session(request)
+        session_id, pow_resp = await create_session_and_pow(request)
         if not session_id:
             raise HTTPException(status_code=401, detail="invalid token.")
-
-        pow_resp = get_pow(request)
         if not pow_resp:
             raise HTTPException(
                 status_code=401,
@@ -61,12 +128,8 @@ async def call_claude_via_openai(request: Request, claude_payload: dict):
         model = deepseek_payload.get("model", "deepseek-chat")
         messages = deepseek_payload.get("messages", [])
 
-        # 使用会话管理器获取模型配置
-        thinking_enabled, search_enabled = get_model_config(model)
-        if thinking_enabled is None:
-            # 默认配置
-            thinking_enabled = False
-            search_enabled = False
+        # 获取模型配置，未知模型直接使用默认配置
+        thinking_enabled, search_enabled = get_model_config(model, DEFAULT_MODEL_CONFIG)
 
         final_prompt = messages_prepare(messages)
 
@@ -80,11 +143,11 @@ async def call_claude_via_openai(request: Request, claude_payload: dict):
             "search_enabled": search_enabled,
         }
 
-        deepseek_resp = call_completion_endpoint(payload, headers, max_attempts=3)
+        deepseek_resp = await acall_completion_endpoint(payload, headers, max_attempts=3)
         return deepseek_resp
 
     except Exception as e:
-        logger.error(f"[call_claude_via_openai] 调用失败: {e}")
+        logger.error("[call_claude_via_openai] 调用失败: %s", e)
         return None
 
 
@@ -94,7 +157,7 @@ async def call_claude_via_openai(request: Request, claude_payload: dict):
 @router.get("/anthropic/v1/models")
 def list_claude_models():
     data = get_claude_models_response()
-    return JSONResponse(content=data, status_code=200)
+    return ORJSONResponse(content=data, status_code=200)
 
 
 # ----------------------------------------------------------------------
@@ -104,14 +167,14 @@ def list_claude_models():
 async def claude_messages(request: Request):
     try:
         try:
-            determine_mode_and_token(request)
+            await determine_mode_and_token(request)
         except HTTPException as exc:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=exc.status_code, content={"error": exc.detail}
             )
         except Exception as exc:
-            logger.error(f"[claude_messages] determine_mode_and_token 异常: {exc}")
-            return JSONResponse(
+            logger.error("[claude_messages] determine_mode_and_token 异常: %s", exc)
+            return ORJSONResponse(
                 status_code=500, content={"error": "Claude authentication failed."}
             )
 
@@ -125,141 +188,87 @@ async def claude_messages(request: Request):
             )
 
         # 标准化消息内容
-        normalized_messages = []
-        for message in messages:
-            normalized_message = message.copy()
-            if isinstance(message.get("content"), list):
-                content_parts = []
-                for content_block in message["content"]:
-                    if content_block.get("type") == "text" and "text" in content_block:
-                        content_parts.append(content_block["text"])
-                    elif content_block.get("type") == "tool_result":
-                        if "content" in content_block:
-                            content_parts.append(str(content_block["content"]))
-                if content_parts:
-                    normalized_message["content"] = "\n".join(content_parts)
-                elif isinstance(message.get("content"), list) and message["content"]:
-                    normalized_message["content"] = message["content"]
-                else:
-                    normalized_message["content"] = ""
-            normalized_messages.append(normalized_message)
+        normalized_messages = [_normalize_message(m) for m in messages]
 
         tools_requested = req_data.get("tools") or []
-        has_tools = len(tools_requested) > 0
-
-        payload = req_data.copy()
-        payload["messages"] = normalized_messages.copy()
-
-        # 如果有工具定义，添加工具使用指导的系统消息
-        if has_tools and not any(m.get("role") == "system" for m in payload["messages"]):
-            tool_schemas = []
-            for tool in tools_requested:
-                tool_name = tool.get("name", "unknown")
-                tool_desc = tool.get("description", "No description available")
-                schema = tool.get("input_schema", {})
-
-                tool_info = f"Tool: {tool_name}\nDescription: {tool_desc}"
-                if "properties" in schema:
-                    props = []
-                    required = schema.get("required", [])
-                    for prop_name, prop_info in schema["properties"].items():
-                        prop_type = prop_info.get("type", "string")
-                        is_req = " (required)" if prop_name in required else ""
-                        props.append(f"  - {prop_name}: {prop_type}{is_req}")
-                    if props:
-                        tool_info += f"\nParameters:\n{chr(10).join(props)}"
-                tool_schemas.append(tool_info)
-
-            system_message = {
-                "role": "system",
-                "content": f"""You are Claude, a helpful AI assistant. You have access to these tools:
-
-{chr(10).join(tool_schemas)}
-
-When you need to use tools, you can call multiple tools in a single response. Use this format:
-
-{{"tool_calls": [
-  {{"name": "tool1", "input": {{"param": "value"}}}},
-  {{"name": "tool2", "input": {{"param": "value"}}}}
-]}}
-
-IMPORTANT: You can call multiple tools in ONE response.
-
-Remember: Output ONLY the JSON, no other text. The response must start with {{ and end with ]}}""",
-            }
-            payload["messages"].insert(0, system_message)
-
-        deepseek_resp = await call_claude_via_openai(request, payload)
-        if not deepseek_resp:
-            raise HTTPException(status_code=500, detail="Failed to get Claude response.")
-
-        if deepseek_resp.status_code != 200:
-            deepseek_resp.close()
-            return JSONResponse(
-                status_code=500,
-                content={"error": {"type": "api_error", "message": "Failed to get response"}},
+
+        # 如果有工具定义，在最前面加上工具使用指导的系统消息（构建新列表，不修改原消息）
+        prompt_messages = normalized_messages
+        if tools_requested and not any(m.get("role") == "system" for m in normalized_messages):
+            # 工具定义按序列化字节缓存；缓存的字典被共享，加入前先复制
+            system_message = dict(build_tool_system_message(orjson.dumps(tools_requested)))
+            prompt_messages = [system_message, *normalized_messages]
+
+        # 只传 convert_claude_to_deepseek 会读取的字段，不复制整个请求体
+        payload = {"model": model, "messages": prompt_messages}
+        for key in _CLAUDE_PASSTHROUGH_KEYS:
+            if key in req_data:
+                payload[key] = req_data[key]
+
+        stream = bool(req_data.get("stream", False))
+
+        # 重复的相同请求（常见于 agent 重试）直接复用上游输出，跳过会话创建与补全请求；
+        # 流式输出不区分思考与正文，两种模式分开缓存。
+        # 只在配置模式下缓存：用户 token 模式下 token 由上游校验，命中缓存会跳过校验；
+        # 键中包含调用方密钥，不同密钥之间不共享缓存
+        cache_key = None
+        cached = None
+        if CONFIG.get("response_cache", False) and request.state.use_config_token:
+            caller_key = request.headers.get("Authorization", "")[7:].strip()
+            cache_key = response_cache_key(
+                caller_key,
+                model,
+                stream,
+                normalized_messages,
+                tools_requested,
+                *(req_data.get(key) for key in _CLAUDE_CACHE_KEY_FIELDS),
             )
+            cached = RESPONSE_CACHE.get(cache_key)
+
+        deepseek_resp = None
+        if cached is None:
+            deepseek_resp = await call_claude_via_openai(request, payload)
+            if not deepseek_resp:
+                raise HTTPException(status_code=500, detail="Failed to get Claude response.")
+
+            if deepseek_resp.status_code != 200:
+                await deepseek_resp.aclose()
+                return ORJSONResponse(
+                    status_code=500,
+                    content={"error": {"type": "api_error", "message": "Failed to get response"}},
+                )
 
         # 流式响应或普通响应
-        if bool(req_data.get("stream", False)):
+        if stream:
 
-            def claude_sse_stream():
-                # 使用导入的常量（不再本地定义）
+            # 响应来自 AsyncSession，逐块读取直接在事件循环上 await，不占线程池
+            async def claude_sse_stream():
+                # 上游事件由独立的协程任务读取并放入 asyncio.Queue，消费端带超时等待，
+                # 上游长时间无数据时也能按保活周期发送注释行
+                producer = None
                 try:
-                    message_id = f"msg_{int(time.time())}_{random.randint(1000, 9999)}"
-                    input_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+                    # 消息 ID 与各工具调用 ID 共用同一个时间戳和随机串，只生成一次
+                    id_suffix = f"{int(time.time())}_{secrets.token_hex(3)}"
+                    message_id = f"msg_{id_suffix}"
+                    # orjson 在 C 层一次序列化全部消息，按字节数估算，不再逐条 str()
+                    input_tokens = len(orjson.dumps(messages)) >> 2
                     output_tokens = 0
-                    full_response_text = ""
+                    output_chars = 0
+                    # 需要写入缓存时才按思考 / 正文分别保留完整输出
+                    keep_parts = cache_key is not None and cached is None
+                    thinking_parts = []
+                    text_parts = []
+                    timed_out = False
+                    # 声明了工具时正文经过闸门：工具调用 JSON 交给增量解析，每个工具对象一闭合就发出
+                    gate = ToolCallTextGate() if tools_requested else None
+                    tool_parser = ToolCallStreamParser(tools_requested) if tools_requested else None
+                    content_index = 0
+                    text_block_open = False
                     last_content_time = time.time()
+                    last_send_time = last_content_time
                     has_content = False
 
-
-                    for line in deepseek_resp.iter_lines():
-                        current_time = time.time()
-                        
-                        # 智能超时检测
-                        if has_content and (current_time - last_content_time) > STREAM_IDLE_TIMEOUT:
-                            logger.warning(f"[claude_sse_stream] 智能超时: 已有内容但 {STREAM_IDLE_TIMEOUT}s 无新数据，强制结束")
-                            break
-                        
-                        if not line:
-                            continue
-                        try:
-                            line_str = line.decode("utf-8")
-                        except Exception:
-                            continue
-
-                        if line_str.startswith("data:"):
-                            data_str = line_str[5:].strip()
-                            if data_str == "[DONE]":
-                                break
-
-                            try:
-                                chunk = json.loads(data_str)
-                                
-                                # 检测内容审核/敏感词阻止
-                                if "error" in chunk or chunk.get("code") == "content_filter":
-                                    logger.warning(f"[claude_sse_stream] 检测到内容过滤: {chunk}")
-                                    break
-                                
-                                if "v" in chunk and isinstance(chunk["v"], str):
-                                    content = chunk["v"]
-                                    # 检查是否是 FINISHED 状态
-                                    if content == "FINISHED":
-                                        break
-                                    full_response_text += content
-                                    if content:
-                                        has_content = True
-                                        last_content_time = current_time
-                                elif "v" in chunk and isinstance(chunk["v"], list):
-                                    for item in chunk["v"]:
-                                        if item.get("p") == "status" and item.get("v") == "FINISHED":
-                                            break
-                            except (json.JSONDecodeError, KeyError):
-                                continue
-
-                    # 发送Claude格式的事件
-                    message_start = {
+                    yield _sse_event({
                         "type": "message_start",
                         "message": {
                             "id": message_id,
@@ -271,114 +280,164 @@ Remember: Output ONLY the JSON, no other text. The response must start with {{ a
                             "stop_sequence": None,
                             "usage": {"input_tokens": input_tokens, "output_tokens": 0},
                         },
-                    }
-                    yield f"data: {json.dumps(message_start)}\n\n"
+                    })
 
-                    # 检查工具调用
-                    # 使用公共函数检测工具调用
-                    detected_tools = parse_tool_calls(full_response_text, tools_requested)
+                    # 思考与正文都按文本发出；只有正文会被判定为工具调用
+                    events = aiter_classified_events(deepseek_resp) if cached is None else _replay_cached(cached)
+                    event_queue = asyncio.Queue()
+                    put = event_queue.put_nowait
 
-                    content_index = 0
-                    if detected_tools:
-                        stop_reason = "tool_use"
-                        for tool_info in detected_tools:
-                            tool_use_id = f"toolu_{int(time.time())}_{random.randint(1000, 9999)}_{content_index}"
-                            tool_name = tool_info["name"]
-                            tool_input = tool_info["input"]
-
-                            yield f"data: {json.dumps({'type': 'content_block_start', 'index': content_index, 'content_block': {'type': 'tool_use', 'id': tool_use_id, 'name': tool_name, 'input': tool_input}})}\n\n"
-                            yield f"data: {json.dumps({'type': 'content_block_stop', 'index': content_index})}\n\n"
-
-                            content_index += 1
-                            output_tokens += len(str(tool_input)) // 4
-                    else:
-                        stop_reason = "end_turn"
-                        if full_response_text:
-                            yield f"data: {json.dumps({'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}})}\n\n"
-                            yield f"data: {json.dumps({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': full_response_text}})}\n\n"
-                            yield f"data: {json.dumps({'type': 'content_block_stop', 'index': 0})}\n\n"
-                            output_tokens += len(full_response_text) // 4
+                    async def pump_events():
+                        """读取上游事件投递到队列，结束时投递 None；读取异常由 await 该任务的消费端抛出"""
+                        try:
+                            async for event in events:
+                                put(event)
+                        finally:
+                            put(None)
+                            if deepseek_resp is not None:
+                                try:
+                                    await deepseek_resp.aclose()
+                                except Exception:
+                                    pass
+
+                    producer = asyncio.create_task(pump_events())
+
+                    while True:
+                        # 智能超时检测
+                        if has_content and (time.time() - last_content_time) > STREAM_IDLE_TIMEOUT:
+                            logger.warning("[claude_sse_stream] 智能超时: 已有内容但 %ss 无新数据，强制结束", STREAM_IDLE_TIMEOUT)
+                            timed_out = True
+                            break
 
-                    yield f"data: {json.dumps({'type': 'message_delta', 'delta': {'stop_reason': stop_reason, 'stop_sequence': None}, 'usage': {'output_tokens': output_tokens}})}\n\n"
-                    yield f"data: {json.dumps({'type': 'message_stop'})}\n\n"
+                        try:
+                            event = await asyncio.wait_for(event_queue.get(), timeout=KEEP_ALIVE_TIMEOUT)
+                        except asyncio.TimeoutError:
+                            # 一个保活周期内上游没有新数据，发送注释行防止连接被代理断开
+                            yield SSE_KEEPALIVE
+                            last_send_time = time.time()
+                            continue
+                        if event is None:
+                            # 上游读取结束；读取过程中的异常在这里抛出，交给下方统一发送错误事件
+                            await producer
+                            break
+                        kind, content = event
+                        current_time = time.time()
+
+                        # 缓冲工具调用期间上游仍有数据但下游收不到，同样定期发送注释行
+                        if current_time - last_send_time >= KEEP_ALIVE_TIMEOUT:
+                            yield SSE_KEEPALIVE
+                            last_send_time = current_time
+
+                        if kind == "ping":
+                            continue
+                        if kind == "finished":
+                            break
+                        has_content = True
+                        last_content_time = current_time
+                        if keep_parts:
+                            (text_parts if kind == "text" else thinking_parts).append(content)
+
+                        tool_chunk = ""
+                        if gate is not None:
+                            if kind == "text":
+                                content, tool_chunk = gate.feed(content)
+                            elif gate.tool_text is not None:
+                                # 工具调用开始后不再发出文本
+                                continue
+                        if content:
+                            if not text_block_open:
+                                yield _TEXT_BLOCK_START
+                                text_block_open = True
+                            yield _TEXT_DELTA_PREFIX + orjson.dumps(content) + _TEXT_DELTA_SUFFIX
+                            output_chars += len(content)
+                            last_send_time = current_time
+                        if tool_chunk:
+                            for tool_info in tool_parser.feed(tool_chunk):
+                                # 工具块跟在已发出的说明文字之后，先结束文本块
+                                if text_block_open:
+                                    yield _CONTENT_BLOCK_STOP % 0
+                                    text_block_open = False
+                                    content_index = 1
+                                yield _tool_use_events(f"toolu_{id_suffix}_{content_index}", content_index, tool_info)
+                                content_index += 1
+                                output_tokens += len(str(tool_info["input"])) // 4
+                                last_send_time = current_time
+
+                    # 超时中断的输出不完整，不写入缓存
+                    if keep_parts and not timed_out and (thinking_parts or text_parts):
+                        RESPONSE_CACHE.set(cache_key, ("".join(thinking_parts), "".join(text_parts)))
+
+                    # 增量解析没有产出工具调用时，对工具 JSON 再做一次批量解析；仍然没有就作为普通文本补发
+                    streamed_tools = tool_parser is not None and tool_parser.found > 0
+                    detected_tools = []
+                    pending_text = ""
+                    if gate is not None and not streamed_tools:
+                        if gate.tool_text is None:
+                            pending_text = gate.flush()
+                        else:
+                            detected_tools = parse_tool_calls(gate.tool_text, tools_requested)
+                            if not detected_tools:
+                                pending_text = gate.tool_text
+                    if pending_text:
+                        if not text_block_open:
+                            yield _TEXT_BLOCK_START
+                            text_block_open = True
+                        yield _TEXT_DELTA_PREFIX + orjson.dumps(pending_text) + _TEXT_DELTA_SUFFIX
+                        output_chars += len(pending_text)
+
+                    if text_block_open:
+                        yield _CONTENT_BLOCK_STOP % 0
+                        content_index = 1
+                    output_tokens += output_chars // 4
+
+                    for tool_info in detected_tools:
+                        yield _tool_use_events(f"toolu_{id_suffix}_{content_index}", content_index, tool_info)
+                        content_index += 1
+                        output_tokens += len(str(tool_info["input"])) // 4
+
+                    stop_reason = "tool_use" if streamed_tools or detected_tools else "end_turn"
+
+                    yield _sse_event({"type": "message_delta", "delta": {"stop_reason": stop_reason, "stop_sequence": None}, "usage": {"output_tokens": output_tokens}})
+                    yield _MESSAGE_STOP
 
                 except Exception as e:
-                    logger.error(f"[claude_sse_stream] 异常: {e}")
+                    logger.error("[claude_sse_stream] 异常: %s", e)
                     error_event = {
                         "type": "error",
                         "error": {"type": "api_error", "message": f"Stream processing error: {str(e)}"},
                     }
-                    yield f"data: {json.dumps(error_event)}\n\n"
+                    yield _sse_event(error_event)
                 finally:
-                    try:
-                        deepseek_resp.close()
-                    except Exception:
-                        pass
+                    # 客户端断开或提前结束时停止读取上游（任务结束时会关闭响应）
+                    if producer is not None:
+                        if not producer.done():
+                            producer.cancel()
+                    elif deepseek_resp is not None:
+                        try:
+                            await deepseek_resp.aclose()
+                        except Exception:
+                            pass
                     cleanup_account(request)
 
-            return StreamingResponse(
-                claude_sse_stream(),
-                media_type="text/event-stream",
-                headers={"Content-Type": "text/event-stream"},
-            )
+            return sse_response(claude_sse_stream())
         else:
             # 非流式响应处理
             try:
-                final_content = ""
-                final_reasoning = ""
-
-                for line in deepseek_resp.iter_lines():
-                    if not line:
-                        continue
-                    try:
-                        line_str = line.decode("utf-8")
-                    except Exception as e:
-                        logger.warning(f"[claude_messages] 行解码失败: {e}")
-                        continue
-
-                    if line_str.startswith("data:"):
-                        data_str = line_str[5:].strip()
-                        if data_str == "[DONE]":
-                            break
-
-                        try:
-                            chunk = json.loads(data_str)
-                            if "v" in chunk:
-                                v_value = chunk["v"]
-                                if "p" in chunk and chunk.get("p") == "response/search_status":
-                                    continue
-                                ptype = "text"
-                                if "p" in chunk and chunk.get("p") == "response/thinking_content":
-                                    ptype = "thinking"
-                                elif "p" in chunk and chunk.get("p") == "response/content":
-                                    ptype = "text"
-                                if isinstance(v_value, str):
-                                    if ptype == "thinking":
-                                        final_reasoning += v_value
-                                    else:
-                                        final_content += v_value
-                                elif isinstance(v_value, list):
-                                    for item in v_value:
-                                        if item.get("p") == "status" and item.get("v") == "FINISHED":
-                                            break
-                        except json.JSONDecodeError as e:
-                            logger.warning(f"[claude_messages] JSON解析失败: {e}")
-                            continue
-                        except Exception as e:
-                            logger.warning(f"[claude_messages] chunk处理失败: {e}")
-                            continue
-
-                try:
-                    deepseek_resp.close()
-                except Exception as e:
-                    logger.warning(f"[claude_messages] 关闭响应异常: {e}")
+                if cached is None:
+                    # 异步读取完整响应，收集完会关闭响应
+                    final_reasoning, final_content = await acollect_deepseek_response(deepseek_resp)
+                    if cache_key is not None and (final_reasoning or final_content):
+                        RESPONSE_CACHE.set(cache_key, (final_reasoning, final_content))
+                else:
+                    final_reasoning, final_content = cached
 
                 # 检查工具调用
                 detected_tools = parse_tool_calls(final_content, tools_requested)
 
-                # 构造响应
+                # 构造响应（消息 ID 与工具调用 ID 共用同一个时间戳和随机串）
+                id_suffix = f"{int(time.time())}_{secrets.token_hex(3)}"
                 claude_response = {
-                    "id": f"msg_{int(time.time())}_{random.randint(1000, 9999)}",
+                    "id": f"msg_{id_suffix}",
                     "type": "message",
                     "role": "assistant",
                     "model": model,
@@ -386,7 +445,7 @@ Remember: Output ONLY the JSON, no other text. The response must start with {{ a
                     "stop_reason": "tool_use" if detected_tools else "end_turn",
                     "stop_sequence": None,
                     "usage": {
-                        "input_tokens": len(str(normalized_messages)) // 4,
+                        "input_tokens": len(orjson.dumps(normalized_messages)) >> 2,
                         "output_tokens": (len(final_content) + len(final_reasoning)) // 4,
                     },
                 }
@@ -396,7 +455,7 @@ Remember: Output ONLY the JSON, no other text. The response must start with {{ a
 
                 if detected_tools:
                     for i, tool_info in enumerate(detected_tools):
-                        tool_use_id = f"toolu_{int(time.time())}_{random.randint(1000, 9999)}_{i}"
+                        tool_use_id = f"toolu_{id_suffix}_{i}"
                         claude_response["content"].append({
                             "type": "tool_use",
                             "id": tool_use_id,
@@ -410,27 +469,28 @@ Remember: Output ONLY the JSON, no other text. The response must start with {{ a
                             "text": final_content or "抱歉，没有生成有效的响应内容。",
                         })
 
-                return JSONResponse(content=claude_response, status_code=200)
+                return ORJSONResponse(content=claude_response, status_code=200)
 
             except Exception as e:
-                logger.error(f"[claude_messages] 非流式响应处理异常: {e}")
+                logger.error("[claude_messages] 非流式响应处理异常: %s", e)
                 try:
-                    deepseek_resp.close()
+                    if deepseek_resp is not None:
+                        await deepseek_resp.aclose()
                 except Exception as close_e:
-                    logger.warning(f"[claude_messages] 关闭响应异常2: {close_e}")
-                return JSONResponse(
+                    logger.warning("[claude_messages] 关闭响应异常2: %s", close_e)
+                return ORJSONResponse(
                     status_code=500,
                     content={"error": {"type": "api_error", "message": "Response processing error"}},
                 )
 
     except HTTPException as exc:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=exc.status_code,
             content={"error": {"type": "invalid_request_error", "message": exc.detail}},
         )
     except Exception as exc:
-        logger.error(f"[claude_messages] 未知异常: {exc}")
-        return JSONResponse(
+        logger.error("[claude_messages] 未知异常: %s", exc)
+        return ORJSONResponse(
             status_code=500,
             content={"error": {"type": "api_error", "message": "Internal Server Error"}},
         )
@@ -445,12 +505,12 @@ Remember: Output ONLY the JSON, no other text. The response must start with {{ a
 async def claude_count_tokens(request: Request):
     try:
         try:
-            determine_mode_and_token(request)
+            await determine_mode_and_token(request)
         except HTTPException as exc:
-            return JSONResponse(status_code=exc.status_code, content={"error": exc.detail})
+            return ORJSONResponse(status_code=exc.status_code, content={"error": exc.detail})
         except Exception as exc:
-            logger.error(f"[claude_count_tokens] determine_mode_and_token 异常: {exc}")
-            return JSONResponse(status_code=500, content={"error": "Claude authentication failed."})
+            logger.error("[claude_count_tokens] determine_mode_and_token 异常: %s", exc)
+            return ORJSONResponse(status_code=500, content={"error": "Claude authentication failed."})
 
         req_data = await request.json()
         model = req_data.get("model")
@@ -462,48 +522,50 @@ async def claude_count_tokens(request: Request):
                 status_code=400, detail="Request must include 'model' and 'messages'."
             )
 
-        input_tokens = 0
-
-        if system:
-            input_tokens += estimate_tokens(system)
+        # 单次遍历累加估算值：字符串直接按 max(1, len // 4) 计数（同 estimate_tokens），
+        # 其余类型才交给 estimate_tokens 处理
+        estimate = estimate_tokens
+        input_tokens = estimate(system) if system else 0
 
         for message in messages:
             content = message.get("content", "")
             input_tokens += 2  # 角色标记
 
-            if isinstance(content, list):
+            if isinstance(content, str):
+                input_tokens += max(1, len(content) >> 2)
+            elif isinstance(content, list):
                 for content_block in content:
                     if isinstance(content_block, dict):
-                        if content_block.get("type") == "text":
-                            input_tokens += estimate_tokens(content_block.get("text", ""))
-                        elif content_block.get("type") == "tool_result":
-                            input_tokens += estimate_tokens(content_block.get("content", ""))
+                        block_type = content_block.get("type")
+                        if block_type == "text":
+                            text = content_block.get("text", "")
+                        elif block_type == "tool_result":
+                            text = content_block.get("content", "")
                         else:
-                            input_tokens += estimate_tokens(str(content_block))
+                            text = str(content_block)
                     else:
-                        input_tokens += estimate_tokens(str(content_block))
+                        text = str(content_block)
+                    input_tokens += max(1, len(text) >> 2) if isinstance(text, str) else estimate(text)
             else:
-                input_tokens += estimate_tokens(content)
+                input_tokens += estimate(content)
 
-        tools = req_data.get("tools", [])
-        if tools:
-            for tool in tools:
-                input_tokens += estimate_tokens(tool.get("name", ""))
-                input_tokens += estimate_tokens(tool.get("description", ""))
-                input_schema = tool.get("input_schema", {})
-                input_tokens += estimate_tokens(json.dumps(input_schema, ensure_ascii=False))
+        for tool in req_data.get("tools") or []:
+            input_tokens += estimate(tool.get("name", ""))
+            input_tokens += estimate(tool.get("description", ""))
+            # schema 只用于估算长度：orjson 直接输出字节，按字节数估算，不再经过 str
+            input_tokens += max(1, len(orjson.dumps(tool.get("input_schema", {}))) >> 2)
 
         response = {"input_tokens": max(1, input_tokens)}
-        return JSONResponse(content=response, status_code=200)
+        return ORJSONResponse(content=response, status_code=200)
 
     except HTTPException as exc:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=exc.status_code,
             content={"error": {"type": "invalid_request_error", "message": exc.detail}},
         )
     except Exception as exc:
-        logger.error(f"[claude_count_tokens] 未知异常: {exc}")
-        return JSONResponse(
+        logger.error("[claude_count_tokens] 未知异常: %s", exc)
+        return ORJSONResponse(
             status_code=500,
             content={"error": {"type": "api_error", "message": "Internal Server Error"}},
         )
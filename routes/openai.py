@@ -1,15 +1,14 @@
 # -*- coding: utf-8 -*-
 """OpenAI 兼容路由"""
-import json
-import queue
+import asyncio
 import random
 import re
-import threading
 import time
 
+import orjson
 from curl_cffi import requests as cffi_requests
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import StreamingResponse
 
 from core.config import CONFIG, logger
 from core.auth import (
@@ -17,37 +16,44 @@ from core.auth import (
     get_auth_headers,
     release_account,
 )
-from core.deepseek import call_completion_endpoint
+from core.deepseek import acall_completion_endpoint
 from core.session_manager import (
-    create_session,
-    get_pow,
+    create_session_and_pow,
     cleanup_account,
 )
 from core.models import get_model_config, get_openai_models_response
 from core.sse_parser import (
-    parse_deepseek_sse_line,
+    aiter_sse_events,
+    parse_deepseek_sse_data,
     parse_sse_chunk_for_content,
     extract_content_from_chunk,
     extract_content_recursive,
-    should_filter_citation,
     parse_tool_calls,
     format_openai_tool_calls,
 )
 from core.constants import (
     KEEP_ALIVE_TIMEOUT,
+    SSE_DONE,
+    SSE_KEEPALIVE,
+    STREAM_COALESCE_MAX_DELTAS,
+    STREAM_COALESCE_WINDOW,
     STREAM_IDLE_TIMEOUT,
-    MAX_KEEPALIVE_COUNT,
 )
-from core.messages import messages_prepare
+from core.messages import build_openai_tool_prompt, messages_prepare
+from core.utils import ORJSONResponse
 
 router = APIRouter()
 
-# 预编译正则表达式（性能优化）
+# 预编译正则表达式（性能优化）；只在启用搜索时才匹配
 _CITATION_PATTERN = re.compile(r"^\[citation:")
 
+# SSE 帧直接产出 UTF-8 字节，StreamingResponse 无需再编码
+_SSE_DONE = b"data: [DONE]\n\n"
 
 
-
+def _sse_chunk(chunk: dict) -> bytes:
+    """把 chunk 序列化为一条 SSE data 帧（orjson 输出 UTF-8，不转义非 ASCII 字符）"""
+    return b"data: " + orjson.dumps(chunk) + b"\n\n"
 
 
 # ----------------------------------------------------------------------
@@ -56,7 +62,7 @@ _CITATION_PATTERN = re.compile(r"^\[citation:")
 @router.get("/v1/models")
 def list_models():
     data = get_openai_models_response()
-    return JSONResponse(content=data, status_code=200)
+    return ORJSONResponse(content=data, status_code=200)
 
 
 # ----------------------------------------------------------------------
@@ -67,14 +73,14 @@ async def chat_completions(request: Request):
     try:
         # 处理 token 相关逻辑，若登录失败则直接返回错误响应
         try:
-            determine_mode_and_token(request)
+            await determine_mode_and_token(request)
         except HTTPException as exc:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=exc.status_code, content={"error": exc.detail}
             )
         except Exception as exc:
-            logger.error(f"[chat_completions] determine_mode_and_token 异常: {exc}")
-            return JSONResponse(
+            logger.error("[chat_completions] determine_mode_and_token 异常: %s", exc)
+            return ORJSONResponse(
                 status_code=500, content={"error": "Account login failed."}
             )
 
@@ -89,55 +95,28 @@ async def chat_completions(request: Request):
         # 解析工具调用参数（OpenAI 格式）
         tools_requested = req_data.get("tools") or []
         has_tools = len(tools_requested) > 0
+        # parse_tool_calls 只需工具名，每个请求构建一次，结束与超时路径共用
+        tools_for_parse = [{"name": t.get("function", t).get("name")} for t in tools_requested]
         
-        # 如果有工具定义，构建工具提示并注入到消息中
-        messages_with_tools = messages.copy()
+        # 如果有工具定义，构建工具提示并注入到消息中；无工具时直接复用原列表（下游只读取）
+        messages_with_tools = messages
         if has_tools:
-            tool_schemas = []
-            for tool in tools_requested:
-                # OpenAI 格式: {"type": "function", "function": {"name": ..., "description": ..., "parameters": ...}}
-                func = tool.get("function", tool)  # 兼容简化格式
-                tool_name = func.get("name", "unknown")
-                tool_desc = func.get("description", "No description available")
-                schema = func.get("parameters", {})
-                
-                tool_info = f"Tool: {tool_name}\nDescription: {tool_desc}"
-                if "properties" in schema:
-                    props = []
-                    required = schema.get("required", [])
-                    for prop_name, prop_info in schema["properties"].items():
-                        prop_type = prop_info.get("type", "string")
-                        is_req = " (required)" if prop_name in required else ""
-                        props.append(f"  - {prop_name}: {prop_type}{is_req}")
-                    if props:
-                        tool_info += f"\nParameters:\n" + "\n".join(props)
-                tool_schemas.append(tool_info)
-            
-            # 检查是否已有系统消息
-            has_system = any(m.get("role") == "system" for m in messages_with_tools)
-            tool_prompt = f"""You have access to these tools:
-
-{chr(10).join(tool_schemas)}
-
-When you need to use tools, output ONLY this JSON format (no other text):
-{{"tool_calls": [
-  {{"name": "tool_name", "input": {{"param": "value"}}}}
-]}}
-
-IMPORTANT: If calling tools, output ONLY the JSON. The response must start with {{ and end with }}"""
-            
-            if has_system:
-                # 追加到现有系统消息
-                for i, m in enumerate(messages_with_tools):
-                    if m.get("role") == "system":
-                        messages_with_tools[i] = {
-                            "role": "system",
-                            "content": m.get("content", "") + "\n\n" + tool_prompt
-                        }
-                        break
+            # 同一组工具按序列化字节缓存提示词，避免每次请求都重新遍历工具与参数
+            tool_prompt = build_openai_tool_prompt(orjson.dumps(tools_requested))
+            # 一次扫描找到第一条系统消息
+            system_index = next(
+                (i for i, m in enumerate(messages) if m.get("role") == "system"), None
+            )
+            if system_index is not None:
+                # 追加到现有系统消息（替换为新字典，不修改请求中的原消息）
+                messages_with_tools = list(messages)
+                messages_with_tools[system_index] = {
+                    "role": "system",
+                    "content": messages[system_index].get("content", "") + "\n\n" + tool_prompt
+                }
             else:
                 # 添加新的系统消息
-                messages_with_tools.insert(0, {"role": "system", "content": tool_prompt})
+                messages_with_tools = [{"role": "system", "content": tool_prompt}, *messages]
         
         # 使用会话管理器获取模型配置
         thinking_enabled, search_enabled = get_model_config(model)
@@ -148,11 +127,9 @@ IMPORTANT: If calling tools, output ONLY the JSON. The response must start with
         
         # 使用 messages_prepare 函数构造最终 prompt（使用带工具提示的消息）
         final_prompt = messages_prepare(messages_with_tools)
-        session_id = create_session(request)
+        session_id, pow_resp = await create_session_and_pow(request)
         if not session_id:
             raise HTTPException(status_code=401, detail="invalid token.")
-        
-        pow_resp = get_pow(request)
         if not pow_resp:
             raise HTTPException(
                 status_code=401,
@@ -169,7 +146,8 @@ IMPORTANT: If calling tools, output ONLY the JSON. The response must start with
             "search_enabled": search_enabled,
         }
 
-        deepseek_resp = call_completion_endpoint(payload, headers, max_attempts=3)
+        # AsyncSession 的响应直接在事件循环上读取，长时间的对话流不占用线程池
+        deepseek_resp = await acall_completion_endpoint(payload, headers, max_attempts=3)
         if not deepseek_resp:
             raise HTTPException(status_code=500, detail="Failed to get completion.")
         created_time = int(time.time())
@@ -178,59 +156,76 @@ IMPORTANT: If calling tools, output ONLY the JSON. The response must start with
         # 流式响应（SSE）或普通响应
         if bool(req_data.get("stream", False)):
             if deepseek_resp.status_code != 200:
-                deepseek_resp.close()
-                return JSONResponse(
-                    content=deepseek_resp.content, status_code=deepseek_resp.status_code
+                await deepseek_resp.aclose()
+                return ORJSONResponse(
+                    content={"error": "Failed to get completion."}, status_code=deepseek_resp.status_code
                 )
 
-            def sse_stream():
-                # 使用导入的常量（不再本地定义）
+            async def sse_stream():
+                # 上游读取与解析在独立的协程任务中进行，结果经 asyncio.Queue 交给消费端，
+                # 消费端 await 等待，不再轮询；上游无数据时按保活周期发送注释行
+                producer = None
                 try:
                     final_text = ""
                     final_thinking = ""
                     first_chunk_sent = False
-                    result_queue = queue.Queue()
-                    last_send_time = time.time()
+                    loop = asyncio.get_running_loop()
+                    result_queue = asyncio.Queue()
                     last_content_time = time.time()  # 最后收到有效内容的时间
-                    keepalive_count = 0  # 连续 keepalive 计数
                     has_content = False  # 是否收到过内容
 
-                    def process_data():
-                        """处理 DeepSeek SSE 数据流 - 使用 sse_parser 模块"""
+                    # 待合并的同类型增量：队列中已积压的片段合并为一帧发出
+                    pending_type = None
+                    pending_parts = []
+                    pending_deadline = 0.0
+
+                    put = result_queue.put_nowait
+
+                    def flush_pending() -> bytes:
+                        """把待合并的片段作为一个 delta 帧输出并清空"""
+                        nonlocal first_chunk_sent
+                        text = "".join(pending_parts)
+                        pending_parts.clear()
+                        delta_obj = {}
+                        if not first_chunk_sent:
+                            delta_obj["role"] = "assistant"
+                            first_chunk_sent = True
+                        delta_obj["reasoning_content" if pending_type == "thinking" else "content"] = text
+                        return _sse_chunk({
+                            "id": completion_id,
+                            "object": "chat.completion.chunk",
+                            "created": created_time,
+                            "model": model,
+                            "choices": [{"delta": delta_obj, "index": 0}],
+                        })
+
+                    async def process_data():
+                        """处理 DeepSeek SSE 数据流 - 使用 sse_parser 模块
+
+                        每个上游事件只投递一次：[(content_text, content_type), ...] 列表，
+                        结束时投递 None；不再为每个片段构造中间 chunk 字典
+                        """
                         nonlocal has_content
                         current_fragment_type = "thinking" if thinking_enabled else "text"
-                        logger.info(f"[sse_stream] 开始处理数据流, session_id={session_id}")
+                        logger.info("[sse_stream] 开始处理数据流, session_id=%s", session_id)
                         
                         try:
-                            for raw_line in deepseek_resp.iter_lines():
-                                # 解码行
-                                try:
-                                    line = raw_line.decode("utf-8")
-                                except Exception as e:
-                                    logger.warning(f"[sse_stream] 解码失败: {e}")
-                                    result_queue.put({"choices": [{"index": 0, "delta": {"content": "解码失败，请稍候再试", "type": "text"}}]})
-                                    result_queue.put(None)
-                                    break
-                                
-                                if not line:
+                            async for data in aiter_sse_events(deepseek_resp):
+                                # data 字段保持原始字节直接交给 orjson 解析（C 层校验 UTF-8），不先解码成 str
+                                if data is None:
                                     continue
-                                    
-                                if not line.startswith("data:"):
-                                    continue
-                                    
-                                data_str = line[5:].strip()
-                                if data_str == "[DONE]":
-                                    result_queue.put(None)
+
+                                if data == SSE_DONE:
+                                    put(None)
                                     break
-                                    
+
                                 try:
-                                    chunk = json.loads(data_str)
+                                    chunk = orjson.loads(data)
                                     
                                     # 检测内容审核/敏感词阻止
                                     if "error" in chunk or chunk.get("code") == "content_filter":
-                                        logger.warning(f"[sse_stream] 检测到内容过滤: {chunk}")
-                                        result_queue.put({"choices": [{"index": 0, "finish_reason": "content_filter"}]})
-                                        result_queue.put(None)
+                                        logger.warning("[sse_stream] 检测到内容过滤: %s", chunk)
+                                        put(None)
                                         return
                                     
                                     # 使用 sse_parser 模块解析内容
@@ -240,157 +235,119 @@ IMPORTANT: If calling tools, output ONLY the JSON. The response must start with
                                     current_fragment_type = new_fragment_type
                                     
                                     if is_finished:
-                                        result_queue.put({"choices": [{"index": 0, "finish_reason": "stop"}]})
-                                        result_queue.put(None)
+                                        put(None)
                                         return
                                     
-                                    # 处理提取的内容
-                                    for content_text, content_type in contents:
-                                        if content_text:
-                                            has_content = True
-                                            unified_chunk = {
-                                                "choices": [{
-                                                    "index": 0,
-                                                    "delta": {"content": content_text, "type": content_type}
-                                                }],
-                                                "model": "",
-                                                "chunk_token_usage": len(content_text) // 4,
-                                                "created": 0,
-                                                "message_id": -1,
-                                                "parent_id": -1
-                                            }
-                                            result_queue.put(unified_chunk)
+                                    # 处理提取的内容：整个事件的非空片段一次投递
+                                    contents = [item for item in contents if item[0]]
+                                    if contents:
+                                        has_content = True
+                                        put(contents)
                                             
                                 except Exception as e:
-                                    logger.warning(f"[sse_stream] 无法解析: {data_str[:100]}, 错误: {e}")
-                                    result_queue.put({"choices": [{"index": 0, "delta": {"content": "解析失败，请稍候再试", "type": "text"}}]})
-                                    result_queue.put(None)
+                                    logger.warning("[sse_stream] 无法解析: %r, 错误: %s", data[:100], e)
+                                    put([("解析失败，请稍候再试", "text")])
+                                    put(None)
                                     break
                                     
                         except Exception as e:
-                            logger.warning(f"[sse_stream] 错误: {e}")
-                            result_queue.put({"choices": [{"index": 0, "delta": {"content": "服务器错误，请稍候再试", "type": "text"}}]})
-                            result_queue.put(None)
+                            logger.warning("[sse_stream] 错误: %s", e)
+                            put([("服务器错误，请稍候再试", "text")])
+                            put(None)
                         finally:
-                            deepseek_resp.close()
-
+                            await deepseek_resp.aclose()
 
-                    process_thread = threading.Thread(target=process_data)
-                    process_thread.start()
+                    producer = asyncio.create_task(process_data())
 
                     while True:
-                        current_time = time.time()
-                        
                         # 智能超时检测：如果已有内容且长时间无新数据，强制结束
-                        if has_content and (current_time - last_content_time) > STREAM_IDLE_TIMEOUT:
-                            logger.warning(f"[sse_stream] 智能超时: 已有内容但 {STREAM_IDLE_TIMEOUT}s 无新数据，强制结束")
+                        if has_content and (time.time() - last_content_time) > STREAM_IDLE_TIMEOUT:
+                            logger.warning("[sse_stream] 智能超时: 已有内容但 %ss 无新数据，强制结束", STREAM_IDLE_TIMEOUT)
                             break
-                        
-                        # 连续 keepalive 检测：如果已有内容且连续多次 keepalive，强制结束
-                        if has_content and keepalive_count >= MAX_KEEPALIVE_COUNT:
-                            logger.warning(f"[sse_stream] 智能超时: 连续 {MAX_KEEPALIVE_COUNT} 次 keepalive，强制结束")
-                            break
-                        
-                        if current_time - last_send_time >= KEEP_ALIVE_TIMEOUT:
-                            yield ": keep-alive\n\n"
-                            last_send_time = current_time
-                            keepalive_count += 1
-                            continue
-                            
+
                         try:
-                            chunk = result_queue.get(timeout=0.05)
-                            keepalive_count = 0  # 重置 keepalive 计数
+                            chunk = await asyncio.wait_for(result_queue.get(), timeout=KEEP_ALIVE_TIMEOUT)
+                        except asyncio.TimeoutError:
+                            # 一个保活周期内没有新数据，发送注释行防止连接被代理断开
+                            yield SSE_KEEPALIVE
+                            continue
+                        current_time = time.time()
+
+                        if chunk is None:
+                            if pending_parts:
+                                yield flush_pending()
+                            prompt_tokens = len(final_prompt) // 4
+                            thinking_tokens = len(final_thinking) // 4
+                            completion_tokens = len(final_text) // 4
+                            usage = {
+                                "prompt_tokens": prompt_tokens,
+                                "completion_tokens": thinking_tokens + completion_tokens,
+                                "total_tokens": prompt_tokens + thinking_tokens + completion_tokens,
+                                "completion_tokens_details": {"reasoning_tokens": thinking_tokens},
+                            }
                             
-                            if chunk is None:
-                                prompt_tokens = len(final_prompt) // 4
-                                thinking_tokens = len(final_thinking) // 4
-                                completion_tokens = len(final_text) // 4
-                                usage = {
-                                    "prompt_tokens": prompt_tokens,
-                                    "completion_tokens": thinking_tokens + completion_tokens,
-                                    "total_tokens": prompt_tokens + thinking_tokens + completion_tokens,
-                                    "completion_tokens_details": {"reasoning_tokens": thinking_tokens},
-                                }
-                                
-                                # 检测工具调用
-                                detected_tools = []
-                                finish_reason = "stop"
-                                if has_tools:
-                                    detected_tools = parse_tool_calls(final_text, [{"name": t.get("function", t).get("name")} for t in tools_requested])
-                                    if detected_tools:
-                                        finish_reason = "tool_calls"
-                                
+                            # 检测工具调用
+                            detected_tools = []
+                            finish_reason = "stop"
+                            if has_tools:
+                                detected_tools = parse_tool_calls(final_text, tools_for_parse)
                                 if detected_tools:
-                                    # 发送工具调用响应
-                                    tool_calls_data = format_openai_tool_calls(detected_tools)
-                                    tool_chunk = {
-                                        "id": completion_id,
-                                        "object": "chat.completion.chunk",
-                                        "created": created_time,
-                                        "model": model,
-                                        "choices": [{"delta": {"tool_calls": tool_calls_data}, "index": 0}],
-                                    }
-                                    yield f"data: {json.dumps(tool_chunk, ensure_ascii=False)}\n\n"
-                                
-                                finish_chunk = {
-                                    "id": completion_id,
-                                    "object": "chat.completion.chunk",
-                                    "created": created_time,
-                                    "model": model,
-                                    "choices": [{"delta": {}, "index": 0, "finish_reason": finish_reason}],
-                                    "usage": usage,
-                                }
-                                yield f"data: {json.dumps(finish_chunk, ensure_ascii=False)}\n\n"
-                                yield "data: [DONE]\n\n"
-                                last_send_time = current_time
-                                break
-                                
-                            new_choices = []
-                            for choice in chunk.get("choices", []):
-                                delta = choice.get("delta", {})
-                                ctype = delta.get("type")
-                                ctext = delta.get("content", "")
-                                if choice.get("finish_reason") == "backend_busy":
-                                    ctext = "服务器繁忙，请稍候再试"
-                                if choice.get("finish_reason") == "content_filter":
-                                    # 内容过滤，正常结束
-                                    pass
-                                if search_enabled and ctext.startswith("[citation:"):
-                                    ctext = ""
-                                if ctype == "thinking":
-                                    if thinking_enabled:
-                                        final_thinking += ctext
-                                else:
-                                    # 非 thinking 内容都作为普通文本处理（包括 ctype=None 或 "text"）
-                                    final_text += ctext
-                                delta_obj = {}
-                                if not first_chunk_sent:
-                                    delta_obj["role"] = "assistant"
-                                    first_chunk_sent = True
-                                if ctype == "thinking":
-                                    if thinking_enabled:
-                                        delta_obj["reasoning_content"] = ctext
-                                else:
-                                    # 非 thinking 内容都作为 content 输出
-                                    if ctext:
-                                        delta_obj["content"] = ctext
-                                if delta_obj:
-                                    new_choices.append({"delta": delta_obj, "index": choice.get("index", 0)})
-                                    
-                            if new_choices:
-                                last_content_time = current_time  # 更新最后内容时间
-                                out_chunk = {
+                                    finish_reason = "tool_calls"
+                            
+                            if detected_tools:
+                                # 发送工具调用响应
+                                tool_calls_data = format_openai_tool_calls(detected_tools)
+                                tool_chunk = {
                                     "id": completion_id,
                                     "object": "chat.completion.chunk",
                                     "created": created_time,
                                     "model": model,
-                                    "choices": new_choices,
+                                    "choices": [{"delta": {"tool_calls": tool_calls_data}, "index": 0}],
                                 }
-                                yield f"data: {json.dumps(out_chunk, ensure_ascii=False)}\n\n"
-                                last_send_time = current_time
-                        except queue.Empty:
-                            continue
+                                yield _sse_chunk(tool_chunk)
+                            
+                            finish_chunk = {
+                                "id": completion_id,
+                                "object": "chat.completion.chunk",
+                                "created": created_time,
+                                "model": model,
+                                "choices": [{"delta": {}, "index": 0, "finish_reason": finish_reason}],
+                                "usage": usage,
+                            }
+                            yield _sse_chunk(finish_chunk)
+                            yield _SSE_DONE
+                            return
                             
+                        for ctext, ctype in chunk:
+                            if not ctext or (search_enabled and _CITATION_PATTERN.match(ctext) is not None):
+                                continue
+                            if ctype == "thinking":
+                                if not thinking_enabled:
+                                    continue
+                                final_thinking += ctext
+                            else:
+                                # 非 thinking 内容都作为 content 输出（包括 ctype=None 或 "text"）
+                                ctype = "text"
+                                final_text += ctext
+                            last_content_time = current_time  # 更新最后内容时间
+                            if pending_parts and ctype != pending_type:
+                                yield flush_pending()
+                            if not pending_parts:
+                                pending_type = ctype
+                                pending_deadline = loop.time() + STREAM_COALESCE_WINDOW
+                            pending_parts.append(ctext)
+
+                        # 队列已取空（不等待后续数据，不增加延迟）、攒够片段数或超过合并窗口时发出
+                        if pending_parts and (
+                            result_queue.empty()
+                            or len(pending_parts) >= STREAM_COALESCE_MAX_DELTAS
+                            or loop.time() >= pending_deadline
+                        ):
+                            yield flush_pending()
+
+                    if pending_parts:
+                        yield flush_pending()
+
                     # 如果是超时退出，也发送结束标记
                     if has_content:
                         prompt_tokens = len(final_prompt) // 4
@@ -407,7 +364,7 @@ IMPORTANT: If calling tools, output ONLY the JSON. The response must start with
                         detected_tools = []
                         finish_reason = "stop"
                         if has_tools:
-                            detected_tools = parse_tool_calls(final_text, [{"name": t.get("function", t).get("name")} for t in tools_requested])
+                            detected_tools = parse_tool_calls(final_text, tools_for_parse)
                             if detected_tools:
                                 finish_reason = "tool_calls"
                         
@@ -420,7 +377,7 @@ IMPORTANT: If calling tools, output ONLY the JSON. The response must start with
                                 "model": model,
                                 "choices": [{"delta": {"tool_calls": tool_calls_data}, "index": 0}],
                             }
-                            yield f"data: {json.dumps(tool_chunk, ensure_ascii=False)}\n\n"
+                            yield _sse_chunk(tool_chunk)
                         
                         finish_chunk = {
                             "id": completion_id,
@@ -430,12 +387,15 @@ IMPORTANT: If calling tools, output ONLY the JSON. The response must start with
                             "choices": [{"delta": {}, "index": 0, "finish_reason": finish_reason}],
                             "usage": usage,
                         }
-                        yield f"data: {json.dumps(finish_chunk, ensure_ascii=False)}\n\n"
-                        yield "data: [DONE]\n\n"
+                        yield _sse_chunk(finish_chunk)
+                        yield _SSE_DONE
                         
                 except Exception as e:
-                    logger.error(f"[sse_stream] 异常: {e}")
+                    logger.error("[sse_stream] 异常: %s", e)
                 finally:
+                    # 客户端断开或超时退出时停止读取上游（任务结束时会关闭响应）
+                    if producer is not None and not producer.done():
+                        producer.cancel()
                     cleanup_account(request)
 
             return StreamingResponse(
@@ -449,18 +409,15 @@ IMPORTANT: If calling tools, output ONLY the JSON. The response must start with
             text_list = []
             result = None
 
-            data_queue = queue.Queue()
-
-            def collect_data():
+            async def collect_data():
                 nonlocal result
                 current_fragment_type = "thinking" if thinking_enabled else "text"
                 try:
-                    for raw_line in deepseek_resp.iter_lines():
-                        chunk = parse_deepseek_sse_line(raw_line)
+                    async for data in aiter_sse_events(deepseek_resp):
+                        chunk = parse_deepseek_sse_data(data) if data is not None else None
                         if not chunk:
                             continue
                         if chunk.get("type") == "done":
-                            data_queue.put(None)
                             break
                         try:
                             contents, is_finished, new_fragment_type = parse_sse_chunk_for_content(
@@ -478,7 +435,7 @@ IMPORTANT: If calling tools, output ONLY the JSON. The response must start with
                                 detected_tools = []
                                 finish_reason = "stop"
                                 if has_tools:
-                                    detected_tools = parse_tool_calls(final_content, [{"name": t.get("function", t).get("name")} for t in tools_requested])
+                                    detected_tools = parse_tool_calls(final_content, tools_for_parse)
                                     if detected_tools:
                                         finish_reason = "tool_calls"
 
@@ -513,27 +470,24 @@ IMPORTANT: If calling tools, output ONLY the JSON. The response must start with
                                         "completion_tokens_details": {"reasoning_tokens": reasoning_tokens},
                                     },
                                 }
-                                data_queue.put("DONE")
                                 return
 
                             for content_text, content_type in contents:
-                                if should_filter_citation(content_text, search_enabled):
+                                if search_enabled and _CITATION_PATTERN.match(content_text) is not None:
                                     continue
                                 if content_type == "thinking":
                                     think_list.append(content_text)
                                 else:
                                     text_list.append(content_text)
                         except Exception as e:
-                            logger.warning(f"[collect_data] 无法解析: {chunk}, 错误: {e}")
+                            logger.warning("[collect_data] 无法解析: %s, 错误: %s", chunk, e)
                             text_list.append("解析失败，请稍候再试")
-                            data_queue.put(None)
                             break
                 except Exception as e:
-                    logger.warning(f"[collect_data] 错误: {e}")
+                    logger.warning("[collect_data] 错误: %s", e)
                     text_list.append("处理失败，请稍候再试")
-                    data_queue.put(None)
                 finally:
-                    deepseek_resp.close()
+                    await deepseek_resp.aclose()
                     if result is None:
                         final_content = "".join(text_list)
                         final_reasoning = "".join(think_list)
@@ -545,7 +499,7 @@ IMPORTANT: If calling tools, output ONLY the JSON. The response must start with
                         detected_tools = []
                         finish_reason = "stop"
                         if has_tools:
-                            detected_tools = parse_tool_calls(final_content, [{"name": t.get("function", t).get("name")} for t in tools_requested])
+                            detected_tools = parse_tool_calls(final_content, tools_for_parse)
                             if detected_tools:
                                 finish_reason = "tool_calls"
                         
@@ -579,28 +533,26 @@ IMPORTANT: If calling tools, output ONLY the JSON. The response must start with
                                 "total_tokens": prompt_tokens + reasoning_tokens + completion_tokens,
                             },
                         }
-                    data_queue.put("DONE")
-
-            collect_thread = threading.Thread(target=collect_data)
-            collect_thread.start()
-
-            def generate():
-                last_send_time = time.time()
-                while True:
-                    current_time = time.time()
-                    if current_time - last_send_time >= KEEP_ALIVE_TIMEOUT:
-                        yield ""
-                        last_send_time = current_time
-                    if not collect_thread.is_alive() and result is not None:
-                        yield json.dumps(result)
-                        break
-                    time.sleep(0.1)
+
+            async def generate():
+                # 收集在协程任务中进行；等待期间每个保活周期发送一个空块，结束后输出完整结果
+                collect_task = asyncio.create_task(collect_data())
+                try:
+                    while True:
+                        done, _ = await asyncio.wait({collect_task}, timeout=KEEP_ALIVE_TIMEOUT)
+                        if done:
+                            break
+                        yield b""
+                    yield orjson.dumps(result)
+                finally:
+                    if not collect_task.done():
+                        collect_task.cancel()
 
             return StreamingResponse(generate(), media_type="application/json")
     except HTTPException as exc:
-        return JSONResponse(status_code=exc.status_code, content={"error": exc.detail})
+        return ORJSONResponse(status_code=exc.status_code, content={"error": exc.detail})
     except Exception as exc:
-        logger.error(f"[chat_completions] 未知异常: {exc}")
-        return JSONResponse(status_code=500, content={"error": "Internal Server Error"})
+        logger.error("[chat_completions] 未知异常: %s", exc)
+        return ORJSONResponse(status_code=500, content={"error": "Internal Server Error"})
     finally:
         cleanup_account(request)
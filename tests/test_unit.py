@@ -33,6 +33,81 @@ class TestConfig(unittest.TestCase):
         self.assertIsInstance(WASM_PATH, str)
         self.assertIsInstance(CONFIG_PATH, str)
 
+    def test_save_and_load_roundtrip(self):
+        """测试配置写回后可原样读取（含中文）"""
+        import tempfile
+        from unittest import mock
+        from core import config
+
+        cfg = {"keys": ["k1"], "accounts": [{"email": "测试@example.com", "token": ""}]}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "config.json")
+            with mock.patch.object(config, "CONFIG_PATH", path):
+                config.save_config(cfg)
+                self.assertEqual(config.load_config(), cfg)
+            with open(path, encoding="utf-8") as f:
+                self.assertIn("测试@example.com", f.read())
+
+    def test_refresh_config_keys(self):
+        """测试 keys 变更后 CONFIG_KEYS 同步更新"""
+        from core import config
+
+        saved = config.CONFIG.get("keys")
+        try:
+            config.CONFIG["keys"] = ["k-test"]
+            config.refresh_config_keys()
+            self.assertIn("k-test", config.CONFIG_KEYS)
+        finally:
+            if saved is None:
+                config.CONFIG.pop("keys", None)
+            else:
+                config.CONFIG["keys"] = saved
+            config.refresh_config_keys()
+
+    def test_export_cache_follows_config_version(self):
+        """测试配置导出按版本号缓存，save_config 后重新序列化"""
+        import tempfile
+        from unittest import mock
+        from core import config
+        from routes.admin import vercel
+
+        first = vercel._export_config_data()
+        self.assertIs(vercel._export_config_data()[0], first[0])
+
+        saved = config.CONFIG.get("claude_mapping")
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(config, "CONFIG_PATH", os.path.join(tmp, "config.json")):
+            try:
+                config.CONFIG["claude_mapping"] = {"fast": "deepseek-chat"}
+                version = config.config_version()
+                config.save_config(config.CONFIG)
+                self.assertGreater(config.config_version(), version)
+                self.assertIn("deepseek-chat", vercel._export_config_data()[0])
+            finally:
+                if saved is None:
+                    config.CONFIG.pop("claude_mapping", None)
+                else:
+                    config.CONFIG["claude_mapping"] = saved
+                config.bump_config_version()
+
+    def test_vercel_request_retries_rate_limit(self):
+        """测试 Vercel API 返回 429 时退避重试，其他状态码直接返回"""
+        import asyncio
+        from unittest import mock
+        from routes.admin import vercel
+
+        statuses = [429, 503, 200]
+        client = mock.Mock()
+        client.request = mock.AsyncMock(
+            side_effect=lambda *a, **k: mock.Mock(status_code=statuses.pop(0))
+        )
+        with mock.patch.object(vercel, "_get_vercel_client", return_value=client), \
+                mock.patch.object(vercel.asyncio, "sleep", mock.AsyncMock()) as sleep:
+            resp = asyncio.run(vercel._vercel_request("GET", "https://api.vercel.com/x"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(client.request.await_count, 3)
+        self.assertEqual(sleep.await_count, 2)
+
 
 class TestMessages(unittest.TestCase):
     """消息处理模块测试"""
@@ -65,6 +140,19 @@ class TestMessages(unittest.TestCase):
         # 检查用户消息标签
         self.assertIn("<｜User｜>", result)
 
+    def test_messages_prepare_merge_same_role(self):
+        """测试连续同角色消息合并，且第一块不加 User 前缀"""
+        from core.messages import messages_prepare
+
+        messages = [
+            {"role": "system", "content": "S"},
+            {"role": "system", "content": "T"},
+            {"role": "assistant", "content": "A"},
+            {"role": "user", "content": "U"},
+        ]
+        result = messages_prepare(messages)
+        self.assertEqual(result, "S\n\nT<｜Assistant｜>A<｜end▁of▁sentence｜><｜User｜>U")
+
     def test_messages_prepare_array_content(self):
         """测试数组格式内容处理"""
         from core.messages import messages_prepare
@@ -97,6 +185,14 @@ class TestMessages(unittest.TestCase):
         self.assertNotIn("![alt]", result)
         self.assertIn("[alt]", result)
 
+    def test_markdown_image_keeps_incomplete_syntax(self):
+        """测试不完整的图片语法保持原样（不能简单替换 "![" 为 "["）"""
+        from core.messages import messages_prepare
+
+        for text in ("say ![ ok", "![a\nb](u)", "![alt] (u)"):
+            result = messages_prepare([{"role": "user", "content": text}])
+            self.assertEqual(result, text)
+
     def test_merge_consecutive_messages(self):
         """测试连续相同角色消息合并"""
         from core.messages import messages_prepare
@@ -137,6 +233,54 @@ class TestMessages(unittest.TestCase):
         self.assertEqual(result.get("temperature"), 0.7)
         self.assertEqual(result.get("stream"), True)
 
+    def test_build_tool_system_message(self):
+        """测试工具指导 system 消息的构建与缓存"""
+        import orjson
+        from core.messages import build_tool_system_message
+
+        tools = [{
+            "name": "get_weather",
+            "description": "Get weather",
+            "input_schema": {
+                "properties": {"city": {"type": "string"}, "days": {"type": "integer"}},
+                "required": ["city"],
+            },
+        }]
+
+        message = build_tool_system_message(orjson.dumps(tools))
+
+        self.assertEqual(message["role"], "system")
+        self.assertIn("Tool: get_weather\nDescription: Get weather", message["content"])
+        self.assertIn("Parameters:\n  - city: string (required)\n  - days: integer\n", message["content"])
+        # 同一组工具命中缓存
+        self.assertIs(build_tool_system_message(orjson.dumps(tools)), message)
+
+    def test_build_openai_tool_prompt(self):
+        """测试 OpenAI 工具提示词的构建与缓存"""
+        import orjson
+        from core.messages import build_openai_tool_prompt
+
+        tools = [
+            {
+                "type": "function",
+                "function": {
+                    "name": "get_weather",
+                    "description": "Get weather",
+                    "parameters": {
+                        "properties": {"city": {"type": "string"}, "days": {"type": "integer"}},
+                        "required": ["city"],
+                    },
+                },
+            },
+            {"name": "ping"},
+        ]
+
+        prompt = build_openai_tool_prompt(orjson.dumps(tools))
+
+        self.assertTrue(prompt.startswith("You have access to these tools:\n\nTool: get_weather\nDescription: Get weather"))
+        self.assertIn("Parameters:\n  - city: string (required)\n  - days: integer\nTool: ping\nDescription: No description available\n\n", prompt)
+        self.assertIs(build_openai_tool_prompt(orjson.dumps(tools)), prompt)
+
 
 class TestPow(unittest.TestCase):
     """PoW 模块测试"""
@@ -156,6 +300,40 @@ class TestPow(unittest.TestCase):
         self.assertIs(engine1, engine2)
         self.assertIs(module1, module2)
 
+    def test_compute_pow_answer(self):
+        """测试 PoW 求解结果正确，且同一线程多次求解（复用实例）结果一致"""
+        import ctypes
+        import struct
+        from wasmtime import Linker, Store
+        from core.pow import _get_cached_wasm_module, compute_pow_answer
+        from core.config import WASM_PATH
+
+        # 用 wasm 导出的 wasm_deepseek_hash_v1 按已知答案构造 challenge
+        engine, module = _get_cached_wasm_module(WASM_PATH)
+        store = Store(engine)
+        exports = Linker(engine).instantiate(store, module).exports(store)
+        memory = exports["memory"]
+        add_to_stack = exports["__wbindgen_add_to_stack_pointer"]
+
+        def deepseek_hash(text: str) -> str:
+            data = text.encode("utf-8")
+            retptr = add_to_stack(store, -16)
+            ptr = exports["__wbindgen_export_0"](store, len(data), 1)
+            base = ctypes.cast(memory.data_ptr(store), ctypes.c_void_p).value
+            ctypes.memmove(base + ptr, data, len(data))
+            exports["wasm_deepseek_hash_v1"](store, retptr, ptr, len(data))
+            base = ctypes.cast(memory.data_ptr(store), ctypes.c_void_p).value
+            out_ptr, out_len = struct.unpack("<ii", ctypes.string_at(base + retptr, 8))
+            add_to_stack(store, 16)
+            return ctypes.string_at(base + out_ptr, out_len).decode("utf-8")
+
+        for answer in (1000, 23456, 1000):
+            challenge = deepseek_hash(f"salt_1700000000_{answer}")
+            result = compute_pow_answer(
+                "DeepSeekHashV1", challenge, "salt", 144000, 1700000000, "", "", WASM_PATH
+            )
+            self.assertEqual(result, answer)
+
     def test_get_account_identifier(self):
         """测试账号标识获取"""
         from core.utils import get_account_identifier
@@ -210,6 +388,94 @@ class TestSessionManager(unittest.TestCase):
         self.assertIsNone(thinking)
         self.assertIsNone(search)
 
+        # 指定默认配置时未知模型直接返回默认值
+        from core.models import DEFAULT_MODEL_CONFIG
+        self.assertEqual(get_model_config("invalid-model", DEFAULT_MODEL_CONFIG), (False, False))
+        self.assertEqual(get_model_config("deepseek-reasoner", DEFAULT_MODEL_CONFIG), (True, False))
+
+    def test_completion_retry_policy(self):
+        """测试对话接口重试策略：4xx 直接失败，5xx 按次数重试"""
+        from unittest import mock
+        from core import deepseek
+
+        def fake_resp(status):
+            return mock.Mock(status_code=status)
+
+        with mock.patch.object(deepseek.time, "sleep") as sleep, \
+                mock.patch.object(deepseek.requests, "post", return_value=fake_resp(403)) as post:
+            self.assertIsNone(deepseek.call_completion_endpoint({}, {}, max_attempts=3))
+            self.assertEqual(post.call_count, 1)
+            sleep.assert_not_called()
+
+        with mock.patch.object(deepseek.time, "sleep") as sleep, \
+                mock.patch.object(deepseek.requests, "post", return_value=fake_resp(502)) as post:
+            self.assertIsNone(deepseek.call_completion_endpoint({}, {}, max_attempts=3))
+            self.assertEqual(post.call_count, 3)
+            self.assertEqual(sleep.call_count, 2)
+
+    def test_async_completion_retry_policy(self):
+        """测试异步对话接口与同步版本使用相同的重试策略"""
+        import asyncio
+        from unittest import mock
+        from core import deepseek
+
+        def fake_resp(status):
+            return mock.Mock(status_code=status, aclose=mock.AsyncMock())
+
+        async def run(status):
+            with mock.patch.object(deepseek.asyncio, "sleep", new=mock.AsyncMock()) as sleep, \
+                    mock.patch.object(deepseek.get_async_http_session(), "post",
+                                      new=mock.AsyncMock(return_value=fake_resp(status))) as post:
+                result = await deepseek.acall_completion_endpoint({}, {}, max_attempts=3)
+            await deepseek.close_async_http_session()
+            return result, post.await_count, sleep.await_count
+
+        self.assertEqual(asyncio.run(run(403)), (None, 1, 0))
+        self.assertEqual(asyncio.run(run(502)), (None, 3, 2))
+        result, attempts, _ = asyncio.run(run(200))
+        self.assertEqual((result.status_code, attempts), (200, 1))
+
+    def test_async_http_session_per_loop(self):
+        """测试异步会话在每个事件循环上单独创建，关闭后重新创建"""
+        import asyncio
+        from core import deepseek
+
+        async def get_twice():
+            session = deepseek.get_async_http_session()
+            self.assertIs(deepseek.get_async_http_session(), session)
+            await deepseek.close_async_http_session()
+            return session
+
+        first = asyncio.run(get_twice())
+        second = asyncio.run(get_twice())
+        self.assertIsNot(first, second)
+
+    def test_create_session_and_pow_revalidates_token(self):
+        """测试并发预取的 PoW 仅在 token 未变化时使用，否则按最终账号重新获取"""
+        import asyncio
+        from types import SimpleNamespace
+        from unittest import mock
+        from core import session_manager
+
+        def make_request():
+            return SimpleNamespace(state=SimpleNamespace(deepseek_token="old", use_config_token=True))
+
+        def switch_account(request, max_attempts):
+            request.state.deepseek_token = "new"
+            return "sid"
+
+        with mock.patch.object(session_manager, "fetch_pow_response", return_value="prefetched"), \
+                mock.patch.object(session_manager, "get_pow", return_value="fresh") as get_pow:
+            with mock.patch.object(session_manager, "create_session", return_value="sid"):
+                result = asyncio.run(session_manager.create_session_and_pow(make_request()))
+            self.assertEqual(result, ("sid", "prefetched"))
+            get_pow.assert_not_called()
+
+            with mock.patch.object(session_manager, "create_session", side_effect=switch_account):
+                result = asyncio.run(session_manager.create_session_and_pow(make_request()))
+            self.assertEqual(result, ("sid", "fresh"))
+            get_pow.assert_called_once()
+
 
 class TestAuth(unittest.TestCase):
     """认证模块测试"""
@@ -222,6 +488,124 @@ class TestAuth(unittest.TestCase):
         keys = CONFIG.get("keys", [])
         self.assertIsInstance(keys, list)
 
+    def test_admin_jwt_roundtrip(self):
+        """测试 Admin JWT 签发后可验证，篡改或过期的 token 被拒绝"""
+        from routes.admin.auth import create_jwt_token, verify_jwt_token
+
+        token = create_jwt_token(1)
+        payload = verify_jwt_token(token)
+        self.assertEqual(payload["role"], "admin")
+        self.assertEqual(payload["exp"] - payload["iat"], 3600)
+
+        header, body, sig = token.split(".")
+        forged = f"{header}.{body}.{'A' if sig[0] != 'A' else 'B'}{sig[1:]}"
+        with self.assertRaises(ValueError):
+            verify_jwt_token(forged)
+        with self.assertRaises(ValueError):
+            verify_jwt_token(create_jwt_token(-1))
+
+    def test_admin_jwt_cache_checks_expiry(self):
+        """测试已缓存的 token 命中时仍校验过期时间"""
+        import time
+        from unittest import mock
+        from routes.admin import auth
+
+        token = auth.create_jwt_token(1)
+        payload = auth.verify_jwt_token(token)
+        self.assertIn(token, auth._verified_tokens)
+        self.assertIs(auth.verify_jwt_token(token), payload)
+
+        with mock.patch.object(auth.time, "time", return_value=time.time() + 7200):
+            with self.assertRaises(ValueError):
+                auth.verify_jwt_token(token)
+        self.assertNotIn(token, auth._verified_tokens)
+
+    def test_verify_admin_accepts_key_and_jwt(self):
+        """测试 verify_admin 同时接受直接 admin key 与 JWT，拒绝错误凭证"""
+        from fastapi import HTTPException
+        from fastapi.security import HTTPAuthorizationCredentials
+        from routes.admin import auth
+
+        def creds(token):
+            return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+        self.assertEqual(auth.verify_admin(creds(auth.ADMIN_KEY)), {"admin_key": True})
+        self.assertEqual(auth.verify_admin(creds(auth.create_jwt_token(1)))["role"], "admin")
+        self.assertFalse(auth._is_admin_key(123))
+        with self.assertRaises(HTTPException):
+            auth.verify_admin(creds(auth.ADMIN_KEY + "x"))
+
+
+class TestAccountPool(unittest.TestCase):
+    """账号池轮询测试"""
+
+    def setUp(self):
+        from core.config import CONFIG
+        from core import auth
+
+        self._saved_accounts = CONFIG.get("accounts")
+        CONFIG["accounts"] = [
+            {"email": "a@example.com", "password": "x", "token": ""},
+            {"email": "b@example.com", "password": "x", "token": "tok-b"},
+            {"email": "c@example.com", "password": "x", "token": "tok-c"},
+        ]
+        auth.init_account_queue()
+
+    def tearDown(self):
+        from core.config import CONFIG
+        from core import auth
+
+        if self._saved_accounts is None:
+            CONFIG.pop("accounts", None)
+        else:
+            CONFIG["accounts"] = self._saved_accounts
+        auth.init_account_queue()
+
+    def test_prefers_tokened_accounts(self):
+        """测试优先选择已有 token 的账号，且同一账号不会被重复选中"""
+        from core.auth import choose_new_account
+
+        first = choose_new_account()
+        second = choose_new_account()
+        self.assertTrue(first["token"])
+        self.assertTrue(second["token"])
+        self.assertIsNot(first, second)
+
+        # 有 token 的账号用完后才选择需要登录的账号
+        third = choose_new_account()
+        self.assertEqual(third["email"], "a@example.com")
+        self.assertIsNone(choose_new_account())
+
+    def test_exclude_and_release(self):
+        """测试排除已尝试账号以及释放后可再次选择"""
+        from core.auth import choose_new_account, release_account, get_queue_status
+
+        acc = choose_new_account(exclude_ids=["b@example.com"])
+        self.assertEqual(acc["email"], "c@example.com")
+        self.assertEqual(get_queue_status()["in_use"], 1)
+
+        release_account(acc)
+        status = get_queue_status()
+        self.assertEqual(status["in_use"], 0)
+        self.assertEqual(status["available"], 3)
+
+        again = choose_new_account(exclude_ids=["b@example.com"])
+        self.assertEqual(again["email"], "c@example.com")
+        release_account(again)
+
+    def test_login_promotes_to_tokened(self):
+        """测试无 token 账号登录后释放，会进入有 token 队列"""
+        from core.auth import choose_new_account, release_account
+
+        acc = choose_new_account(exclude_ids=["b@example.com", "c@example.com"])
+        self.assertEqual(acc["email"], "a@example.com")
+        acc["token"] = "tok-a"  # 模拟登录成功
+        release_account(acc)
+
+        picked = [choose_new_account() for _ in range(3)]
+        self.assertTrue(all(p["token"] for p in picked))
+        self.assertEqual(picked[-1]["email"], "a@example.com")
+
 
 class TestRegexPatterns(unittest.TestCase):
     """正则表达式测试"""
@@ -241,6 +625,103 @@ class TestRegexPatterns(unittest.TestCase):
 class TestStreamParsing(unittest.TestCase):
     """流式响应解析测试"""
 
+    def test_parse_deepseek_sse_line(self):
+        """测试 SSE 行解析：非 data 行跳过，[DONE] 与 UTF-8 JSON 正确处理"""
+        from core.sse_parser import parse_deepseek_sse_line
+
+        self.assertIsNone(parse_deepseek_sse_line(b""))
+        self.assertIsNone(parse_deepseek_sse_line(b": keep-alive"))
+        self.assertEqual(parse_deepseek_sse_line(b"data: [DONE]"), {"type": "done"})
+        self.assertEqual(parse_deepseek_sse_line('data: {"v": "你好"}'.encode("utf-8")), {"v": "你好"})
+        self.assertIsNone(parse_deepseek_sse_line(b"data: {broken"))
+
+    def test_should_skip_chunk(self):
+        """测试状态类路径被跳过，内容路径保留"""
+        from core.sse_parser import should_skip_chunk
+
+        for path in ("response/search_status", "response/quasi_status",
+                     "response/fragments/-1/status", "response/conversation_mode"):
+            self.assertTrue(should_skip_chunk(path), path)
+        for path in ("", "response/content", "response/fragments/-1/content", "status"):
+            self.assertFalse(should_skip_chunk(path), path)
+
+    def test_iter_sse_lines_across_chunks(self):
+        """测试跨网络块的行被正确拼接"""
+        from core.sse_parser import iter_sse_lines
+
+        class FakeResponse:
+            def iter_content(self):
+                return iter([b'data: {"v"', b': "a"}\n\nda', b"ta: [DONE]", b"\n", b"tail"])
+
+        self.assertEqual(
+            list(iter_sse_lines(FakeResponse())),
+            [b'data: {"v": "a"}', b"", b"data: [DONE]", b"tail"],
+        )
+
+    def test_iter_sse_events_across_chunks(self):
+        """测试按空行切分事件，分隔符跨网络块时也能正确切分"""
+        from core.sse_parser import iter_sse_events
+
+        class FakeResponse:
+            def iter_content(self):
+                return iter([
+                    b'data: {"v": "a"}\n',
+                    b'\ndata: {"v"',
+                    b': "b"}\n\n: keep-alive\n\nevent: x\ndata: 1\ndata: 2\n\n',
+                    b"data: [DONE]",
+                ])
+
+        self.assertEqual(
+            list(iter_sse_events(FakeResponse())),
+            [b'{"v": "a"}', b'{"v": "b"}', None, b"1", b"2", b"[DONE]"],
+        )
+
+    def test_iter_sse_events_crlf(self):
+        """测试 CRLF 分帧的事件同样按空行切分，\\r\\n 跨网络块时也能正确切分"""
+        from core.sse_parser import iter_sse_events
+
+        class FakeResponse:
+            def iter_content(self):
+                return iter([
+                    b'data: {"v": "a"}\r\n\r\n',
+                    b'data: {"v": "b"}\r\n\r',
+                    b'\n: keep-alive\r\n\r\nevent: x\r\ndata: 1\r',
+                    b"\ndata: 2\r\n\r\ndata: [DONE]\r\n",
+                ])
+
+        self.assertEqual(
+            list(iter_sse_events(FakeResponse())),
+            [b'{"v": "a"}', b'{"v": "b"}', None, b"1", b"2", b"[DONE]"],
+        )
+
+    def test_iter_classified_events(self):
+        """测试按内容类型分类产出事件"""
+        from core.sse_parser import iter_classified_events
+
+        class FakeResponse:
+            def iter_content(self):
+                return iter([
+                    b'data: {"p": "response/thinking_content", "v": "think"}\n\n',
+                    b": keep-alive\n\n",
+                    b'data: {"p": "response/search_status", "v": "x"}\n\n',
+                    b'data: {"p": "response/content", "v": "he"}\n\n',
+                    b'data: {"v": "llo"}\n\n',
+                    b'data: {"p": "response", "v": [{"p": "status", "v": "FINISHED"}]}\n\n',
+                    b'data: {"v": "ignored"}\n\n',
+                ])
+
+        self.assertEqual(
+            list(iter_classified_events(FakeResponse())),
+            [
+                ("thinking", "think"),
+                ("ping", ""),
+                ("ping", ""),
+                ("text", "he"),
+                ("text", "llo"),
+                ("finished", ""),
+            ],
+        )
+
     def test_parse_simple_string_content(self):
         """测试简单字符串内容解析"""
         # 模拟 DeepSeek V3 的简单字符串格式
@@ -529,6 +1010,58 @@ class TestToolCallParsing(unittest.TestCase):
         # 应该返回空列表而不是抛出异常
         self.assertEqual(result, [])
 
+    def test_detect_tool_call_prefix(self):
+        """测试流式输出开头的工具调用判定"""
+        from core.sse_parser import detect_tool_call_prefix
+
+        self.assertTrue(detect_tool_call_prefix('{"tool_calls": ['))
+        self.assertTrue(detect_tool_call_prefix("\n{ 'tool_calls' :"))
+        self.assertFalse(detect_tool_call_prefix("好的，我来帮你查询"))
+        self.assertFalse(detect_tool_call_prefix('{"answer": 1}'))
+        # 开头不足以判断时返回 None，由调用方继续缓冲
+        self.assertIsNone(detect_tool_call_prefix("  "))
+        self.assertIsNone(detect_tool_call_prefix('{"tool'))
+
+    def test_tool_call_stream_parser(self):
+        """测试工具调用逐对象增量解析"""
+        from core.sse_parser import ToolCallStreamParser
+
+        text = (
+            '{"tool_calls": [{"name": "search", "input": {"q": "a}\\"]{", "n": [1, {"x": 2}]}}, '
+            '{"name": "unknown", "input": {}}, {"name": "get_time", "input": {}}]}'
+        )
+        parser = ToolCallStreamParser([{"name": "search"}, {"name": "get_time"}])
+        emitted = []
+        for i in range(0, len(text), 3):
+            emitted.append(parser.feed(text[i:i + 3]))
+
+        tools = [tool for batch in emitted for tool in batch]
+        self.assertEqual([tool["name"] for tool in tools], ["search", "get_time"])
+        self.assertEqual(tools[0]["input"], {"q": 'a}"]{', "n": [1, {"x": 2}]})
+        # 第一个工具在后续内容到达前就已产出
+        first_batch = next(i for i, batch in enumerate(emitted) if batch)
+        self.assertLess(first_batch, len(emitted) - 1)
+        self.assertTrue(parser.done)
+        self.assertEqual(parser.found, 2)
+
+
+    def test_tool_call_text_gate(self):
+        """测试正文闸门：说明文字放行，工具调用 JSON 从 "{" 起交给工具解析"""
+        from core.sse_parser import ToolCallTextGate
+
+        gate = ToolCallTextGate()
+        self.assertEqual(gate.feed("Sure, {x} checking.\n{"), ("Sure, {x} checking.\n", ""))
+        self.assertEqual(gate.feed(' "tool'), ("", ""))
+        self.assertEqual(gate.feed('_calls": ['), ("", '{ "tool_calls": ['))
+        self.assertEqual(gate.feed("{}]}"), ("", "{}]}"))
+        self.assertEqual(gate.tool_text, '{ "tool_calls": [{}]}')
+
+        # 扣住的 "{" 最终不是工具调用时连同后文一起放行，结束时取回剩余部分
+        gate = ToolCallTextGate()
+        self.assertEqual(gate.feed("a {"), ("a ", ""))
+        self.assertEqual(gate.feed('"b": 1} {"to'), ('{"b": 1} ', ""))
+        self.assertEqual(gate.flush(), '{"to')
+        self.assertIsNone(gate.tool_text)
 
 class TestTokenEstimation(unittest.TestCase):
     """Token 估算测试"""
@@ -556,6 +1089,165 @@ class TestTokenEstimation(unittest.TestCase):
         result = estimate_tokens(content)
         self.assertGreater(result, 0)
 
+    def test_estimate_tokens_nested_list(self):
+        """测试嵌套列表按片段逐项估算"""
+        from core.utils import estimate_tokens
+        
+        content = [
+            {"text": "12345678"},
+            {"text": [{"text": "abcd"}, {"text": ""}]},
+            {"type": "image_url"},
+            ["xy"],
+            42,
+        ]
+        # 2 + (1 + 1) + 1 + len("['xy']")//4 + 1
+        self.assertEqual(estimate_tokens(content), 7)
+        self.assertEqual(estimate_tokens([]), 0)
+
+
+class TestResponseCache(unittest.TestCase):
+    """响应缓存测试"""
+
+    def test_ttl_cache_expiry_and_eviction(self):
+        """测试过期条目读取时失效，超出容量淘汰最早条目"""
+        import time
+        from core.response_cache import TTLCache
+
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual((cache.get("b"), cache.get("c")), (2, 3))
+
+        cache = TTLCache(maxsize=2, ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_response_cache_key(self):
+        """测试缓存键与字典键顺序无关，内容不同则不同"""
+        from core.response_cache import response_cache_key
+
+        key = response_cache_key("m", [{"role": "user", "content": "hi"}])
+        self.assertEqual(key, response_cache_key("m", [{"content": "hi", "role": "user"}]))
+        self.assertNotEqual(key, response_cache_key("m", [{"role": "user", "content": "hello"}]))
+        self.assertNotEqual(key, response_cache_key("n", [{"role": "user", "content": "hi"}]))
+
+
+class TestClaudeStream(unittest.TestCase):
+    """Claude 流式输出测试"""
+
+    def _stream_response(self, chunks, tools=None):
+        """用伪造的上游响应跑一次流式请求，返回原始响应文本；chunks 中的数字表示上游静默的秒数"""
+        import asyncio
+        from unittest import mock
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+        from routes import claude
+
+        class FakeResponse:
+            status_code = 200
+
+            async def aiter_content(self):
+                for chunk in chunks:
+                    if isinstance(chunk, float):
+                        await asyncio.sleep(chunk)
+                    else:
+                        yield chunk
+
+            async def aclose(self):
+                pass
+
+        async def fake_determine(request):
+            request.state.use_config_token = False
+
+        body = {"model": "claude-sonnet-4-20250514", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+        if tools:
+            body["tools"] = tools
+        app = FastAPI()
+        app.include_router(claude.router)
+        with mock.patch.object(claude, "determine_mode_and_token", fake_determine), \
+                mock.patch.object(claude, "call_claude_via_openai", mock.AsyncMock(return_value=FakeResponse())):
+            return TestClient(app).post("/anthropic/v1/messages", json=body).text
+
+    def _stream_events(self, chunks, tools=None):
+        """跑一次流式请求，返回解析后的 SSE 事件"""
+        text = self._stream_response(chunks, tools)
+        return [json.loads(line[5:]) for line in text.split("\n") if line.startswith("data:")]
+
+    def _content_blocks(self, events):
+        """按 content_block 事件还原每个块：文本块拼出完整文本，工具块取名称与参数"""
+        blocks = {}
+        for event in events:
+            if event["type"] == "content_block_start":
+                blocks[event["index"]] = dict(event["content_block"])
+            elif event["type"] == "content_block_delta":
+                blocks[event["index"]]["text"] += event["delta"]["text"]
+        return [blocks[i] for i in sorted(blocks)]
+
+    def test_tool_call_after_preamble(self):
+        """测试工具调用前有说明文字时，只发出说明文字和一次工具调用"""
+        tools = [{"name": "get_weather", "input_schema": {"type": "object"}}]
+        events = self._stream_events([
+            b'data: {"p": "response/content", "v": "Sure, checking.\\n{\\"tool"}\n\n',
+            b'data: {"v": "_calls\\": [{\\"name\\": \\"get_weather\\", "}\n\n',
+            b'data: {"v": "\\"input\\": {\\"city\\": \\"Paris\\"}}]}"}\n\n',
+            b'data: {"p": "response/status", "v": "FINISHED"}\n\n',
+        ], tools)
+
+        blocks = self._content_blocks(events)
+        self.assertEqual([block["type"] for block in blocks], ["text", "tool_use"])
+        self.assertEqual(blocks[0]["text"], "Sure, checking.\n")
+        self.assertEqual((blocks[1]["name"], blocks[1]["input"]), ("get_weather", {"city": "Paris"}))
+        self.assertEqual(events[-2]["delta"]["stop_reason"], "tool_use")
+
+    def test_tool_call_after_thinking(self):
+        """测试思考内容之后的工具调用不会被当成文本发出"""
+        tools = [{"name": "get_weather", "input_schema": {"type": "object"}}]
+        events = self._stream_events([
+            b'data: {"p": "response/thinking_content", "v": "need weather"}\n\n',
+            b'data: {"p": "response/content", "v": "{\\"tool_calls\\": [{\\"name\\": \\"get_weather\\", "}\n\n',
+            b'data: {"v": "\\"input\\": {}}]}"}\n\n',
+            b'data: {"p": "response/status", "v": "FINISHED"}\n\n',
+        ], tools)
+
+        blocks = self._content_blocks(events)
+        self.assertEqual([block["type"] for block in blocks], ["text", "tool_use"])
+        self.assertEqual(blocks[0]["text"], "need weather")
+        self.assertEqual(blocks[1]["name"], "get_weather")
+        self.assertEqual(events[-2]["delta"]["stop_reason"], "tool_use")
+
+    def test_text_with_braces_is_streamed(self):
+        """测试声明了工具但输出普通文本时，含花括号的文本原样发出"""
+        tools = [{"name": "get_weather", "input_schema": {"type": "object"}}]
+        events = self._stream_events([
+            b'data: {"p": "response/content", "v": "use {x} or {"}\n\n',
+            b'data: {"v": "\\"tool"}\n\n',
+            b'data: {"p": "response/status", "v": "FINISHED"}\n\n',
+        ], tools)
+
+        blocks = self._content_blocks(events)
+        self.assertEqual(blocks, [{"type": "text", "text": 'use {x} or {"tool'}])
+        self.assertEqual(events[-2]["delta"]["stop_reason"], "end_turn")
+
+    def test_keepalive_while_upstream_silent(self):
+        """测试上游静默期间也会按保活周期发送注释行"""
+        from unittest import mock
+        from routes import claude
+
+        with mock.patch.object(claude, "KEEP_ALIVE_TIMEOUT", 0.05):
+            text = self._stream_response([
+                0.3,
+                b'data: {"p": "response/content", "v": "hi"}\n\n',
+                b'data: {"p": "response/status", "v": "FINISHED"}\n\n',
+            ])
+
+        # 静默期间每个保活周期都会发送，而不是等到上游事件到达时才补发一次
+        self.assertGreaterEqual(text[:text.index("content_block_start")].count(": keep-alive"), 2)
+        self.assertIn('"text":"hi"', text)
+
 
 if __name__ == "__main__":
     # 设置环境变量避免配置警告